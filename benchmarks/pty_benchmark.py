@@ -0,0 +1,76 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+"""Compare waiting for the prompt after commands with large outputs, e.g.,
+``info sharedlibrary`` or printing a big array, using ``PtyProcess`` and
+pexpect (which mdb used before).
+
+Run from the top-level directory with pexpect installed::
+
+    $ python benchmarks/pty_benchmark.py
+"""
+
+import asyncio
+import shlex
+import sys
+import time
+
+import click
+import pexpect  # type: ignore
+
+from mdb.pty_process import PtyProcess
+
+# prints a prompt and then, for each line typed, that many lines of output
+FAKE_DEBUGGER = """
+while True:
+    lines = int(input("(gdb) "))
+    print("".join(f"{i} = 0x{i:016x} <some_symbol+{i}>\\n" for i in range(lines)), end="")
+"""
+COMMAND = f"{sys.executable} -c {shlex.quote(FAKE_DEBUGGER)}"
+PROMPT = r"\(gdb\)"
+
+
+async def time_pty_process(lines: int, repeat: int) -> float:
+    proc = await PtyProcess.spawn(COMMAND)
+    await proc.expect(PROMPT)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        proc.sendline(str(lines))
+        await proc.expect(PROMPT)
+    elapsed = time.perf_counter() - start
+    proc.sendline("quit")
+    await proc.expect(PROMPT, eof=True)
+    await proc.wait()
+    return elapsed / repeat
+
+
+async def time_pexpect(lines: int, repeat: int) -> float:
+    proc = pexpect.spawn(COMMAND, timeout=None)
+    proc.expect(PROMPT)
+    start = time.perf_counter()
+    for _ in range(repeat):
+        proc.sendline(str(lines))
+        await proc.expect(PROMPT, async_=True)
+    elapsed = time.perf_counter() - start
+    proc.close(force=True)
+    return elapsed / repeat
+
+
+@click.command()
+@click.option(
+    "--lines",
+    default="100,1000,10000,100000",
+    show_default=True,
+    help="Comma separated numbers of lines of output per command.",
+)
+@click.option("--repeat", default=5, show_default=True, help="Commands per size.")
+def main(lines: str, repeat: int) -> None:
+    print(f"{'lines':>8} {'pexpect (s)':>12} {'pty (s)':>12} {'speedup':>8}")
+    for count in map(int, lines.split(",")):
+        slow = asyncio.run(time_pexpect(count, repeat))
+        fast = asyncio.run(time_pty_process(count, repeat))
+        print(f"{count:>8} {slow:>12.4f} {fast:>12.4f} {slow / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,16 +4,17 @@
 import asyncio
 import logging
 import os
+import random
 import ssl
 from abc import ABC
 from socket import gethostbyaddr
 from typing import Optional
 
-from typing_extensions import TypedDict
+from typing_extensions import NotRequired, TypedDict
 
 from .async_connection import AsyncConnection
 from .messages import Message
-from .utils import ssl_cert_path, ssl_key_path
+from .utils import exchange_socket_path, is_local_host, ssl_cert_path, ssl_key_path
 
 logger = logging.getLogger(__name__)
 
@@ -23,9 +24,33 @@ AsyncClientOpts = TypedDict(
         "exchange_hostname": str,
         "exchange_port": int,
         "connection_attempts": int,
+        "connection_backoff": NotRequired[float],
+        "connection_backoff_max": NotRequired[float],
     },
 )
 
+CONNECTION_BACKOFF = 0.5  # seconds before the first retry
+CONNECTION_BACKOFF_MAX = 8.0  # seconds
+
+
+def backoff_delay(attempt: int, base: float, cap: float) -> float:
+    """Delay before retrying a failed connection, using exponential backoff
+    with "equal jitter" so that thousands of clients that failed at the same
+    time don't all retry at the same time, while each client still waits at
+    least half of the backoff (e.g., for the exchange server to start).
+
+    Args:
+        attempt: number of failed attempts so far (starting at 1).
+        base: upper limit of the first delay in seconds.
+        cap: maximum delay in seconds.
+
+    Returns:
+        A random delay between half of and all of
+        ``min(cap, base * 2**(attempt - 1))``.
+    """
+    limit: float = min(cap, base * 2 ** (attempt - 1))
+    return limit / 2 + random.uniform(0, limit / 2)
+
 
 class AsyncClient(ABC):
     def __init__(self, opts: AsyncClientOpts):
@@ -41,6 +66,10 @@ class AsyncClient(ABC):
         self.exchange_hostname = opts["exchange_hostname"]
         self.exchange_port = opts["exchange_port"]
         self.connection_attempts = opts["connection_attempts"]
+        self.connection_backoff = opts.get("connection_backoff", CONNECTION_BACKOFF)
+        self.connection_backoff_max = opts.get(
+            "connection_backoff_max", CONNECTION_BACKOFF_MAX
+        )
 
     def _init_tls(self) -> None:
         context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
@@ -57,7 +86,27 @@ class AsyncClient(ABC):
 
         self.context = context
 
+    def _local_socket_path(self) -> Optional[str]:
+        """Path of the exchange server's Unix domain socket if it runs on this
+        host (see ``AsyncExchangeServer.start_server``), else None."""
+        if os.environ.get("MDB_DISABLE_LOCAL_SOCKET", None):
+            return None
+        if not is_local_host(self.exchange_hostname):
+            return None
+        path = exchange_socket_path(self.exchange_port)
+        return path if os.path.exists(path) else None
+
     async def init_connection(self) -> None:
+        path = self._local_socket_path()
+        if path is not None:
+            try:
+                reader, writer = await asyncio.open_unix_connection(path)
+                self.conn = AsyncConnection(reader, writer)
+                logger.info("connected to exchange over local socket [%s]", path)
+                return
+            except (ConnectionRefusedError, FileNotFoundError):
+                # left behind by an exchange server that has gone away
+                logger.info("local socket [%s] is not accepting connections", path)
         try:
             cert_host = gethostbyaddr(self.exchange_hostname)[0]
             reader, writer = await asyncio.open_connection(
@@ -79,16 +128,22 @@ class AsyncClient(ABC):
                 logger.info("connected to exchange")
                 await self.conn.send_message(msg)
                 msg = await self.conn.recv_message()
+                # switch to whatever wire format the exchange server picked
+                self.conn.wire_format = msg.data.get("wire_format", "json")
                 break
             except Exception:
-                await asyncio.sleep(1)
                 attempts += 1
+                delay = backoff_delay(
+                    attempts, self.connection_backoff, self.connection_backoff_max
+                )
                 logger.exception("Failed to connect")
                 logger.info(
-                    "Attempt %d/%d to connect to exchange server. Sleeping 1 second...",
+                    "Attempt %d/%d to connect to exchange server. Sleeping %.2f seconds...",
                     attempts,
                     self.connection_attempts,
+                    delay,
                 )
+                await asyncio.sleep(delay)
         return msg
 
     async def close(self) -> None:
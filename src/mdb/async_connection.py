@@ -3,12 +3,22 @@
 
 import asyncio
 import logging
+from typing import Optional
+
 from .messages import Message
 
 logger = logging.getLogger(__name__)
 
 
 class AsyncConnection:
+    """Length-prefixed messages over a stream.
+
+    Once ``multiplex`` has been called, a task reads every incoming message
+    and hands replies to the request they belong to (see
+    ``Message.request_id``), so that several requests can be in flight at
+    once and be answered in any order.
+    """
+
     def __init__(
         self,
         reader: asyncio.StreamReader,
@@ -18,22 +28,43 @@ class AsyncConnection:
         self.writer = writer
         self.num_bytes = 8  # number of bytes used to represent int
         self.type = ""
+        # every connection starts out as json until the handshake agrees on
+        # something more compact (see `Message.debug_conn_request`)
+        self.wire_format = "json"
+        self.next_request_id = 0
+        # replies of each request in flight, None once the connection is lost
+        self.pending: dict[int, asyncio.Queue[Optional[Message]]] = {}
+        # messages that aren't replies, e.g., `exchange_info`
+        self.unsolicited: asyncio.Queue[Optional[Message]] = asyncio.Queue()
+        self.dispatcher: Optional[asyncio.Task[None]] = None
+        self.error: Optional[Exception] = None
+
+    async def _read_message(self) -> "Message":
+        length_in_bytes = await self.reader.readexactly(self.num_bytes)
+        length = int.from_bytes(length_in_bytes, byteorder="big", signed=False)
+        raw_msg = await self.reader.readexactly(length)
+        msg = Message.decode(raw_msg, self.wire_format)
+        logger.debug("msg received [%s]", msg.msg_type)
+        return msg
 
     async def recv_message(self) -> "Message":
+        """Receive the next message, or the next message that isn't a reply
+        to a request if the connection is multiplexed."""
+        if self.dispatcher is not None:
+            msg = await self.unsolicited.get()
+            if msg is None:
+                assert self.error is not None
+                raise self.error
+            return msg
         try:
-            length_in_bytes = await self.reader.readexactly(self.num_bytes)
-            length = int.from_bytes(length_in_bytes, byteorder="big", signed=False)
-            raw_msg = await self.reader.readexactly(length)
+            return await self._read_message()
         except Exception as e:
             logger.exception("async read error")
             raise e
-        msg = Message.from_json(raw_msg)
-        logger.debug("msg received [%s]", msg.msg_type)
-        return msg
 
     async def send_message(self, msg: Message) -> None:
         try:
-            data = msg.to_json()
+            data = msg.encode(self.wire_format)
             length_header = len(data).to_bytes(
                 self.num_bytes, byteorder="big", signed=False
             )
@@ -47,3 +78,62 @@ class AsyncConnection:
             raise e
         logger.debug("sent message [%s]", msg.msg_type)
         return
+
+    def multiplex(self) -> None:
+        """Start handing incoming messages to the request they reply to."""
+        if self.dispatcher is None:
+            self.dispatcher = asyncio.create_task(self._dispatch())
+
+    async def _dispatch(self) -> None:
+        try:
+            while True:
+                msg = await self._read_message()
+                request_id = msg.request_id
+                if request_id is None:
+                    await self.unsolicited.put(msg)
+                elif request_id in self.pending:
+                    await self.pending[request_id].put(msg)
+                else:
+                    logger.warning(
+                        "discarding [%s] for finished request [%d]",
+                        msg.msg_type,
+                        request_id,
+                    )
+        except Exception as e:
+            logger.debug("connection closed: %s", e)
+            # wake up everyone waiting on this connection
+            self.error = e
+            for queue in self.pending.values():
+                queue.put_nowait(None)
+            self.unsolicited.put_nowait(None)
+
+    async def request(self, msg: Message) -> int:
+        """Send a request whose replies can be received with ``recv_reply``.
+
+        Args:
+            msg: the request, it is tagged with a new request id.
+
+        Returns:
+            The request id. Pass it to ``end_request`` after the last reply.
+        """
+        self.multiplex()
+        self.next_request_id += 1
+        request_id = self.next_request_id
+        self.pending[request_id] = asyncio.Queue()
+        if self.error is not None:
+            self.pending[request_id].put_nowait(None)
+        await self.send_message(msg.with_request_id(request_id))
+        return request_id
+
+    async def recv_reply(self, request_id: int) -> "Message":
+        """Receive the next reply to a request (see ``request``)."""
+        msg = await self.pending[request_id].get()
+        if msg is None:
+            assert self.error is not None
+            raise self.error
+        return msg
+
+    def end_request(self, request_id: int) -> None:
+        """Stop waiting for replies to a request, any that still arrive are
+        discarded."""
+        self.pending.pop(request_id, None)
@@ -2,10 +2,23 @@
 # details.
 
 from abc import ABC, abstractmethod
-from typing import Dict, Type
+from collections.abc import Mapping
+from importlib import metadata
+from typing import Iterator, Optional, Type
 import importlib.util
 import os
-import glob
+
+# the most common gdb error messages, errors start at the beginning of a line
+GDB_ERROR_REGEX = (
+    r"(?m)^(No symbol .* in current context\.|No symbol table is loaded\."
+    r"|Cannot access memory at address|The program is not being run\."
+    r"|No frame selected\.|Undefined command: |A syntax error in expression"
+    r"|Function \".*\" not defined\.|No source file named|No breakpoint number)"
+)
+
+# function of each frame printed by gdb's `bt`, e.g., `#1  0x... in main () at
+# test.c:5`. Frames without a function (e.g., signal handlers) are skipped
+GDB_FRAME_REGEX = r"(?m)^#\d+\s+(?:0x[0-9a-fA-F]+ in )?(.+?) \("
 
 
 class DebugBackend(ABC):
@@ -49,32 +62,121 @@ class DebugBackend(ABC):
     def runtime_options(self, opts: dict[str, str]) -> list[str]:
         pass
 
+    @property
+    def multi_inferior(self) -> bool:
+        """True if one debugger process can debug several ranks as separate
+        inferiors, selected with ``inferior N``."""
+        return False
 
-backends: Dict[str, Type[DebugBackend]] = {}
-
+    @property
+    def error_regex(self) -> Optional[str]:
+        """Regular expression that matches the debugger's error messages,
+        used to stop batches of commands early (see
+        ``DebugClient.execute_batch``). None if errors can't be detected."""
+        return None
 
-def load_plugins() -> None:
-    plugin_dir = os.path.join(os.path.dirname(__file__), "plugins")
-    if not os.path.exists(plugin_dir):
-        return  # no plugin exist
+    @property
+    def frame_regex(self) -> Optional[str]:
+        """Regular expression whose first group is the function of a frame in
+        the output of ``bt``, used to merge backtraces (see ``stacks``). None
+        if backtraces can't be parsed."""
+        return None
 
-    for file in glob.glob(os.path.join(plugin_dir, "*.py")):
-        module_name = os.path.splitext(os.path.basename(file))[0]
-        spec = importlib.util.spec_from_file_location(module_name, file)
+    @property
+    def machine_interface(self) -> bool:
+        """True if the debugger is driven through GDB/MI (see ``gdb_mi``)
+        rather than its command line interface."""
+        return False
+
+    def structured_query(self, command: str) -> Optional[str]:
+        """MI command that returns the output of ``command`` as structured
+        values (e.g., the frames of a backtrace). Only used by backends with
+        a ``machine_interface``.
+
+        Args:
+            command: CLI command run by the user.
+
+        Returns:
+            The MI command, or None if there is no structured equivalent.
+        """
+        return None
+
+
+class BackendRegistry(Mapping[str, Type[DebugBackend]]):
+    """Debug backends by name, e.g., ``backends["gdb"]``.
+
+    Names are found without importing any backend. Built-in backends are
+    named after their file in ``plugins/``, and other packages can add
+    backends with entry points in the ``mdb.backends`` group. Each backend is
+    only imported the first time it is looked up, so a process only pays for
+    the backend it uses.
+    """
+
+    def __init__(self, plugin_dir: str, group: str = "mdb.backends") -> None:
+        self.plugin_dir = plugin_dir
+        self.group = group
+        self._backends: dict[str, Type[DebugBackend]] = {}
+        self._plugin_files: Optional[dict[str, str]] = None
+        self._entry_points: Optional[dict[str, metadata.EntryPoint]] = None
+
+    def plugin_files(self) -> dict[str, str]:
+        if self._plugin_files is None:
+            files = []
+            if os.path.isdir(self.plugin_dir):
+                files = sorted(os.listdir(self.plugin_dir))
+            self._plugin_files = {
+                os.path.splitext(file)[0]: os.path.join(self.plugin_dir, file)
+                for file in files
+                if file.endswith(".py")
+            }
+        return self._plugin_files
+
+    def entry_points(self) -> dict[str, metadata.EntryPoint]:
+        # scanning installed packages is slow so only do it when a backend
+        # isn't built-in
+        if self._entry_points is None:
+            self._entry_points = {
+                entry_point.name: entry_point
+                for entry_point in metadata.entry_points(group=self.group)
+            }
+        return self._entry_points
+
+    def _load_plugin(self, name: str, file: str) -> Type[DebugBackend]:
+        spec = importlib.util.spec_from_file_location(name, file)
         if spec is None or spec.loader is None:  # handle None case
-            continue
+            raise ImportError(f"cannot load backend plugin [{file}]")
         module = importlib.util.module_from_spec(spec)
         spec.loader.exec_module(module)
 
-        # check if module defines a DebugBackend subclass, then store it in backends dictionary
-        for attr in dir(module):
-            cls = getattr(module, attr)
+        # find the DebugBackend subclass that the module defines
+        for cls in vars(module).values():
             if (
                 isinstance(cls, type)
                 and issubclass(cls, DebugBackend)
-                and cls is not DebugBackend
+                and cls.__module__ == module.__name__
             ):
-                backends[cls().name] = cls
+                return cls
+        raise ImportError(f"no DebugBackend found in plugin [{file}]")
+
+    def __getitem__(self, name: str) -> Type[DebugBackend]:
+        if name not in self._backends:
+            if name in self.plugin_files():
+                cls = self._load_plugin(name, self.plugin_files()[name])
+            elif name in self.entry_points():
+                cls = self.entry_points()[name].load()
+            else:
+                raise KeyError(name)
+            self._backends[name] = cls
+        return self._backends[name]
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.plugin_files() or name in self.entry_points()
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(sorted({*self.plugin_files(), *self.entry_points()}))
+
+    def __len__(self) -> int:
+        return len({*self.plugin_files(), *self.entry_points()})
 
 
-load_plugins()
+backends = BackendRegistry(os.path.join(os.path.dirname(__file__), "plugins"))
@@ -2,17 +2,25 @@
 # details.
 
 import asyncio
+import functools
+import json
 import logging
 import re
 import shutil
-from typing import Any, Optional
-
-import pexpect  # type: ignore
+import socket
+from collections import defaultdict
+from typing import Any, Callable, Coroutine, Optional
 
 from .async_client import AsyncClient
 from .backend import backends
-from .messages import Message
-from .utils import strip_bracketted_paste
+from .gdb_mi import MISession, console_command, parse_record
+from .messages import FABRIC_REQUESTS, Message
+from .pty_process import PtyProcess
+from .rank_set import RankSet
+from .stacks import UNKNOWN_FRAME, build_tree, fold_stack, parse_backtrace
+from .trace import TRACE_MARKER, TraceBuffer, trace_buffer_size
+from .reduction import partial_reduction
+from .utils import extract_float, extract_truth, strip_bracketted_paste
 
 logger = logging.getLogger(__name__)
 
@@ -24,7 +32,27 @@ class DebugClient(AsyncClient):
         self.target = opts["target"]
         self.stdout = opts["redirect_stdout"]
         self.args = opts["args"]
-        self.is_running = False
+        # debug process of each local rank. Normally this is just `myrank`
+        # but a node wrapper (see `node_wrapper`) debugs every rank on its node
+        self.dbg_procs: dict[int, PtyProcess] = {}
+        # MI sessions of each local rank if the backend uses GDB/MI
+        self.mi_sessions: dict[int, MISession] = {}
+        # commands that are running and the local ranks they selected, so
+        # that interrupts can reply in their place (see `interrupt`)
+        self.running: dict[asyncio.Task[None], tuple[Message, list[int]]] = {}
+        # commands on the same rank run one at a time
+        self.rank_locks: defaultdict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        # hits of trace probes (see `trace`) collected on each local rank
+        self.traces: dict[int, TraceBuffer] = {}
+        # requests that run in the background (see `start_command`)
+        self.handlers: dict[str, Callable[[Message], Coroutine[Any, Any, None]]] = {
+            "mdb_command_request": self.execute_command,
+            "mdb_batch_request": self.execute_batch,
+            "mdb_stacks_request": self.execute_stacks,
+            "mdb_profile_request": self.execute_profile,
+            "mdb_predicate_request": self.evaluate_predicate,
+            "mdb_reduce_request": self.evaluate_reduction,
+        }
 
         backend_name = opts["backend"].lower()
         if backend_name in backends:
@@ -33,10 +61,25 @@ class DebugClient(AsyncClient):
             raise ValueError(f"Debugger backend is not supported: {backend_name}")
 
         self.runtimeOptions = self.backend.runtime_options(opts=opts)
+        self.runtimeOptions += self.backend.default_options
 
         logger.debug("Selected backend: %s", self.backend.name)
 
-    async def init_debug_proc(self) -> None:
+    async def init_debug_proc(
+        self,
+        rank: int,
+        env: Optional[dict[str, str]] = None,
+        cwd: Optional[str] = None,
+    ) -> None:
+        """Start the debug process of a local rank.
+
+        Args:
+            rank: rank to debug.
+            env: environment of the rank's MPI process. Defaults to the
+              environment of this process.
+            cwd: working directory of the rank's MPI process. Defaults to the
+              working directory of this process.
+        """
         backend = self.backend
         if self.args:
             args = " ".join(self.args)
@@ -56,84 +99,468 @@ class DebugClient(AsyncClient):
                 f"Please ensure '{command_name}' is installed and available in your PATH."
             )
 
-        dbg_proc = pexpect.spawn(debug_command, timeout=None)
-        dbg_proc.expect(backend.prompt_string)
-        self.runtimeOptions += backend.default_options
-        for command in self.runtimeOptions:
-            dbg_proc.sendline(command)
-            logger.debug("running runtime command: [%s]", command)
-            await dbg_proc.expect(backend.prompt_string, async_=True)
+        dbg_proc = await PtyProcess.spawn(debug_command, env=env, cwd=cwd)
+        self.traces[rank] = TraceBuffer(trace_buffer_size())
+        if backend.machine_interface:
+            # gdb/MI prints the hits as console records, e.g., `~"@mdb-..."`
+            marker = '~"' + TRACE_MARKER
+        else:
+            marker = TRACE_MARKER
+        dbg_proc.divert_lines(marker, functools.partial(self.record_trace_hit, rank))
+        await dbg_proc.expect(backend.prompt_string)
         command = self.backend.start_command
         if self.stdout is not None:
             command += f" >> {self.stdout}"
-        dbg_proc.sendline(command)
-        await dbg_proc.expect(backend.prompt_string, async_=True)
+        if backend.machine_interface:
+            session = MISession(dbg_proc, backend.prompt_string)
+            for command in [*self.runtimeOptions, command]:
+                logger.debug("running runtime command: [%s]", command)
+                await session.execute(console_command(command))
+            self.mi_sessions[rank] = session
+        else:
+            for runtime_command in self.runtimeOptions:
+                dbg_proc.sendline(runtime_command)
+                logger.debug("running runtime command: [%s]", runtime_command)
+                await dbg_proc.expect(backend.prompt_string)
+            dbg_proc.sendline(command)
+            await dbg_proc.expect(backend.prompt_string)
+
+        logger.debug("Backend init finished on rank %d: %s", rank, backend.name)
+        # only add the rank once it is ready to receive commands
+        self.dbg_procs[rank] = dbg_proc
+
+    def record_trace_hit(self, rank: int, line: str) -> None:
+        if self.backend.machine_interface:
+            try:
+                record = parse_record(line)
+            except (ValueError, IndexError):
+                record = None
+            if record is None:
+                logger.warning("cannot parse trace hit: %s", line)
+                return
+            line = record.text.rstrip("\n")
+        self.traces[rank].append(line[len(TRACE_MARKER) :])
 
-        logger.debug("Backend init finished: %s", backend.name)
-        self.dbg_proc = dbg_proc
+    async def send_trace_hits(self, message: Message) -> None:
+        # the buffers are filled as the debuggers print the hits, so they can
+        # be fetched while a command (e.g., `continue`) is still running
+        ranks = self.selected_ranks(message.data["select"])
+        hits = {}
+        dropped = {}
+        for rank in ranks:
+            hits[rank], rank_dropped = self.traces[rank].drain()
+            if rank_dropped:
+                dropped[rank] = rank_dropped
+        await self.conn.send_message(
+            Message.debug_trace_response(
+                hits=hits, dropped=dropped, ranks=RankSet(ranks)
+            ).with_request_id(message.request_id)
+        )
 
-    async def execute_command(
-        self, message: Message, prev: Optional[asyncio.Task[Any]]
+    async def add_rank(
+        self,
+        rank: int,
+        env: Optional[dict[str, str]] = None,
+        cwd: Optional[str] = None,
     ) -> None:
+        """Start debugging a local rank and register it with the exchange
+        server."""
+        await self.init_debug_proc(rank, env=env, cwd=cwd)
+        logger.info("debug proc initialized on rank %d", rank)
+
+        # tell the exhange server we are done with init
+        await self.conn.send_message(
+            Message.debug_init_complete(
+                ranks=RankSet([rank]), hosts={socket.gethostname(): 1}
+            )
+        )
+
+    async def run_on_rank(self, rank: int, command: str) -> str:
+        dbg_proc = self.dbg_procs[rank]
+        if dbg_proc.closed:
+            return "\r\nDebug process is closed. Please re-launch mdb.\r\n"
+        if re.match(r"^\s*dump binary value\s.*", command):
+            command = re.sub(r"\$RANK\$", str(rank), command)
+        if rank in self.mi_sessions:
+            response = await self.mi_sessions[rank].execute(console_command(command))
+            return response.text(command)
+        dbg_proc.sendline(command)
+        logger.debug("command running on rank %d: '%s'", rank, command)
+        output = await dbg_proc.expect(self.backend.prompt_string, eof=True)
+        return strip_bracketted_paste(output)
+
+    def command_failed(self, rank: int, output: str) -> bool:
+        """Check if the last command run on a rank failed.
+
+        Args:
+            rank: rank the command ran on.
+            output: output of the command.
+
+        Returns:
+            True if the debugger reported an error.
+        """
+        if rank in self.mi_sessions:
+            return self.mi_sessions[rank].failed
+        error_regex = self.backend.error_regex
+        return error_regex is not None and re.search(error_regex, output) is not None
+
+    async def query_rank(self, rank: int, command: str) -> Optional[str]:
+        """Get the output of a command that has just run on a rank as
+        structured values (see ``DebugBackend.structured_query``).
+
+        Args:
+            rank: rank the command ran on.
+            command: command as typed by the user.
+
+        Returns:
+            The values encoded as json, or None if the backend can't provide
+            them or the command failed.
+        """
+        query = self.backend.structured_query(command)
+        if rank not in self.mi_sessions or query is None:
+            return None
+        if self.mi_sessions[rank].failed:
+            # queries read what the command left behind, e.g., `$` would still
+            # be the last value that was printed successfully
+            return None
+        values = await self.mi_sessions[rank].query(query)
+        if values is None:
+            return None
+        # sorted so that identical values from different ranks are grouped
+        return json.dumps(values, sort_keys=True)
+
+    async def interrupt_rank(self, rank: int) -> str:
+        if rank in self.mi_sessions:
+            return await self.mi_sessions[rank].interrupt()
+        dbg_proc = self.dbg_procs[rank]
+        # send intterupt to the process
+        dbg_proc.sendintr()
+        output = await dbg_proc.expect(self.backend.prompt_string)
+        return strip_bracketted_paste(output)
+
+    def selected_ranks(self, select: RankSet) -> list[int]:
+        return [rank for rank in self.dbg_procs if rank in select]
+
+    async def run_and_check(
+        self, rank: int, command: str, query: bool = False
+    ) -> tuple[str, bool, Optional[str]]:
+        """Run a command on a rank and check if it failed (see
+        ``command_failed``) before anything else runs on the rank.
+
+        Args:
+            rank: rank to run the command on.
+            command: command to run.
+            query: also get the output as structured values (see
+              ``query_rank``).
+
+        Returns:
+            The output of the command, True if it failed and its structured
+            values (None unless ``query`` is set).
+        """
+        # commands in flight at the same time may select the same rank, in
+        # which case they take turns
+        async with self.rank_locks[rank]:
+            output = await self.run_on_rank(rank, command)
+            failed = self.command_failed(rank, output)
+            value = await self.query_rank(rank, command) if query else None
+            return output, failed, value
+
+    async def run_on_ranks(
+        self, ranks: list[int], command: str, query: bool = False
+    ) -> list[tuple[str, bool, Optional[str]]]:
+        """Run a command on several local ranks at the same time.
+
+        Args:
+            ranks: local ranks to run the command on.
+            command: command to run.
+            query: also get the output as structured values.
+
+        Returns:
+            What ``run_and_check`` returns for each rank.
+        """
+        return list(
+            await asyncio.gather(
+                *(self.run_and_check(rank, command, query) for rank in ranks)
+            )
+        )
+
+    async def execute_command(self, message: Message) -> None:
         command = message.data["command"]
-        output = ""
-        if command == "interrupt" and self.is_running:
-            logger.warning("Interrupt received")
-            # stop whatever is current running, so it doesn't try to reply
-            if prev is not None:
-                success = prev.cancel()
-
-            if not success:
-                # nothing needed cancelling, so no reply needed
-                logger.debug("No task to interrupt")
-                output = f"\r\nInterrupted: {success}\r\n"
-            else:
-                # send intterupt to the process
-                self.dbg_proc.sendintr()
+        logger.debug("Running command: '%s'", command)
+        # all local ranks run the command at the same time and reply in a
+        # single message
+        ranks = self.selected_ranks(message.data["select"])
+        replies = await self.run_on_ranks(ranks, command, query=True)
+        result = {rank: output for rank, (output, _, _) in zip(ranks, replies)}
+        # structured values of each rank's output (MI backends only)
+        value = {rank: v for rank, (_, _, v) in zip(ranks, replies) if v is not None}
+        await self.conn.send_message(
+            Message.debug_command_response(
+                result=result, value=value or None
+            ).with_request_id(message.request_id)
+        )
 
-            await self.dbg_proc.expect(self.backend.prompt_string, async_=True)
-            # report on how that all went
-            output = self.dbg_proc.before.decode()
-            output = strip_bracketted_paste(output)
-            output += f"\r\nInterrupted: {success}\r\n"
+    async def execute_batch(self, message: Message) -> None:
+        """Run the commands of a batch one after the other and reply once for
+        the whole batch.
+
+        If ``stop_on_error`` is set, the remaining commands are skipped as
+        soon as a command fails on any local rank, so the reply may hold fewer
+        results than there are commands.
+        """
+        commands = message.data["commands"]
+        selects = message.data["selects"]
+        # every selected local rank is counted by the exchange server, even if
+        # the batch stops before reaching it
+        local_ranks = RankSet(
+            [rank for rank in self.dbg_procs if any(rank in s for s in selects)]
+        )
+        results: list[dict[int, str]] = []
+        for command, select in zip(commands, selects):
+            ranks = self.selected_ranks(select)
+            logger.debug("Running batch command: '%s'", command)
+            replies = await self.run_on_ranks(ranks, command)
+            results.append(
+                {rank: output for rank, (output, _, _) in zip(ranks, replies)}
+            )
+            if message.data["stop_on_error"] and any(
+                failed for _, failed, _ in replies
+            ):
+                logger.warning("batch stopped after error in [%s]", command)
+                break
+        await self.conn.send_message(
+            Message.debug_batch_response(
+                result=results, ranks=local_ranks
+            ).with_request_id(message.request_id)
+        )
+
+    async def backtrace_rank(self, rank: int) -> list[str]:
+        """Get the call stack of a rank for ``stacks``. The caller holds the
+        rank's lock.
+
+        Args:
+            rank: rank to get the call stack of.
+
+        Returns:
+            The function of each frame, outermost frame first. Empty if the
+            rank has no stack (e.g., it isn't running) or the backend can't
+            parse backtraces.
+        """
+        if self.dbg_procs[rank].closed:
+            return []
+        if rank in self.mi_sessions:
+            values = await self.mi_sessions[rank].query("-stack-list-frames")
+            if values is None:
+                return []
+            return [frame.get("func", UNKNOWN_FRAME) for frame in values["stack"]][::-1]
+        frame_regex = self.backend.frame_regex
+        if frame_regex is None:
+            return []
+        return parse_backtrace(await self.run_on_rank(rank, "bt"), frame_regex)
+
+    async def locked_backtrace(self, rank: int) -> list[str]:
+        async with self.rank_locks[rank]:
+            return await self.backtrace_rank(rank)
+
+    async def execute_stacks(self, message: Message) -> None:
+        # the stacks of all local ranks are merged before replying, so a node
+        # wrapper sends one small tree rather than one backtrace per rank
+        ranks = self.selected_ranks(message.data["select"])
+        stacks = await asyncio.gather(*(self.locked_backtrace(rank) for rank in ranks))
+        await self.conn.send_message(
+            Message.debug_stacks_response(
+                tree=build_tree(dict(zip(ranks, stacks))), ranks=RankSet(ranks)
+            ).with_request_id(message.request_id)
+        )
+
+    async def locked_run(self, rank: int, command: str) -> str:
+        async with self.rank_locks[rank]:
+            return await self.run_on_rank(rank, command)
+
+    async def evaluate_predicate(self, message: Message) -> None:
+        # only the outcome is sent back, never the printed values
+        expr = message.data["expr"]
+        ranks = self.selected_ranks(message.data["select"])
+        outputs = await asyncio.gather(
+            *(self.locked_run(rank, f"print {expr}") for rank in ranks)
+        )
+        matched = []
+        failed = []
+        for rank, output in zip(ranks, outputs):
+            truth = extract_truth(output, self.backend)
+            if truth is None:
+                logger.debug("cannot evaluate [%s] on rank %d: %s", expr, rank, output)
+                failed.append(rank)
+            elif truth:
+                matched.append(rank)
+        await self.conn.send_message(
+            Message.debug_predicate_response(
+                matched=RankSet(matched), failed=RankSet(failed), ranks=RankSet(ranks)
+            ).with_request_id(message.request_id)
+        )
+
+    async def evaluate_reduction(self, message: Message) -> None:
+        # the values of all local ranks are reduced before replying, so only
+        # a handful of numbers are sent back
+        expr = message.data["expr"]
+        ranks = self.selected_ranks(message.data["select"])
+        outputs = await asyncio.gather(
+            *(self.locked_run(rank, f"print {expr}") for rank in ranks)
+        )
+        values = {}
+        failed = []
+        for rank, output in zip(ranks, outputs):
+            try:
+                values[rank] = extract_float(output, self.backend)
+            except ValueError:
+                logger.debug("cannot reduce [%s] on rank %d: %s", expr, rank, output)
+                failed.append(rank)
+        histogram = message.data.get("histogram")
+        await self.conn.send_message(
+            Message.debug_reduce_response(
+                reduction=partial_reduction(
+                    values, None if histogram is None else tuple(histogram)
+                ),
+                failed=RankSet(failed),
+                ranks=RankSet(ranks),
+            ).with_request_id(message.request_id)
+        )
+
+    async def sample_rank(
+        self, rank: int, samples: int, interval: float
+    ) -> tuple[dict[str, int], list[float]]:
+        """Profile a rank by letting it run and interrupting it to take a
+        backtrace, ``samples`` times.
+
+        Args:
+            rank: rank to profile, it must be stopped.
+            samples: number of samples to take.
+            interval: seconds that the rank runs before each sample.
+
+        Returns:
+            The folded stack profile of the rank (see ``merge_profiles``) and
+            how long (in seconds) the rank was stopped for each sample.
+            Sampling stops early if the rank stops by itself, e.g., at a
+            breakpoint or because it exited.
+        """
+        loop = asyncio.get_running_loop()
+        profile: dict[str, int] = {}
+        pauses: list[float] = []
+        async with self.rank_locks[rank]:
+            for _ in range(samples):
+                if self.dbg_procs[rank].closed:
+                    break
+                # every supported debugger resumes the program with `continue`
+                resume = asyncio.create_task(self.run_on_rank(rank, "continue"))
+                try:
+                    done, _ = await asyncio.wait([resume], timeout=interval)
+                finally:
+                    resume.cancel()
+                if done:
+                    logger.info("rank %d stopped while being profiled", rank)
+                    break
+                # stop the rank in the same way as an interrupt from the user
+                stopped_at = loop.time()
+                await self.interrupt_rank(rank)
+                stack = fold_stack(await self.backtrace_rank(rank))
+                profile[stack] = profile.get(stack, 0) + 1
+                pauses.append(loop.time() - stopped_at)
+        return profile, pauses
+
+    async def execute_profile(self, message: Message) -> None:
+        ranks = self.selected_ranks(message.data["select"])
+        sampled = await asyncio.gather(
+            *(
+                self.sample_rank(
+                    rank, message.data["samples"], message.data["interval"]
+                )
+                for rank in ranks
+            )
+        )
+        pauses = [pause for _, rank_pauses in sampled for pause in rank_pauses]
+        await self.conn.send_message(
+            Message.debug_profile_response(
+                profiles={rank: profile for rank, (profile, _) in zip(ranks, sampled)},
+                overhead={
+                    "samples": len(pauses),
+                    "pause": sum(pauses),
+                    "max_pause": max(pauses, default=0.0),
+                },
+                ranks=RankSet(ranks),
+            ).with_request_id(message.request_id)
+        )
+
+    async def reply_in_place(self, message: Message, result: dict[int, str]) -> None:
+        """Reply to a request whose handler couldn't, e.g., because it was
+        interrupted, so that the exchange server doesn't wait for the reply.
 
+        Args:
+            message: the request.
+            result: output to report for each selected local rank.
+        """
+        if message.msg_type in FABRIC_REQUESTS:
+            response = Message.interrupted_response(message.msg_type, result)
         else:
-            self.is_running = True
-            select = message.data["select"]
-            logger.debug("Running command: '%s'", command)
-            logger.debug("self.myrank = %d", self.myrank)
-            if self.myrank in select:
-                if not self.dbg_proc.closed:
-                    if re.match(r"^\s*dump binary value\s.*", command):
-                        command = re.sub(r"\$RANK\$", str(self.myrank), command)
-                    self.dbg_proc.sendline(command)
-                    logger.debug("command running: '%s'", command)
-                    await self.dbg_proc.expect(
-                        [self.backend.prompt_string, pexpect.EOF], async_=True
-                    )
-                    output = self.dbg_proc.before.decode()
-                    output = strip_bracketted_paste(output)
-                    result = {self.myrank: output}
-                else:
-                    output = "\r\nDebug process is closed. Please re-launch mdb.\r\n"
-
-        result = {self.myrank: output}
-        self.is_running = False
-        await self.conn.send_message(Message.debug_command_response(result=result))
+            response = Message.debug_command_response(result=result)
+        await self.conn.send_message(response.with_request_id(message.request_id))
+
+    async def handle(
+        self, handler: Callable[[Message], Coroutine[Any, Any, None]], message: Message
+    ) -> None:
+        """Run the handler of a request, replying in its place if it fails."""
+        try:
+            await handler(message)
+        except Exception as e:
+            logger.exception("failed to handle [%s]", message.msg_type)
+            ranks = self.selected_ranks(message.data["select"])
+            await self.reply_in_place(
+                message, {rank: f"\r\nError: {e!r}\r\n" for rank in ranks}
+            )
+
+    def start_command(self, message: Message) -> None:
+        """Run a command (or batch) in the background so that more commands
+        and interrupts can be received while it runs."""
+        task = asyncio.create_task(
+            self.handle(self.handlers[message.msg_type], message)
+        )
+        self.running[task] = (message, self.selected_ranks(message.data["select"]))
+        task.add_done_callback(lambda task: self.running.pop(task, None))
+
+    async def interrupt(self) -> None:
+        """Interrupt every command that is running and reply in its place."""
+        interrupted = [
+            (message, ranks)
+            for task, (message, ranks) in list(self.running.items())
+            # nothing needs cancelling if the command finished and already
+            # replied, so no reply is needed
+            if task.cancel()
+        ]
+        if not interrupted:
+            logger.debug("No task to interrupt")
+            return
+
+        logger.warning("Interrupt received")
+        for message, ranks in interrupted:
+            outputs = await asyncio.gather(
+                *(self.interrupt_rank(rank) for rank in ranks)
+            )
+            # report on how that all went
+            result = {
+                rank: output + "\r\nInterrupted: True\r\n"
+                for rank, output in zip(ranks, outputs)
+            }
+            await self.reply_in_place(message, result)
+
+    async def connect(self) -> None:
+        await self.connect_to_exchange(Message.debug_conn_request())
+        logger.info("connected to exchange")
 
     async def run(self) -> None:
         """
         Main loop of the asynchronous debugger wrapper.
         """
-        msg = await self.connect_to_exchange(Message.debug_conn_request())
-        logger.info("connected to exchange")
-        await self.init_debug_proc()
-        logger.info("debug proc initialized")
-
-        # tell the exhange server we are done with init
-        await self.conn.send_message(Message.debug_init_complete())
-
-        previous_task = None
+        await self.connect()
+        await self.add_rank(self.myrank)
 
         while True:
             # as soon as we get a command, run it so we can go back to waiting
@@ -142,15 +569,16 @@ class DebugClient(AsyncClient):
 
             if msg.msg_type == "ping":
                 logger.debug("Received ping")
-                await self.conn.send_message(Message.pong())
-            elif msg.msg_type == "mdb_command_request":
-                previous_task = asyncio.create_task(
-                    self.execute_command(msg, previous_task)
+                await self.conn.send_message(
+                    Message.pong().with_request_id(msg.request_id)
                 )
+            elif msg.msg_type == "mdb_trace_request":
+                # answered straight away, even while a command is running
+                await self.handle(self.send_trace_hits, msg)
+            elif msg.msg_type in self.handlers:
+                self.start_command(msg)
             elif msg.msg_type == Message.mdb_interrupt_request().msg_type:
                 logger.debug("received interrupt: %s", msg.msg_type)
-                previous_task = asyncio.create_task(
-                    self.execute_command(msg, previous_task)
-                )
+                asyncio.create_task(self.interrupt())
             else:
                 logger.error("Unhandled message type: %s", msg.msg_type)
@@ -6,15 +6,60 @@ import logging
 import os
 import signal
 import ssl
-from typing import Any, Coroutine, Optional
+import time
+from contextlib import suppress
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Any, Callable, Optional, cast
 
 from .async_connection import AsyncConnection
-from .messages import DEBUG_CLIENT, MDB_CLIENT, Message
-from .utils import parse_ranks, ssl_cert_path, ssl_key_path
+from .messages import (
+    DEBUG_CLIENT,
+    FABRIC_REQUESTS,
+    MDB_CLIENT,
+    FabricRequest,
+    Message,
+    negotiate_wire_format,
+)
+from .rank_set import RankSet
+from .utils import exchange_socket_path, parse_ranks, ssl_cert_path, ssl_key_path
 
 logger = logging.getLogger(__name__)
 
-DEBUGGER_TIMEOUT_DURATION = 10  # seconds
+DEBUGGER_TIMEOUT_DURATION = 10  # seconds without any new debugger connecting
+STREAM_INTERVAL = 0.2  # seconds to batch up replies before streaming them
+LISTEN_BACKLOG = 1024  # connections waiting to be accepted
+MAX_HANDSHAKES = 64  # TLS handshakes in progress at once
+# seconds by which each level of relays shortens a command's timeout, so that
+# its report of the ranks that timed out reaches its parent in time
+TIMEOUT_MARGIN = 0.5
+# replies that are merged as they arrive (see `_collect_replies`) are merged
+# whenever this many are waiting
+MERGE_REPLIES = 64
+
+
+@dataclass
+class PendingRequest:
+    """A command forwarded to the debuggers that hasn't been fully answered."""
+
+    # connection of the client that sent the command
+    conn: AsyncConnection
+    # id that the debuggers tag their replies with
+    request_id: int
+    # id the client gave the command, used for the reply to the client
+    client_id: Optional[int]
+    # message type of the debuggers' replies
+    reply_type: str
+    # ranks that are expected to reply
+    expected: RankSet = field(default_factory=RankSet)
+    replies: asyncio.Queue[Message] = field(default_factory=asyncio.Queue)
+    # ranks whose replies have arrived (but may not have been handled yet)
+    replied: RankSet = field(default_factory=RankSet)
+    # loop time when ranks that haven't replied are reported as timed out
+    deadline: Optional[float] = None
+    # debuggers that haven't answered a ping yet, pings count debuggers
+    # rather than ranks
+    pinged: set[AsyncConnection] = field(default_factory=set)
 
 
 class AsyncExchangeServer:
@@ -34,8 +79,35 @@ class AsyncExchangeServer:
         self.port = opts["port"]
         self.backend_name = opts["backend"]
         self.launch_task = opts["launch_task"]
+        self.relay_tasks = opts.get("relay_tasks", [])
         self.debuggers: list[AsyncConnection] = []
+        # which connection each rank can be reached on
+        self.rank_index: dict[int, AsyncConnection] = {}
+        self.connected_ranks = RankSet()
+        # ranks whose debug client has gone away (see `_lose_debugger`)
+        self.lost_ranks = RankSet()
+        # connections of the mdb clients
+        self.clients: list[AsyncConnection] = []
+        # commands in flight, by the request id the exchange server gave them.
+        # Client request ids are only unique per connection
+        self.requests: dict[int, PendingRequest] = {}
+        self.next_request_id = 0
+        self.reader_tasks: list[asyncio.Task[None]] = []
+        self.backlog = opts.get("backlog", LISTEN_BACKLOG)
+        # admission control for TLS handshakes (see `handle_connection`)
+        self.handshakes = asyncio.Semaphore(opts.get("max_handshakes", MAX_HANDSHAKES))
         self.debug_client_count = 0
+        self.debugger_timeout = opts.get("debugger_timeout", DEBUGGER_TIMEOUT_DURATION)
+        # set once every rank has connected
+        self.debuggers_ready = asyncio.Event()
+        # set every time more ranks connect (see `ensure_debuggers`)
+        self.debuggers_progress = asyncio.Event()
+        self.start_time = time.monotonic()
+        # number of ranks connected from each host and when the last one did
+        self.host_ranks: dict[str, int] = {}
+        self.host_last_connected: dict[str, float] = {}
+        self.servers: list[asyncio.Server] = []
+        self.socket_path: Optional[str] = None
         logger.info(f"echange server started :: {self.hostname}:{self.port}")
 
     def _init_tls(self) -> None:
@@ -50,9 +122,28 @@ class AsyncExchangeServer:
         self.context = context
 
     async def handle_connection(
-        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+        self,
+        reader: asyncio.StreamReader,
+        writer: asyncio.StreamWriter,
+        local: bool = False,
     ) -> None:
         # no try/except clause needed as the asyncio server does that for us
+        # local connections are authenticated by the permissions of the socket
+        # directory so they don't need TLS
+        if self.context is not None and not local:
+            # TLS handshakes are expensive, so when thousands of debuggers
+            # connect at once only a few are handshaking at any time. The rest
+            # have already been accepted so they don't overflow the backlog.
+            # Stop reading until it's our turn, otherwise the client's hello
+            # would be read into the plain text stream and lost
+            cast(asyncio.Transport, writer.transport).pause_reading()
+            async with self.handshakes:
+                try:
+                    await writer.start_tls(self.context)
+                except Exception as e:
+                    logger.warning("TLS handshake failed: %s", e)
+                    writer.close()
+                    return
         conn = AsyncConnection(reader, writer)
         try:
             msg = await conn.recv_message()
@@ -72,22 +163,15 @@ class AsyncExchangeServer:
         # here you'd distinguish the connection too, to work out if it needs
         # to be pushed to `self.debuggers` or not, etc
 
+        wire_format = negotiate_wire_format(msg.data.get("wire_formats", []))
+
         if msg.data["from"] == DEBUG_CLIENT:
             # ack
-            await conn.send_message(Message.debug_conn_response())
+            await conn.send_message(Message.debug_conn_response(wire_format))
+            conn.wire_format = wire_format
             # wait for it to inform us that it's completed init
             init_message = await conn.recv_message()
 
-            self.debug_client_count += 1
-
-            print(
-                "connecting to debuggers ... (%d/%d)"
-                % (self.debug_client_count, self.max_debug_clients),
-                end="\r",
-            )
-            if self.debug_client_count == self.max_debug_clients:
-                print("\nall debug clients connected")
-
             if init_message.msg_type != "debug_init_complete":
                 logger.error(
                     "Client did not send initialize: received [%s]",
@@ -97,6 +181,10 @@ class AsyncExchangeServer:
                 logger.info("Client sent initialization confirmed")
                 # only now we append the connection
                 self.debuggers.append(conn)
+                self._register_ranks(
+                    conn, init_message.data["ranks"], init_message.data.get("hosts")
+                )
+                self.reader_tasks.append(loop.create_task(self._read_debugger(conn)))
                 return  # keep connection open
 
         if msg.data["from"] == MDB_CLIENT:
@@ -106,8 +194,10 @@ class AsyncExchangeServer:
                     no_of_ranks=self.number_of_ranks,
                     backend_name=self.backend_name,
                     select_str=self.select_str,
+                    wire_format=wire_format,
                 )
             )
+            conn.wire_format = wire_format
             # schedule the loop to run
             loop.create_task(self.client_loop(conn))
             # but allow this function to return so it's not just stuck on the
@@ -118,27 +208,376 @@ class AsyncExchangeServer:
         conn.writer.close()
         await conn.writer.wait_closed()
 
-    async def _forward_all_debuggers_to_client(self, conn: AsyncConnection) -> None:
+    def _report_progress(self) -> None:
+        elapsed = time.monotonic() - self.start_time
+        print(
+            "connecting to debuggers ... (%d/%d, %.1f ranks/s)"
+            % (
+                self.debug_client_count,
+                self.max_debug_clients,
+                self.debug_client_count / max(elapsed, 1e-3),
+            ),
+            end="\r",
+        )
+        if self.debug_client_count == self.max_debug_clients:
+            print("\nall debug clients connected (%.1fs)" % elapsed)
+            self._report_hosts()
+
+    def _host_rates(self) -> list[tuple[str, int, float]]:
+        """Connection rate of each host, slowest first.
+
+        Returns:
+            List of ``(host, ranks connected, ranks per second)`` tuples.
+        """
+        rates = []
+        for host, ranks in self.host_ranks.items():
+            elapsed = self.host_last_connected[host] - self.start_time
+            rates.append((host, ranks, ranks / max(elapsed, 1e-3)))
+        return sorted(rates, key=lambda rate: rate[2])
+
+    def _report_hosts(self, limit: int = 10) -> None:
+        rates = self._host_rates()
+        for host, ranks, rate in rates[:limit]:
+            print(f"  {host}: {ranks} ranks ({rate:.1f} ranks/s)")
+        if len(rates) > limit:
+            print(f"  ... and {len(rates) - limit} faster hosts")
+
+    def _register_ranks(
+        self,
+        conn: AsyncConnection,
+        ranks: RankSet,
+        hosts: Optional[dict[str, int]] = None,
+    ) -> None:
+        """Route the ranks of a debug client (or relay) to its connection.
+
+        Args:
+            conn: connection of the debug client.
+            ranks: ranks it debugs.
+            hosts: number of ranks on each host. Defaults to every rank being
+              on the host of the connection's peer address.
+        """
+        for rank in ranks:
+            self.rank_index[rank] = conn
+        self.connected_ranks |= ranks
+        self.debug_client_count += len(ranks)
+
+        if hosts is None:
+            peer = conn.writer.get_extra_info("peername")
+            hosts = {peer[0] if isinstance(peer, tuple) else "localhost": len(ranks)}
+        now = time.monotonic()
+        for host, count in hosts.items():
+            self.host_ranks[host] = self.host_ranks.get(host, 0) + count
+            self.host_last_connected[host] = now
+
+        self._report_progress()
+        self.debuggers_progress.set()
+        if self.debug_client_count == self.max_debug_clients:
+            self.debuggers_ready.set()
+
+    async def _read_debugger(self, debugger: AsyncConnection) -> None:
+        # hand every reply to the request it belongs to, so that replies can
+        # be handled in the order they arrive rather than waiting for every
+        # debugger
         while True:
-            tasks = [
-                asyncio.create_task(debugger.recv_message())
-                for debugger in self.debuggers
-            ]
-            messages = await asyncio.gather(*tasks)
-
-            if all(i.msg_type == "debug_command_response" for i in messages):
-                logger.debug("Sending results to client")
-                await conn.send_message(
-                    Message.exchange_command_response(messages=messages)
+            try:
+                msg = await debugger.recv_message()
+            except (asyncio.IncompleteReadError, OSError):
+                self._lose_debugger(debugger)
+                return
+            if msg.msg_type == "debug_init_complete":
+                # node wrappers register their ranks one at a time
+                self._register_ranks(debugger, msg.data["ranks"], msg.data.get("hosts"))
+                continue
+            if msg.msg_type == "debug_ranks_lost":
+                # a relay below has lost some of its ranks
+                self._lose_ranks(msg.data["ranks"])
+                continue
+            request = None
+            if msg.request_id is not None:
+                request = self.requests.get(msg.request_id)
+            if request is None:
+                # e.g., a straggler replying after its command timed out
+                logger.warning(
+                    "discarding [%s] for finished request [%s]",
+                    msg.msg_type,
+                    msg.request_id,
                 )
-            elif all(i.msg_type == "pong" for i in messages):
-                logger.debug("Sending pong to client")
-                await conn.send_message(Message.pong())
-            else:
-                logger.error(
-                    "Inconsistent debugger message types: %s",
-                    set(i.msg_type for i in messages),
+                continue
+            if msg.msg_type == "pong":
+                request.pinged.discard(debugger)
+            elif msg.msg_type == request.reply_type:
+                request.replied |= msg.replied_ranks()
+            await request.replies.put(msg)
+
+    def _lose_debugger(self, debugger: AsyncConnection) -> None:
+        """Forget a debug client (or relay) whose connection has been lost,
+        e.g., because its node failed, and carry on with the others."""
+        if debugger not in self.debuggers:
+            return
+        self.debuggers.remove(debugger)
+        ranks = RankSet(
+            [rank for rank, conn in self.rank_index.items() if conn is debugger]
+        )
+        logger.error("lost connection to ranks [%s]", ranks)
+        debugger.writer.close()
+        self._lose_ranks(ranks)
+        for request in self.requests.values():
+            # stop waiting for the debugger's pong, unless it has already
+            # answered
+            if debugger in request.pinged:
+                request.pinged.discard(debugger)
+                request.replies.put_nowait(Message.pong())
+
+    def _lose_ranks(self, ranks: RankSet) -> None:
+        ranks &= self.connected_ranks
+        if not ranks:
+            return
+        for rank in ranks:
+            del self.rank_index[rank]
+        self.connected_ranks -= ranks
+        self.lost_ranks |= ranks
+        # commands waiting for these ranks get a stand-in reply so they don't
+        # wait forever
+        for request in self.requests.values():
+            missing = (request.expected & ranks) - request.replied
+            if missing and request.reply_type != "pong":
+                request.replied |= missing
+                request.replies.put_nowait(
+                    Message.missing_response(request.reply_type, missing, "lost")
+                )
+        self._report_lost(ranks)
+
+    def _report_lost(self, ranks: RankSet) -> None:
+        # tell every client once, later commands just skip the lost ranks
+        info = Message.exchange_info(
+            f"lost connection to ranks [{ranks}], continuing with ranks "
+            f"[{self.connected_ranks}]",
+            lost=ranks,
+        )
+        for client in self.clients:
+            asyncio.create_task(client.send_message(info))
+
+    async def _send_to_debuggers(
+        self, debuggers: list[AsyncConnection], message: Message
+    ) -> int:
+        """Send a message to some debuggers, dropping any that have gone away.
+
+        Returns:
+            The number of debuggers that the message was sent to.
+        """
+        sent = 0
+        for debugger in debuggers:
+            try:
+                await debugger.send_message(message)
+                sent += 1
+            except OSError:
+                self._lose_debugger(debugger)
+        return sent
+
+    def _open_request(
+        self, conn: AsyncConnection, command: Message, reply_type: str
+    ) -> PendingRequest:
+        """Give a command from the client a new request id, unique across all
+        clients, that the debuggers tag their replies with.
+
+        Args:
+            conn: connection the command came from.
+            command: the command, its request id is replaced. Its timeout (if
+              any) is shortened by ``TIMEOUT_MARGIN`` for the debuggers and
+              relays below, so relays report their stragglers in time.
+            reply_type: message type of the debuggers' replies.
+
+        Returns:
+            The request, which must be closed with ``_close_request``.
+        """
+        self.next_request_id += 1
+        request = PendingRequest(
+            conn=conn,
+            request_id=self.next_request_id,
+            client_id=command.request_id,
+            reply_type=reply_type,
+        )
+        command.data["id"] = request.request_id
+        timeout = command.data.get("timeout")
+        if timeout is not None:
+            request.deadline = asyncio.get_running_loop().time() + timeout
+            command.data["timeout"] = max(timeout - TIMEOUT_MARGIN, timeout / 2)
+        self.requests[request.request_id] = request
+        return request
+
+    def _close_request(self, request: PendingRequest) -> None:
+        # any replies that still arrive are discarded
+        del self.requests[request.request_id]
+
+    async def _next_reply(self, request: PendingRequest) -> Optional[Message]:
+        """Wait for the next reply to a request.
+
+        Returns:
+            The reply, or None once the deadline of the request has passed.
+        """
+        if request.deadline is None:
+            return await request.replies.get()
+        timeout = max(0.0, request.deadline - asyncio.get_running_loop().time())
+        try:
+            return await asyncio.wait_for(request.replies.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def _timed_out(self, request: PendingRequest, replied: RankSet) -> Message:
+        # stand in for the ranks that haven't replied
+        missing = request.expected - replied
+        logger.warning("ranks [%s] timed out", missing)
+        return Message.missing_response(request.reply_type, missing)
+
+    async def _send_response(
+        self, request: PendingRequest, messages: list[Message]
+    ) -> None:
+        logger.debug("Sending results to client")
+        await request.conn.send_message(
+            Message.exchange_command_response(messages=messages).with_request_id(
+                request.client_id
+            )
+        )
+
+    async def _send_partial_response(
+        self,
+        request: PendingRequest,
+        messages: list[Message],
+        replied: int,
+        total: int,
+    ) -> None:
+        logger.debug("Sending partial results to client (%d/%d)", replied, total)
+        await request.conn.send_message(
+            Message.exchange_command_partial(
+                messages=messages, replied=replied, total=total
+            ).with_request_id(request.client_id)
+        )
+
+    async def _end_stream(self, request: PendingRequest) -> None:
+        # an empty response marks the end of the stream
+        await request.conn.send_message(
+            Message.exchange_command_response(messages=[]).with_request_id(
+                request.client_id
+            )
+        )
+
+    async def _collect_replies(
+        self,
+        request: PendingRequest,
+        merge: Optional[Callable[[list[Message]], Message]] = None,
+    ) -> list[Message]:
+        # count ranks rather than messages because a relay may reply for many
+        # ranks at once, possibly in several batches. Ranks are counted as a
+        # set because a lost rank can be reported by a relay and by us. If
+        # `merge` is given, replies are merged into one reply every
+        # `MERGE_REPLIES` replies so they don't pile up in memory
+        messages: list[Message] = []
+        replied = RankSet()
+        try:
+            while not request.expected <= replied:
+                msg = await self._next_reply(request)
+                if msg is None:
+                    messages.append(self._timed_out(request, replied))
+                    break
+                if msg.msg_type != request.reply_type:
+                    logger.error("Unexpected debugger message type: %s", msg.msg_type)
+                    continue
+                messages.append(msg)
+                replied |= msg.replied_ranks()
+                if merge is not None and len(messages) >= MERGE_REPLIES:
+                    messages = [merge(messages)]
+        finally:
+            self._close_request(request)
+        return messages
+
+    async def _forward_all_debuggers_to_client(self, request: PendingRequest) -> None:
+        messages = await self._collect_replies(request)
+        await self._send_response(request, messages)
+
+    async def _send_merged_response(
+        self, request: PendingRequest, spec: FabricRequest, messages: list[Message]
+    ) -> None:
+        await request.conn.send_message(
+            Message.merged_response(spec.response_type, messages).with_request_id(
+                request.client_id
+            )
+        )
+
+    async def _forward_merged_to_client(
+        self, request: PendingRequest, spec: FabricRequest
+    ) -> None:
+        # replies are merged here (and in each relay on the way up) so the
+        # client only receives a single response, e.g., one stack tree
+        messages = await self._collect_replies(
+            request, merge=partial(Message.merged_response, spec.reply_type)
+        )
+        await self._send_merged_response(request, spec, messages)
+
+    async def _forward_pong_to_client(self, request: PendingRequest) -> None:
+        # every reply (or lost debugger) removes a debugger from
+        # `request.pinged`, see `_read_debugger` and `_lose_debugger`
+        try:
+            while request.pinged:
+                msg = await request.replies.get()
+                if msg.msg_type != "pong":
+                    logger.error("Unexpected debugger message type: %s", msg.msg_type)
+        finally:
+            self._close_request(request)
+
+        logger.debug("Sending pong to client")
+        await request.conn.send_message(
+            Message.pong().with_request_id(request.client_id)
+        )
+
+    async def _stream_debuggers_to_client(self, request: PendingRequest) -> None:
+        # forward results in batches as the debuggers reply, so that one slow
+        # rank doesn't hold back the output of every other rank
+        loop = asyncio.get_running_loop()
+        total = len(request.expected)
+        replied = RankSet()
+
+        try:
+            while not request.expected <= replied:
+                first = await self._next_reply(request)
+                if first is None:
+                    timed_out = self._timed_out(request, replied)
+                    await self._send_partial_response(
+                        request, [timed_out], total, total
+                    )
+                    break
+                if first.msg_type != request.reply_type:
+                    logger.error("Unexpected debugger message type: %s", first.msg_type)
+                    continue
+                batch = [first]
+                replied |= first.replied_ranks()
+                flush_time = loop.time() + STREAM_INTERVAL
+                if request.deadline is not None:
+                    flush_time = min(flush_time, request.deadline)
+                while not request.expected <= replied:
+                    timeout = max(0.0, flush_time - loop.time())
+                    try:
+                        msg = await asyncio.wait_for(request.replies.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                    if msg.msg_type != request.reply_type:
+                        logger.error(
+                            "Unexpected debugger message type: %s", msg.msg_type
+                        )
+                        continue
+                    batch.append(msg)
+                    replied |= msg.replied_ranks()
+                await self._send_partial_response(
+                    request, batch, len(request.expected & replied), total
                 )
+        finally:
+            self._close_request(request)
+
+        await self._end_stream(request)
+
+    def _select_debuggers(self, select: RankSet) -> list[AsyncConnection]:
+        # several ranks can share a connection so only keep unique ones
+        selected = select & self.connected_ranks
+        return list(dict.fromkeys(self.rank_index[rank] for rank in selected))
 
     async def client_loop(self, conn: AsyncConnection) -> None:
         # the problem here is we don't know if another message is going to come
@@ -148,7 +587,9 @@ class AsyncExchangeServer:
         # assumption, but not for the exchange server
 
         # to handle this, every time a message comes in from the client, we send it to all debuggers
-        # every time a message comes in from the debuggers, we send it to the client
+        # every time a message comes in from the debuggers, we put it on a
+        # queue which is drained by a task that forwards the replies to the
+        # client
 
         if not await self.ensure_debuggers():
             await conn.send_message(
@@ -159,8 +600,10 @@ class AsyncExchangeServer:
             )
             await self.kill()
 
-        asyncio.create_task(self._forward_all_debuggers_to_client(conn))
+        self.clients.append(conn)
+        await self._forward_commands(conn)
 
+    async def _forward_commands(self, conn: AsyncConnection) -> None:
         while True:
             try:
                 command = await conn.recv_message()
@@ -169,17 +612,74 @@ class AsyncExchangeServer:
                 logger.info("shutting down exchange server")
                 await self.shutdown(signal.SIGINT.name)
                 break
-            for debugger in self.debuggers:
-                await debugger.send_message(command)
 
-    def start_server(self) -> Coroutine[Any, Any, Any]:
-        task = asyncio.start_server(
+            # interrupts are answered in place of the command they interrupt
+            # so they don't need their own forwarding task
+            if command.msg_type == "mdb_interrupt_request":
+                await self._send_to_debuggers(list(self.debuggers), command)
+            elif command.msg_type == "ping":
+                request = self._open_request(conn, command, "pong")
+                # debuggers whose send fails are dropped from `pinged` when
+                # they are lost
+                request.pinged = set(self.debuggers)
+                await self._send_to_debuggers(list(self.debuggers), command)
+                asyncio.create_task(self._forward_pong_to_client(request))
+            elif command.msg_type == "mdb_command_request":
+                # only send commands to the debuggers of the selected ranks
+                select = command.data["select"]
+                request = self._open_request(conn, command, "debug_command_response")
+                request.expected = select & self.connected_ranks
+                await self._send_to_debuggers(self._select_debuggers(select), command)
+                if command.data.get("stream", False):
+                    asyncio.create_task(self._stream_debuggers_to_client(request))
+                else:
+                    asyncio.create_task(self._forward_all_debuggers_to_client(request))
+            elif command.msg_type in FABRIC_REQUESTS:
+                spec = FABRIC_REQUESTS[command.msg_type]
+                select = command.data["select"]
+                request = self._open_request(conn, command, spec.reply_type)
+                request.expected = select & self.connected_ranks
+                await self._send_to_debuggers(self._select_debuggers(select), command)
+                asyncio.create_task(self._forward_merged_to_client(request, spec))
+            else:
+                logger.error("Unhandled message type: %s", command.msg_type)
+
+    async def start_server(self) -> asyncio.Server:
+        """Listen for connections over TCP and, unless disabled with
+        ``MDB_DISABLE_LOCAL_SOCKET``, on a Unix domain socket for clients on
+        the same host (see ``exchange_socket_path``).
+
+        Returns:
+            The TCP server.
+        """
+        server = await asyncio.start_server(
             self.handle_connection,
             self.hostname,
             self.port,
-            ssl=self.context,
+            backlog=self.backlog,
         )
-        return task
+        self.servers.append(server)
+        if not os.environ.get("MDB_DISABLE_LOCAL_SOCKET", None):
+            self.socket_path = exchange_socket_path(self.port)
+            self.servers.append(
+                await asyncio.start_unix_server(
+                    partial(self.handle_connection, local=True),
+                    self.socket_path,
+                    backlog=self.backlog,
+                )
+            )
+            os.chmod(self.socket_path, 0o600)
+            logger.info("listening for local clients on [%s]", self.socket_path)
+        return server
+
+    def close(self) -> None:
+        """Stop listening for connections."""
+        for server in self.servers:
+            server.close()
+        if self.socket_path is not None:
+            with suppress(FileNotFoundError):
+                os.unlink(self.socket_path)
+            self.socket_path = None
 
     async def shutdown(self, signame: str) -> None:
         """Cleanup tasks tied to the service's shutdown."""
@@ -188,25 +688,34 @@ class AsyncExchangeServer:
 
     async def kill(self) -> None:
         loop = asyncio.get_event_loop()
-        try:
-            proc = self.launch_task.result()
-            logger.info(f"terminating process [{proc.pid}]")
-            proc.terminate()
-            proc.kill()
-            logger.info(f"process [{proc.pid}] terminated")
-        except Exception as e:
-            print(e)
+        for task in [self.launch_task, *self.relay_tasks]:
+            try:
+                proc = task.result()
+                logger.info(f"terminating process [{proc.pid}]")
+                proc.terminate()
+                proc.kill()
+                logger.info(f"process [{proc.pid}] terminated")
+            except Exception as e:
+                print(e)
+        self.close()
         loop.stop()
 
     async def ensure_debuggers(self) -> bool:
-        count = 0
-
-        while self.debug_client_count != self.max_debug_clients:
-            await asyncio.sleep(1)
-            count += 1
-
-            if count > DEBUGGER_TIMEOUT_DURATION:
+        # the timeout restarts whenever more ranks connect, so large jobs only
+        # give up once they stop making progress
+        while not self.debuggers_ready.is_set():
+            self.debuggers_progress.clear()
+            try:
+                await asyncio.wait_for(
+                    self.debuggers_progress.wait(), self.debugger_timeout
+                )
+            except asyncio.TimeoutError:
                 logger.error("No debuggers connected in timeout interval")
+                print(
+                    "\n%d/%d debuggers connected, slowest hosts:"
+                    % (self.debug_client_count, self.max_debug_clients)
+                )
+                self._report_hosts()
                 return False
 
         logger.debug("Debuggers connected: %d", len(self.debuggers))
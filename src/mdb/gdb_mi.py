@@ -0,0 +1,296 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from .pty_process import PtyProcess
+
+logger = logging.getLogger(__name__)
+
+# first character of each kind of MI record
+RECORD_KINDS = {
+    "^": "result",
+    "*": "exec",
+    "+": "status",
+    "=": "notify",
+    "~": "console",
+    "@": "target",
+    "&": "log",
+}
+
+_RECORD_REGEX = re.compile(r"^(\d*)([\^*+=~@&])")
+_ESCAPES = {"n": "\n", "t": "\t", "r": "\r", '"': '"', "\\": "\\"}
+
+
+@dataclass
+class MIRecord:
+    """One line of GDB/MI output, e.g., ``12^done,value="3"``."""
+
+    kind: str
+    token: Optional[int] = None
+    # result/async class, e.g., "done", "error", "running" or "stopped"
+    cls: str = ""
+    results: dict[str, Any] = field(default_factory=dict)
+    # text of stream records (console, target and log output)
+    text: str = ""
+
+
+def _parse_c_string(line: str, pos: int) -> tuple[str, int]:
+    # gdb escapes non-ascii bytes as octal so collect bytes and decode at the
+    # end to get the original utf-8 text back
+    assert line[pos] == '"'
+    pos += 1
+    out = bytearray()
+    while pos < len(line):
+        char = line[pos]
+        if char == '"':
+            return out.decode(errors="replace"), pos + 1
+        if char == "\\" and pos + 1 < len(line):
+            escape = line[pos + 1]
+            if escape in "01234567":
+                digits = re.match(r"[0-7]{1,3}", line[pos + 1 :])
+                assert digits is not None
+                out.append(int(digits.group(), 8) & 0xFF)
+                pos += 1 + len(digits.group())
+                continue
+            out += _ESCAPES.get(escape, escape).encode()
+            pos += 2
+            continue
+        out += char.encode()
+        pos += 1
+    raise ValueError(f"unterminated MI string: {line}")
+
+
+def _parse_value(line: str, pos: int) -> tuple[Any, int]:
+    char = line[pos]
+    if char == '"':
+        return _parse_c_string(line, pos)
+    if char == "{":
+        if line[pos + 1] == "}":
+            return {}, pos + 2
+        return _parse_results(line, pos + 1, "}")
+    if char == "[":
+        if line[pos + 1] == "]":
+            return [], pos + 2
+        # lists hold either values or results (e.g., `stack=[frame={...}]`),
+        # the names of the results are always the same so they are dropped
+        items = []
+        pos += 1
+        while True:
+            if line[pos] in '"{[':
+                item, pos = _parse_value(line, pos)
+            else:
+                _, item, pos = _parse_result(line, pos)
+            items.append(item)
+            if line[pos] == "]":
+                return items, pos + 1
+            pos += 1  # skip ","
+    raise ValueError(f"unexpected character [{char}] in MI record: {line}")
+
+
+def _parse_result(line: str, pos: int) -> tuple[str, Any, int]:
+    equals = line.index("=", pos)
+    name = line[pos:equals]
+    value, pos = _parse_value(line, equals + 1)
+    return name, value, pos
+
+
+def _parse_results(line: str, pos: int, end: str = "") -> tuple[dict[str, Any], int]:
+    results: dict[str, Any] = {}
+    while pos < len(line):
+        name, results[name], pos = _parse_result(line, pos)
+        if end and line[pos] == end:
+            return results, pos + 1
+        pos += 1  # skip ","
+    return results, pos
+
+
+def parse_record(line: str) -> Optional[MIRecord]:
+    """Parse one line of GDB/MI output.
+
+    Args:
+        line: line of output without the trailing newline.
+
+    Returns:
+        The record, or None if the line is a prompt or not an MI record (e.g.,
+        the terminal echoing a command).
+    """
+    m = _RECORD_REGEX.match(line)
+    if m is None:
+        return None
+    token = int(m.group(1)) if m.group(1) else None
+    kind = RECORD_KINDS[m.group(2)]
+    pos = m.end()
+    if kind in ("console", "target", "log"):
+        text, _ = _parse_c_string(line, pos)
+        return MIRecord(kind=kind, token=token, text=text)
+
+    comma = line.find(",", pos)
+    if comma == -1:
+        return MIRecord(kind=kind, token=token, cls=line[pos:])
+    results, _ = _parse_results(line, comma + 1)
+    return MIRecord(kind=kind, token=token, cls=line[pos:comma], results=results)
+
+
+class MIParser:
+    """Incremental GDB/MI parser.
+
+    Output can be fed in chunks of any size. Only the incomplete last line is
+    kept between calls, so each byte of output is only scanned once however
+    large the output is.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = ""
+
+    def feed(self, data: str) -> list[MIRecord]:
+        """Parse a chunk of output.
+
+        Args:
+            data: next chunk of gdb's output.
+
+        Returns:
+            The records completed by this chunk.
+        """
+        *lines, self.buffer = (self.buffer + data).split("\n")
+        records = []
+        for line in lines:
+            try:
+                record = parse_record(line.rstrip("\r"))
+            except (ValueError, IndexError):
+                logger.warning("cannot parse MI record: %s", line)
+                continue
+            if record is not None:
+                records.append(record)
+        return records
+
+
+@dataclass
+class MIResponse:
+    """Everything gdb output in response to one MI command."""
+
+    result: MIRecord
+    # console output, i.e., what the command would print in the gdb CLI
+    output: str = ""
+    # set if the command resumed the target and it stopped again
+    stopped: Optional[MIRecord] = None
+
+    def text(self, command: str) -> str:
+        """Format the response like the output of the gdb CLI so that it is
+        displayed in the same way.
+
+        Args:
+            command: command as typed by the user.
+
+        Returns:
+            Command, output and prompt separated by ``\\r\\n``.
+        """
+        output = self.output
+        if self.result.cls == "error":
+            output += self.result.results.get("msg", "") + "\n"
+        return f"{command}\r\n" + output.replace("\n", "\r\n") + "(gdb) "
+
+
+def console_command(command: str) -> str:
+    """Wrap a CLI command so that it can be run through the MI interpreter.
+
+    Args:
+        command: gdb CLI command.
+
+    Returns:
+        The ``-interpreter-exec console`` MI command.
+    """
+    escaped = command.replace("\\", "\\\\").replace('"', '\\"')
+    return f'-interpreter-exec console "{escaped}"'
+
+
+class MISession:
+    """Runs MI commands on a gdb started with ``--interpreter=mi3``.
+
+    Each command is sent with a unique token and the session reads output
+    until the result record with that token arrives (and, if the command
+    resumed the target, until the target stops again).
+    """
+
+    def __init__(self, proc: PtyProcess, prompt: str) -> None:
+        self.proc = proc
+        self.prompt = prompt
+        self.parser = MIParser()
+        self.token = 0
+        # true while waiting for the target to stop
+        self.running = False
+        # true if the last command failed, i.e., returned ``^error``
+        self.failed = False
+
+    async def read_records(self) -> list[MIRecord]:
+        records = self.parser.feed(await self.proc.expect(self.prompt, eof=True))
+        if self.proc.closed:
+            raise EOFError("gdb exited")
+        return records
+
+    async def execute(self, command: str) -> MIResponse:
+        """Run an MI command.
+
+        Args:
+            command: MI command without a token.
+
+        Returns:
+            The response to the command.
+        """
+        self.token += 1
+        token = self.token
+        self.proc.sendline(f"{token}{command}")
+        logger.debug("running MI command: [%d%s]", token, command)
+
+        output = []
+        result: Optional[MIRecord] = None
+        stopped = None
+        while result is None or self.running:
+            for record in await self.read_records():
+                if record.kind in ("console", "target"):
+                    output.append(record.text)
+                elif record.kind == "result" and record.token == token:
+                    result = record
+                    self.running = record.cls == "running"
+                    self.failed = record.cls == "error"
+                elif record.kind == "exec" and record.cls == "stopped":
+                    stopped = record
+                    self.running = False
+        return MIResponse(result=result, output="".join(output), stopped=stopped)
+
+    async def query(self, command: str) -> Optional[dict[str, Any]]:
+        """Run an MI command that returns structured values.
+
+        Args:
+            command: MI command without a token.
+
+        Returns:
+            The results of the command, or None if it failed.
+        """
+        response = await self.execute(command)
+        if response.result.cls != "done":
+            return None
+        return response.result.results
+
+    async def interrupt(self) -> str:
+        """Interrupt gdb (e.g., after the command that was running has been
+        cancelled).
+
+        Returns:
+            Console output up to the point where gdb was interrupted.
+        """
+        self.proc.sendintr()
+        output = []
+        # if the target isn't running only wait for gdb to acknowledge
+        waiting = True
+        while waiting:
+            for record in await self.read_records():
+                if record.kind in ("console", "target", "log"):
+                    output.append(record.text)
+                elif record.kind == "exec" and record.cls == "stopped":
+                    self.running = False
+            waiting = self.running
+        return "".join(output)
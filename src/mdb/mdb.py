@@ -1,15 +1,46 @@
 # Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
 # details.
 
-import click
+import importlib
 from importlib import metadata
+from typing import Any, Optional
+
+import click
+
+# subcommands are only imported when they are run so that, e.g., every
+# `mdb wrapper` process doesn't import the plotting libraries used by `attach`
+SUBCOMMANDS = {
+    "attach": "mdb.mdb_attach:attach",
+    "launch": "mdb.mdb_launch:launch",
+    "relay": "mdb.mdb_relay:relay",
+    "wrapper": "mdb.mdb_wrapper:wrapper",
+}
+
+
+class LazyGroup(click.Group):
+    """Click group that imports the module of each subcommand on first use."""
+
+    def __init__(
+        self,
+        *args: Any,
+        lazy_subcommands: Optional[dict[str, str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(*args, **kwargs)
+        self.lazy_subcommands = lazy_subcommands or {}
+
+    def list_commands(self, ctx: click.Context) -> list[str]:
+        return sorted([*super().list_commands(ctx), *self.lazy_subcommands])
 
-from .mdb_attach import attach
-from .mdb_launch import launch
-from .mdb_wrapper import wrapper
+    def get_command(self, ctx: click.Context, cmd_name: str) -> Optional[click.Command]:
+        if cmd_name in self.lazy_subcommands:
+            module_name, attr = self.lazy_subcommands[cmd_name].split(":")
+            command: click.Command = getattr(importlib.import_module(module_name), attr)
+            return command
+        return super().get_command(ctx, cmd_name)
 
 
-@click.group()
+@click.group(cls=LazyGroup, lazy_subcommands=SUBCOMMANDS)
 def main() -> None:
     """mdb is comprised of two sub-commands [attach] and [launch].
 
@@ -42,7 +73,4 @@ def version() -> None:
         print("mdb-debugger not installed")
 
 
-main.add_command(attach)
-main.add_command(launch)
 main.add_command(version)
-main.add_command(wrapper)
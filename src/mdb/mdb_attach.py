@@ -22,6 +22,8 @@ ShellOpts = TypedDict(
         "plot_lib": str,
         "ranks": int,
         "exchange_select": str,
+        "stream": bool,
+        "command_timeout": float | None,
     },
 )
 
@@ -70,11 +72,36 @@ ShellOpts = TypedDict(
     show_default=True,
     help="Plotting library to use. Recommended default is [termgraph] but if this is not available [matplotlib] will be used. [matplotlib] is best if there are many ranks to debug e.g., -n 100.",
 )
+@click.option(
+    "--stream/--no-stream",
+    default=True,
+    show_default=True,
+    help="Print the output of each command progressively as ranks reply, along with a count of how many ranks have replied. Use --no-stream to print all output at once after every rank has replied.",
+)
+@click.option(
+    "--command-timeout",
+    default=0.0,
+    type=click.FloatRange(min=0),
+    show_default=True,
+    help="Seconds to wait for every rank to reply to a command. The output of ranks that have replied is shown and the rest are reported as timed out. Use 0 to wait forever. Can be changed for a single command with `command --timeout SECONDS`.",
+)
 @click.option(
     "--connection-attempts",
     default=3,
     show_default=True,
-    help="Maximum number of failed connection attempts. A connection attempt is made once per second.",
+    help="Maximum number of failed connection attempts. Retries are spaced out as set by --connection-backoff and --connection-backoff-max, by default over 3.5-7 seconds in total.",
+)
+@click.option(
+    "--connection-backoff",
+    default=1.0,
+    show_default=True,
+    help="Longest delay in seconds before the first connection retry, which waits at least half of it. The delay doubles after every failed attempt.",
+)
+@click.option(
+    "--connection-backoff-max",
+    default=8.0,
+    show_default=True,
+    help="Longest delay in seconds between connection attempts.",
 )
 def attach(
     hostname: str,
@@ -84,7 +111,11 @@ def attach(
     log_level: str,
     log_file: str,
     plot_lib: str,
+    stream: bool,
+    command_timeout: float,
     connection_attempts: int,
+    connection_backoff: float,
+    connection_backoff_max: float,
 ) -> None:
     """Attach to mdb debug server.
 
@@ -122,6 +153,8 @@ def attach(
         "exchange_hostname": hostname,
         "exchange_port": port,
         "connection_attempts": connection_attempts,
+        "connection_backoff": connection_backoff,
+        "connection_backoff_max": connection_backoff_max,
     }
 
     if exec_script is None:
@@ -133,6 +166,8 @@ def attach(
         client_opts,  # type: ignore
         plot_lib,
         script_path=script,
+        stream=stream,
+        command_timeout=command_timeout or None,
     )
 
     if not interactive:
@@ -149,6 +184,8 @@ def attach_shell(
     client_opts: ClientOpts,
     plot_lib: str,
     script_path: None | str = None,
+    stream: bool = False,
+    command_timeout: float | None = None,
 ) -> mdbShell:
     """
     Attach to mdb debug server. Returns the shell instance. Intended use is for
@@ -172,6 +209,8 @@ def attach_shell(
         "plot_lib": plot_lib,
         "ranks": ranks,
         "exchange_select": client.select_str,
+        "stream": stream,
+        "command_timeout": command_timeout,
     }
 
     mshell = mdbShell(shell_opts, client)
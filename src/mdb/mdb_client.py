@@ -3,10 +3,14 @@
 
 from __future__ import annotations
 
+import asyncio
 import logging
+from typing import Callable, Optional
 
 from .async_client import AsyncClient, AsyncClientOpts
-from .messages import Message
+from .messages import FABRIC_REQUESTS, MISSING_REASONS, Message
+from .rank_set import RankSet
+from .utils import merge_results
 
 logger = logging.getLogger(__name__)
 
@@ -14,9 +18,16 @@ logger = logging.getLogger(__name__)
 ClientOpts = AsyncClientOpts
 
 
+class UnexpectedReplyError(Exception):
+    """The exchange server replied to a request with the wrong message type."""
+
+
 class Client(AsyncClient):
     def __init__(self, opts: AsyncClientOpts):
         super().__init__(opts=opts)
+        self.info_task: Optional[asyncio.Task[None]] = None
+        # ranks whose debug client has gone away
+        self.lost_ranks = RankSet()
 
     async def send_interrupt(self, signame: str) -> None:
         logger.info("Sending interrupt [%s]", signame)
@@ -25,24 +36,216 @@ class Client(AsyncClient):
         # message queue
         await self.conn.send_message(Message.mdb_interrupt_request())
 
-    async def run_command(self, command: str, select: list[int]) -> "Message":
-        await self.conn.send_message(
-            Message.mdb_command_request(command=command, select=select)
+    async def run_command(
+        self,
+        command: str,
+        select: RankSet,
+        on_progress: Optional[Callable[[Message], None]] = None,
+        timeout: Optional[float] = None,
+    ) -> "Message":
+        """Run a debugger command on the selected ranks.
+
+        If `on_progress` is given, the exchange server streams results back
+        as the ranks reply and `on_progress` is called with each partial
+        result. The returned response always contains the results from
+        every rank.
+
+        Each command has its own request id, so several commands can run at
+        the same time (e.g., with ``asyncio.gather``) and finish in any order.
+
+        With a `timeout` (in seconds), the exchange server stops waiting for
+        ranks that haven't replied by then. The response holds the results
+        that arrived and the ranks that timed out under ``timed_out``. Ranks
+        whose debug client has gone away in the meantime are under ``lost``.
+        """
+        stream = on_progress is not None
+        request_id = await self.conn.request(
+            Message.mdb_command_request(
+                command=command, select=select, stream=stream, timeout=timeout
+            )
+        )
+
+        partial_results: list[dict[str, RankSet]] = []
+        partial_values: list[dict[str, RankSet]] = []
+        missing: dict[str, RankSet] = {}
+
+        try:
+            while True:
+                command_response = await self.conn.recv_reply(request_id)
+
+                if command_response.msg_type == "exchange_command_response":
+                    if stream:
+                        command_response.data["results"] = merge_results(
+                            partial_results
+                        )
+                        if partial_values:
+                            command_response.data["values"] = merge_results(
+                                partial_values
+                            )
+                        command_response.data.update(missing)
+                    return command_response
+                elif command_response.msg_type == "exchange_command_partial":
+                    partial_results.append(command_response.data["results"])
+                    if "values" in command_response.data:
+                        partial_values.append(command_response.data["values"])
+                    for reason in MISSING_REASONS:
+                        if reason in command_response.data:
+                            missing[reason] = (
+                                missing.get(reason, RankSet())
+                                | command_response.data[reason]
+                            )
+                    if on_progress is not None:
+                        on_progress(command_response)
+                else:
+                    raise UnexpectedReplyError(
+                        f"Unhandled message type: {command_response.msg_type}"
+                    )
+        finally:
+            self.conn.end_request(request_id)
+
+    async def _fabric_request(self, request: Message) -> Message:
+        """Send a request in ``FABRIC_REQUESTS`` and wait for the exchange
+        server's response, in which the replies of every rank are merged.
+
+        Args:
+            request: the request.
+
+        Returns:
+            The response, with int keys for fields keyed by rank.
+        """
+        spec = FABRIC_REQUESTS[request.msg_type]
+        request_id = await self.conn.request(request)
+        try:
+            response = await self.conn.recv_reply(request_id)
+        finally:
+            self.conn.end_request(request_id)
+        if response.msg_type != spec.response_type:
+            raise UnexpectedReplyError(f"Unhandled message type: {response.msg_type}")
+        # keys are int ranks but json turns them into strings
+        for key in spec.rank_keys:
+            response.data[key] = {
+                int(rank): value for rank, value in response.data[key].items()
+            }
+        return response
+
+    async def run_batch(
+        self,
+        commands: list[str],
+        selects: list[RankSet],
+        stop_on_error: bool = True,
+        timeout: Optional[float] = None,
+    ) -> "Message":
+        """Run several debugger commands one after the other in a single
+        round trip.
+
+        The response holds one dict of grouped results per command (see
+        ``group_results``). If ``stop_on_error`` is set, each debug client
+        skips the rest of the batch after a command fails, so later commands
+        may be missing the results of some ranks. `timeout` applies to the
+        whole batch, as in ``run_command``.
+        """
+        return await self._fabric_request(
+            Message.mdb_batch_request(
+                commands=commands,
+                selects=selects,
+                stop_on_error=stop_on_error,
+                timeout=timeout,
+            )
+        )
+
+    async def run_stacks(
+        self, select: RankSet, timeout: Optional[float] = None
+    ) -> "Message":
+        """Get the call stacks of the selected ranks, merged into a single
+        stack tree (see ``stacks``) by the exchange server.
+
+        The response holds the tree and, as in ``run_command``, any ranks
+        that timed out or were lost.
+        """
+        return await self._fabric_request(
+            Message.mdb_stacks_request(select=select, timeout=timeout)
+        )
+
+    async def run_profile(
+        self,
+        select: RankSet,
+        samples: int,
+        interval: float,
+        timeout: Optional[float] = None,
+    ) -> "Message":
+        """Profile the selected ranks by sampling their stacks (see
+        ``DebugClient.sample_rank``).
+
+        The response holds the merged folded stack profile, the profile of
+        each rank and how long the ranks were stopped for the samples. The
+        ranks must be stopped, and they are stopped again afterwards.
+        """
+        return await self._fabric_request(
+            Message.mdb_profile_request(
+                select=select, samples=samples, interval=interval, timeout=timeout
+            )
+        )
+
+    async def run_trace(
+        self, select: RankSet, timeout: Optional[float] = None
+    ) -> "Message":
+        """Fetch the hits of trace probes (see ``trace``) collected by the
+        selected ranks since they were last fetched.
+
+        The response holds the hits of each rank, oldest first, and how many
+        older hits each rank dropped because its buffer was full.
+        """
+        return await self._fabric_request(
+            Message.mdb_trace_request(select=select, timeout=timeout)
+        )
+
+    async def run_predicate(
+        self, expr: str, select: RankSet, timeout: Optional[float] = None
+    ) -> "Message":
+        """Find the selected ranks where a condition holds. Each debug client
+        evaluates the condition itself and only the resulting rank sets are
+        sent back.
+
+        The response holds the ranks where the condition holds (``matched``)
+        and the ranks where it couldn't be evaluated (``failed``).
+        """
+        return await self._fabric_request(
+            Message.mdb_predicate_request(expr=expr, select=select, timeout=timeout)
+        )
+
+    async def run_reduce(
+        self,
+        expr: str,
+        select: RankSet,
+        histogram: Optional[tuple[int, float, float]] = None,
+        timeout: Optional[float] = None,
+    ) -> "Message":
+        """Reduce the value of an expression across the selected ranks. Each
+        debug client parses its values and the partial reductions are
+        combined by the exchange server (see ``reduction``).
+
+        The response holds the reduction and the ranks whose value isn't a
+        number (``failed``).
+        """
+        return await self._fabric_request(
+            Message.mdb_reduce_request(
+                expr=expr, select=select, histogram=histogram, timeout=timeout
+            )
         )
 
+    async def report_exchange_info(self) -> None:
+        """Print the messages that the exchange server sends outside of any
+        request, until the connection is closed."""
         while True:
-            command_response = await self.conn.recv_message()
-
-            if command_response.msg_type == "exchange_command_response":
-                return command_response
-            elif command_response.msg_type == "exchange_info":
-                print(
-                    "[*] Exchange Server: {}".format(command_response.data["message"])
-                )
+            try:
+                msg = await self.conn.recv_message()
+            except Exception:
+                return
+            if msg.msg_type == "exchange_info":
+                self.lost_ranks |= msg.data.get("lost", RankSet())
+                print("[*] Exchange Server: {}".format(msg.data["message"]))
             else:
-                raise Exception(
-                    "Unhandled message type: {}".format(command_response.msg_type)
-                )
+                logger.error("Unhandled message type: %s", msg.msg_type)
 
     async def connect(self) -> None:
         """
@@ -52,4 +255,7 @@ class Client(AsyncClient):
         self.number_of_ranks = msg.data["no_of_ranks"]
         self.backend_name = msg.data["backend_name"]
         self.select_str = msg.data["select_str"]
+        # several commands can be in flight at once (see `AsyncConnection`)
+        self.conn.multiplex()
+        self.info_task = asyncio.create_task(self.report_exchange_info())
         return
@@ -4,9 +4,11 @@
 import asyncio
 import logging
 import os
+import re
 import shlex
 import signal
 import socket
+import time
 from asyncio import Task
 from os import mkdir
 from os.path import exists, expanduser, join
@@ -18,6 +20,13 @@ from typing_extensions import TypedDict
 
 from .exchange_server import AsyncExchangeServer
 from .mdb_wrapper import Wrapper_opts, WrapperLauncher
+from .relay_server import RelayNode, plan_relay_tree
+from .utils import parse_ranks
+
+logger = logging.getLogger(__name__)
+
+CERT_DAYS = 365  # validity of newly generated certificates
+CERT_MIN_VALIDITY = 24 * 60 * 60  # seconds a reused certificate must stay valid
 
 Server_opts = TypedDict(
     "Server_opts",
@@ -33,6 +42,139 @@ Server_opts = TypedDict(
 )
 
 
+def certificate_is_reusable(
+    openssl_cmd: str, cert_path: str, key_path: str, cert_host: str
+) -> bool:
+    """Check whether an existing certificate can be used for this launch.
+
+    Args:
+        openssl_cmd: openssl executable.
+        cert_path: path of the certificate.
+        key_path: path of the private key.
+        cert_host: hostname the certificate must be issued for.
+
+    Returns:
+        True if the certificate and key exist, the certificate is issued for
+        ``cert_host``, uses an EC key and is valid for at least another
+        ``CERT_MIN_VALIDITY`` seconds.
+    """
+    if not exists(cert_path) or not exists(key_path):
+        return False
+    cmd = (
+        f"{openssl_cmd} x509 -in {cert_path} -noout -text -checkend {CERT_MIN_VALIDITY}"
+    )
+    proc = run(shlex.split(cmd), capture_output=True)
+    if proc.returncode != 0:
+        return False
+    text = proc.stdout.decode()
+    m = re.search(r"Subject:.*CN\s*=\s*([^,/\s]+)", text)
+    # certificates from older versions of mdb use (slower) RSA keys
+    return m is not None and m.group(1) == cert_host and "id-ecPublicKey" in text
+
+
+def ensure_certificate(mdb_home: str, cert_host: str) -> bool:
+    """Make sure there is a certificate and key for ``cert_host`` in
+    ``mdb_home``. An existing certificate is reused while it is valid,
+    otherwise a new one with an elliptic curve (P-256) key is generated.
+    Compared to RSA-4096 the key is much faster to generate and the
+    handshake signatures are much cheaper for the exchange server.
+
+    Args:
+        mdb_home: directory where the certificate and key are stored.
+        cert_host: hostname the certificate is issued for.
+
+    Returns:
+        True if the existing certificate was reused.
+    """
+    cert_path = join(mdb_home, "cert.pem")
+    # the file name is kept for compatibility even though the key isn't RSA
+    key_path = join(mdb_home, "key.rsa")
+
+    # Use MDB_OPENSSL environment variable if set, otherwise default to 'openssl'
+    openssl_cmd = os.environ.get("MDB_OPENSSL", "openssl")
+    if certificate_is_reusable(openssl_cmd, cert_path, key_path, cert_host):
+        logger.debug("reusing ssl certificate and key")
+        return True
+
+    subj = f"/C=XX/ST=mdb/L=mdb/O=mdb/OU=mdb/CN={cert_host}"
+    opts = f"req -x509 -newkey ec -pkeyopt ec_paramgen_curve:prime256v1 -sha256 -days {CERT_DAYS}"
+    cmd = f'{openssl_cmd} {opts} -keyout {key_path} -out {cert_path} -nodes -subj "{subj}"'
+    proc = run(shlex.split(cmd), capture_output=True)
+    logger.debug("generating ssl certificate and key")
+    logger.debug(cmd)
+    logger.debug(proc.stderr.decode())
+
+    # Check if certificate generation was successful
+    if proc.returncode != 0:
+        raise RuntimeError(
+            "Failed to generate SSL certificate.\n"
+            "You can try setting a custom OpenSSL path: export MDB_OPENSSL=/path/to/openssl"
+        )
+
+    # Verify that the certificate files were created
+    if not exists(cert_path) or not exists(key_path):
+        raise FileNotFoundError(
+            "SSL certificate files were not created. "
+            f"Expected files: {cert_path} and {key_path}\n"
+            "Please check that OpenSSL is working correctly. "
+            "You can try: export MDB_OPENSSL=/path/to/openssl"
+        )
+    return False
+
+
+def busy_ports(hostname: str, ports: list[int]) -> list[int]:
+    """Find the ports that can't be listened on, e.g., because another
+    process (or another mdb session) is using them.
+
+    Args:
+        hostname: host whose ports are checked.
+        ports: ports to check.
+
+    Returns:
+        The ports that are in use.
+    """
+    busy = []
+    for port in ports:
+        with socket.socket() as sock:
+            # as set by asyncio's servers, so ports in TIME_WAIT count as free
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            try:
+                sock.bind((hostname, port))
+            except OSError:
+                busy.append(port)
+    return busy
+
+
+async def watch_relay(
+    server: AsyncExchangeServer,
+    node: RelayNode,
+    relay_task: "Task[asyncio.subprocess.Process]",
+) -> None:
+    """Shut the exchange server down if a relay exits before every rank has
+    connected, since the ranks of that relay could never connect.
+
+    Args:
+        server: the exchange server.
+        node: the relay.
+        relay_task: task that starts the relay's process.
+    """
+    proc = await relay_task
+    exited = asyncio.ensure_future(proc.wait())
+    ready = asyncio.ensure_future(server.debuggers_ready.wait())
+    await asyncio.wait([exited, ready], return_when=asyncio.FIRST_COMPLETED)
+    ready.cancel()
+    if server.debuggers_ready.is_set():
+        # later failures are handled like any other lost debug client
+        exited.cancel()
+        return
+    logger.error("relay on port [%d] exited with [%d]", node.port, exited.result())
+    print(
+        f"\nrelay for ranks [{node.ranks}] on port {node.port} exited early "
+        f"(exit code {exited.result()}), its ranks can't connect. Shutting down."
+    )
+    await server.kill()
+
+
 @click.command()
 @click.option(
     "-n",
@@ -118,7 +260,57 @@ Server_opts = TypedDict(
     "--connection-attempts",
     default=10,
     show_default=True,
-    help="Maximum number of failed connection attempts. A connection attempt is made once per second.",
+    help="Maximum number of failed connection attempts.",
+)
+@click.option(
+    "--connection-backoff",
+    default=0.5,
+    show_default=True,
+    help="Longest delay in seconds before the first connection retry, which waits at least half of it. The delay doubles after every failed attempt and is randomised so that many processes don't retry at the same time.",
+)
+@click.option(
+    "--connection-backoff-max",
+    default=8.0,
+    show_default=True,
+    help="Longest delay in seconds between connection attempts.",
+)
+@click.option(
+    "--listen-backlog",
+    default=1024,
+    show_default=True,
+    help="Maximum number of connections waiting to be accepted by the exchange server (capped by the OS, see net.core.somaxconn).",
+)
+@click.option(
+    "--max-handshakes",
+    default=64,
+    show_default=True,
+    help="Maximum number of TLS handshakes the exchange server performs at once. Other connections wait until a handshake finishes.",
+)
+@click.option(
+    "--debugger-timeout",
+    default=10,
+    show_default=True,
+    help="Seconds to wait for another debug process to connect before giving up. The timeout restarts every time a debug process connects, so large jobs only fail if they stop making progress.",
+)
+@click.option(
+    "--fanout",
+    default=0,
+    show_default=True,
+    help="Maximum number of debug processes (or relays) connected to each exchange server. Larger jobs are served by a tree of relays running on the launch host. Set to 0 to connect every debug process directly to the exchange server.",
+)
+@click.option(
+    "--node-wrapper",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="Use one mdb wrapper per node to debug all of that node's ranks over a single connection, instead of one per rank.",
+)
+@click.option(
+    "--multi-inferior",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="Use one gdb per node to debug all of that node's ranks as separate inferiors, so the target's symbols are only loaded once per node. Implies --node-wrapper.",
 )
 @click.argument(
     "args",
@@ -139,6 +331,14 @@ def launch(
     log_level: str,
     mdb_home: str,
     connection_attempts: int,
+    connection_backoff: float,
+    connection_backoff_max: float,
+    listen_backlog: int,
+    max_handshakes: int,
+    debugger_timeout: int,
+    fanout: int,
+    node_wrapper: bool,
+    multi_inferior: bool,
     args: tuple[str] | list[str],
 ) -> None:
     """Launch mdb debug server.
@@ -153,11 +353,8 @@ def launch(
         raise ValueError("Invalid log level: %s" % log_level)
 
     logging.basicConfig(encoding="utf-8", level=numeric_level)
-    logger = logging.getLogger(__name__)
 
     MDB_HOME = expanduser(mdb_home)
-    MDB_CERT_PATH = join(MDB_HOME, "cert.pem")
-    MDB_KEY_PATH = join(MDB_HOME, "key.rsa")
 
     if not exists(MDB_HOME):
         mkdir(MDB_HOME)
@@ -169,32 +366,10 @@ def launch(
     print("to connect to the debugger run:")
     print(f"mdb attach -h {hostname} -p {port}\n")
     cert_host = gethostbyaddr(hostname)[0]
-    subj = f"/C=XX/ST=mdb/L=mdb/O=mdb/OU=mdb/CN={cert_host}"
-    opts = "req -x509 -newkey rsa:4096 -sha256 -days 365"
 
-    # Use MDB_OPENSSL environment variable if set, otherwise default to 'openssl'
-    openssl_cmd = os.environ.get("MDB_OPENSSL", "openssl")
-    cmd = f'{openssl_cmd} {opts} -keyout {MDB_KEY_PATH} -out {MDB_CERT_PATH} -nodes -subj "{subj}"'
-    proc = run(shlex.split(cmd), capture_output=True)
-    logger.debug("generating ssl certificate and key")
-    logger.debug(cmd)
-    logger.debug(proc.stderr.decode())
-
-    # Check if certificate generation was successful
-    if proc.returncode != 0:
-        raise RuntimeError(
-            "Failed to generate SSL certificate.\n"
-            "You can try setting a custom OpenSSL path: export MDB_OPENSSL=/path/to/openssl"
-        )
-
-    # Verify that the certificate files were created
-    if not exists(MDB_CERT_PATH) or not exists(MDB_KEY_PATH):
-        raise FileNotFoundError(
-            "SSL certificate files were not created. "
-            f"Expected files: {MDB_CERT_PATH} and {MDB_KEY_PATH}\n"
-            "Please check that OpenSSL is working correctly. "
-            "You can try: export MDB_OPENSSL=/path/to/openssl"
-        )
+    start = time.perf_counter()
+    reused = ensure_certificate(MDB_HOME, cert_host)
+    timings = {"certificate": time.perf_counter() - start}
 
     args = list(args)
 
@@ -202,6 +377,19 @@ def launch(
     if select is None:
         select = f"0-{ranks - 1}"
 
+    relays: list[RelayNode] = []
+    rank_ports: dict[int, int] = {}
+    if fanout > 0:
+        relays, rank_ports = plan_relay_tree(parse_ranks(select), fanout, port)
+        # relays listen on the ports after the exchange server's port, a relay
+        # that can't listen would leave its ranks unable to connect
+        busy = busy_ports(hostname, [node.port for node in relays])
+        if busy:
+            raise click.ClickException(
+                f"ports {busy} are needed by the relays but are in use, "
+                "choose another port with --port"
+            )
+
     wl_opts: Wrapper_opts = {
         "appfile": ".mdb.appfile",
         "args": " ".join(args),
@@ -213,18 +401,53 @@ def launch(
         "ranks": ranks,
         "select": select,
         "connection_attempts": connection_attempts,
+        "connection_backoff": connection_backoff,
+        "connection_backoff_max": connection_backoff_max,
+        "rank_ports": rank_ports,
+        "node_wrapper": node_wrapper or multi_inferior,
+        "multi_inferior": multi_inferior,
         "target": target.name,
         "redirect_stdout": (
             redirect_stdout.name if redirect_stdout is not None else None
         ),
     }
 
+    start = time.perf_counter()
     wrapper_launcher = WrapperLauncher(wl_opts)
     wrapper_launcher.write_app_file()
+    timings["app file"] = time.perf_counter() - start
 
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
+    # start the relays before the debug processes that connect to them
+    relay_tasks = []
+    for node in relays:
+        relay_cmd = [
+            "mdb",
+            "relay",
+            "-s",
+            f"{node.ranks}",
+            "-h",
+            hostname,
+            "-p",
+            f"{node.port}",
+            "--exchange-hostname",
+            hostname,
+            "--exchange-port",
+            f"{node.parent_port}",
+            "--connection-attempts",
+            f"{connection_attempts}",
+            "--connection-backoff",
+            f"{connection_backoff}",
+            "--connection-backoff-max",
+            f"{connection_backoff_max}",
+            "--log-level",
+            log_level,
+        ]
+        logger.debug(f"relay command: {' '.join(relay_cmd)}")
+        relay_tasks.append(loop.create_task(asyncio.create_subprocess_exec(*relay_cmd)))
+
     cmd = wrapper_launcher.launch_command()
     logger.debug(f"launch command: {cmd}")
     launch_task = loop.create_task(asyncio.create_subprocess_exec(*shlex.split(cmd)))
@@ -235,10 +458,24 @@ def launch(
         "number_of_ranks": ranks,
         "backend": backend,
         "launch_task": launch_task,
+        "relay_tasks": relay_tasks,
+        "debugger_timeout": debugger_timeout,
+        "backlog": listen_backlog,
+        "max_handshakes": max_handshakes,
         "select": select,
     }
+    start = time.perf_counter()
     server = AsyncExchangeServer(opts=exchange_opts)
+    timings["exchange server"] = time.perf_counter() - start
     loop.create_task(server.start_server())
+    for node, relay_task in zip(relays, relay_tasks):
+        loop.create_task(watch_relay(server, node, relay_task))
+
+    print(
+        "launch timing: "
+        + ", ".join(f"{phase} {seconds:.3f}s" for phase, seconds in timings.items())
+        + (" (certificate reused)" if reused else " (certificate generated)")
+    )
 
     for s in [signal.SIGINT, signal.SIGTERM]:
 
@@ -0,0 +1,117 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import asyncio
+import logging
+
+import click
+
+from .relay_server import RelayServer
+from .utils import parse_ranks
+
+
+@click.command()
+@click.option(
+    "-s",
+    "--select",
+    required=True,
+    help="Rank(s) served by this relay e.g., 0-63.",
+)
+@click.option(
+    "-h",
+    "--hostname",
+    required=True,
+    help="Hostname where this relay listens for debug clients.",
+)
+@click.option(
+    "-p",
+    "--port",
+    required=True,
+    type=int,
+    help="Port where this relay listens for debug clients.",
+)
+@click.option(
+    "--exchange-hostname",
+    required=True,
+    help="Hostname of the parent exchange server (or relay).",
+)
+@click.option(
+    "--exchange-port",
+    required=True,
+    type=int,
+    help="Port of the parent exchange server (or relay).",
+)
+@click.option(
+    "--connection-attempts",
+    default=10,
+    show_default=True,
+    help="Maximum number of failed connection attempts.",
+)
+@click.option(
+    "--connection-backoff",
+    default=0.5,
+    show_default=True,
+    help="Longest delay in seconds before the first connection retry, which waits at least half of it. The delay doubles after every failed attempt and is randomised so that many processes don't retry at the same time.",
+)
+@click.option(
+    "--connection-backoff-max",
+    default=8.0,
+    show_default=True,
+    help="Longest delay in seconds between connection attempts.",
+)
+@click.option(
+    "--log-level",
+    default="WARN",
+    show_default=True,
+    help="Choose minimum level of debug messages: [DEBUG, INFO, WARN, ERROR, CRITICAL]",
+)
+def relay(
+    select: str,
+    hostname: str,
+    port: int,
+    exchange_hostname: str,
+    exchange_port: int,
+    connection_attempts: int,
+    connection_backoff: float,
+    connection_backoff_max: float,
+    log_level: str,
+) -> None:
+    """Run an intermediate exchange server (relay).
+
+    Note: this is not expected to be run manually by the user. It is started
+    by mdb launch when the --fanout option is used.
+
+    Example:
+
+    $ mdb relay -s 0-63 -h localhost -p 2001 --exchange-hostname localhost --exchange-port 2000
+    """
+
+    numeric_level = getattr(logging, log_level.upper(), None)
+    if not isinstance(numeric_level, int):
+        raise ValueError("Invalid log level: %s" % log_level)
+
+    logging.basicConfig(encoding="utf-8", level=numeric_level)
+
+    opts = {
+        "number_of_ranks": len(parse_ranks(select)),
+        "select": select,
+        "hostname": hostname,
+        "port": port,
+        "exchange_hostname": exchange_hostname,
+        "exchange_port": exchange_port,
+        "connection_attempts": connection_attempts,
+        "connection_backoff": connection_backoff,
+        "connection_backoff_max": connection_backoff_max,
+    }
+    server = RelayServer(opts=opts)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    try:
+        loop.run_until_complete(server.run())
+    except OSError as e:
+        # e.g., the port is in use, mdb launch shuts down when a relay exits
+        raise click.ClickException(f"relay for ranks [{select}] failed: {e}")
+    finally:
+        loop.close()
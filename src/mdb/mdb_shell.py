@@ -6,6 +6,7 @@ from __future__ import annotations
 import asyncio
 import cmd
 import functools
+import math
 import os
 import re
 import readline
@@ -15,12 +16,17 @@ from shlex import split
 from subprocess import run
 from typing import TYPE_CHECKING
 
-import matplotlib.pyplot as plt
-import numpy as np
-
 from .backend import backends
+from .rank_set import RankSet
+from .reduction import DEFAULT_BINS, REDUCE_OPS
+from .stacks import folded_lines, render_tree, tree_to_dot, tree_to_json
+from .trace import dprintf_command
 from .utils import (
+    expand_results,
+    expand_values,
     extract_float,
+    format_ranks,
+    group_results,
     parse_ranks,
     pretty_print_response,
     sort_debug_response,
@@ -29,9 +35,24 @@ from .utils import (
 if TYPE_CHECKING:
     from .mdb_attach import ShellOpts
     from .mdb_client import Client
+    from .messages import Message
+
+
+# number of stacks printed by `profile`, the rest are only in its output files
+PROFILE_REPORT_STACKS = 10
 
 
-plt.style.use("dark_background")
+class CommandBatch(str):
+    """Consecutive ``command`` lines of a script, queued as a single line so
+    they are sent to the debuggers in one batch (see ``mdbShell.run_batch``).
+    """
+
+    commands: list[str]
+
+    def __new__(cls, commands: list[str]) -> CommandBatch:
+        batch = super().__new__(cls, "\n".join(commands))
+        batch.commands = commands
+        return batch
 
 
 class mdbShell(cmd.Cmd):
@@ -64,6 +85,11 @@ class mdbShell(cmd.Cmd):
         self.prompt = f"(mdb {self.select_str}) "
         self.client = client
         self.exec_script = shell_opts["exec_script"]
+        self.stream = shell_opts["stream"]
+        # seconds to wait for the slowest rank, None waits forever
+        self.command_timeout = shell_opts["command_timeout"]
+        # id of the next trace probe (see `do_trace`)
+        self.next_trace_id = 1
         self.plot_lib = shell_opts["plot_lib"]
         if self.plot_lib == "termgraph":
             try:
@@ -110,25 +136,50 @@ class mdbShell(cmd.Cmd):
             (mdb) plot [var]
         """
 
+        # plotting libraries are slow to import so only load them when needed
+        import numpy as np
+
         var = line
 
         loop = asyncio.get_event_loop()
         command_response = loop.run_until_complete(
             self.client.run_command(f"print {var}", self.select)
         )
-        response = sort_debug_response(command_response.data["results"])
+        if "values" in command_response.data:
+            # MI backends return the printed value so there is no text to parse
+            values = expand_values(command_response.data["values"])
+            response = {rank: value["value"] for rank, value in values.items()}
+            # ranks where the print failed have no value
+            failed = {
+                rank: output
+                for rank, output in expand_results(
+                    command_response.data["results"]
+                ).items()
+                if rank not in values
+            }
+            if failed:
+                print(
+                    f"[do_plot] cannot plot [{var}] on ranks [{format_ranks(failed)}]"
+                )
+                pretty_print_response(sort_debug_response(group_results(failed)))
+                return
+        else:
+            response = expand_results(command_response.data["results"])
 
         ranks = np.array(list(response.keys()))
 
         try:
-            data = np.array(
-                list(
-                    map(
-                        lambda v: extract_float(v, backend=self.backend),
-                        response.values(),
+            if "values" in command_response.data:
+                data = np.array(list(map(float, response.values())))
+            else:
+                data = np.array(
+                    list(
+                        map(
+                            lambda v: extract_float(v, backend=self.backend),
+                            response.values(),
+                        )
                     )
                 )
-            )
 
             print("min  = ", np.min(data))
             print("max  = ", np.max(data))
@@ -144,6 +195,9 @@ class mdbShell(cmd.Cmd):
                     encoding="utf-8",
                 )
             else:
+                import matplotlib.pyplot as plt
+
+                plt.style.use("dark_background")
                 fig, ax = plt.subplots()
                 ax.bar(ranks, data)
                 ax.set_xlabel("rank")
@@ -168,17 +222,314 @@ class mdbShell(cmd.Cmd):
         The following command will run "print myvar" command on processes 0,3,4 and 5.
 
             (mdb) command 0,3-5 print myvar
+
+        Ranks that haven't replied after --command-timeout seconds (see mdb
+        attach) are reported as timed out. The timeout can be changed for a
+        single command, e.g., to wait at most 5 seconds:
+
+            (mdb) command --timeout 5 0,3-5 bt
         """
 
-        command = line
-        select = self.select
-        commands = command.split(" ")
+        parsed = self.parse_command(line)
+        if parsed is None:
+            return
+        command, select, timeout = parsed
+        if not command:
+            print("Error: usage is command [--timeout SECONDS] [ranks] <command>")
+            return
 
-        if re.match(r"^[0-9,-]+$", commands[0]):
-            select = parse_ranks(commands[0])
-            command = " ".join(commands[1:])
+        loop = asyncio.get_event_loop()
+        self.forward_interrupts(loop)
+
+        printed_partial = False
+
+        def print_partial(partial: Message) -> None:
+            nonlocal printed_partial
+            # overwrite the progress counter left by the previous batch
+            print("\r\x1b[K", end="")
+            response = sort_debug_response(partial.data["results"])
+            if any(response):
+                if printed_partial:
+                    print(72 * "*")
+                pretty_print_response(response)
+                printed_partial = True
+            print(
+                "%d/%d ranks replied"
+                % (partial.data["replied"], partial.data["total"]),
+                end="\r",
+                flush=True,
+            )
+
+        command_response = loop.run_until_complete(
+            self.client.run_command(
+                command,
+                select,
+                on_progress=print_partial if self.stream else None,
+                timeout=timeout,
+            )
+        )
+
+        self.ignore_interrupts(loop)
+
+        if command_response.msg_type == "exchange_command_response":
+            if self.stream:
+                # results were already printed as they arrived, just clear
+                # the progress counter
+                print("\r\x1b[K", end="")
+            else:
+                response = sort_debug_response(command_response.data["results"])
+                pretty_print_response(response)
+            self.report_missing(command_response, timeout)
+        else:
+            print("Received unexpected message type: %s", command_response.msg_type)
+        return
+
+    def do_stacks(self, line: str) -> None:
+        """
+        Description:
+        Merge the backtraces of every selected process into a single call
+        tree. Each line is a function and the ranks whose stack passes
+        through it, so identical stacks are only printed once. Optionally
+        specify ranks and a timeout as for [command], and export the tree as
+        a graphviz (--dot) or json (--json) file instead of printing it.
+
+        Example:
+        The following command will print the merged stacks of every process.
+
+            (mdb) stacks
+
+        The following command will write the merged stacks of processes 0-63
+        to stacks.dot (e.g., for `dot -Tsvg stacks.dot -o stacks.svg`).
+
+            (mdb) stacks 0-63 --dot stacks.dot
+        """
+
+        parsed = self.parse_command(line)
+        if parsed is None:
+            return
+        options, select, timeout = parsed
+        args = shlex.split(options)
+        export = None
+        if args:
+            if len(args) != 2 or args[0] not in ("--dot", "--json"):
+                print("Error: usage is stacks [ranks] [--dot FILE | --json FILE]")
+                return
+            export = args
+
+        loop = asyncio.get_event_loop()
+        self.forward_interrupts(loop)
+        try:
+            stacks_response = loop.run_until_complete(
+                self.client.run_stacks(select, timeout=timeout)
+            )
+        finally:
+            self.ignore_interrupts(loop)
+        tree = stacks_response.data["tree"]
+        if export is None:
+            print("\n".join(render_tree(tree)))
+        else:
+            option, filename = export
+            with open(filename, "w") as f:
+                f.write(tree_to_dot(tree) if option == "--dot" else tree_to_json(tree))
+            print(f"written stacks to {filename}")
+        self.report_missing(stacks_response, timeout)
+
+    def do_reduce(self, line: str) -> None:
+        """
+        Description:
+        Reduce the value of [expr] across every selected process, where [op]
+        is one of count, sum, mean, min, max, argmin, argmax or histogram.
+        Each process parses its own value and only the combined result is
+        sent back, so this scales to many more processes than [plot].
+        Optionally specify ranks and a timeout as for [command].
+
+        Example:
+        The following command will print the largest residual and the rank
+        that has it.
+
+            (mdb) reduce argmax residual
+
+        The following command will print a histogram of 20 bins of x on
+        processes 0-63.
+
+            (mdb) reduce histogram --bins 20 0-63 x
+        """
+
+        op, _, rest = line.partition(" ")
+        if op not in REDUCE_OPS:
+            print(
+                f"Error: usage is reduce <op> [ranks] <expr>, op is one of {REDUCE_OPS}"
+            )
+            return
+        bins = DEFAULT_BINS
+        if op == "histogram" and rest.split(" ", 1)[0] == "--bins":
+            _, value, rest = (rest.split(" ", 2) + ["", ""])[:3]
+            try:
+                bins = int(value)
+                if bins < 1:
+                    raise ValueError(f"number of bins must be at least 1 [{bins}]")
+            except ValueError as e:
+                print(f"Error: {e}")
+                return
+        parsed = self.parse_command(rest)
+        if parsed is None:
+            return
+        expr, select, timeout = parsed
+        if not expr:
+            print("Error: usage is reduce <op> [ranks] <expr>")
+            return
+
+        loop = asyncio.get_event_loop()
+        self.forward_interrupts(loop)
+        try:
+            reduce_response = loop.run_until_complete(
+                self.client.run_reduce(expr, select, timeout=timeout)
+            )
+            reduction = reduce_response.data["reduction"]
+            if op == "histogram" and reduction["count"]:
+                # the range of the histogram is only known after a first pass
+                histogram = (bins, reduction["min"], reduction["max"])
+                reduce_response = loop.run_until_complete(
+                    self.client.run_reduce(
+                        expr, select, histogram=histogram, timeout=timeout
+                    )
+                )
+                reduction = reduce_response.data["reduction"]
+        finally:
+            self.ignore_interrupts(loop)
+
+        if not reduction["count"]:
+            print(f"[{expr}] isn't a number on any rank")
+        elif op == "count":
+            print(f"count = {reduction['count']}")
+        elif op == "sum":
+            print(f"sum = {reduction['sum']:g}")
+        elif op == "mean":
+            print(f"mean = {reduction['sum'] / reduction['count']:g}")
+        elif op in ("min", "argmin"):
+            print(f"min = {reduction['min']:g} on rank {reduction['min_rank']}")
+        elif op in ("max", "argmax"):
+            print(f"max = {reduction['max']:g} on rank {reduction['max_rank']}")
+        elif "bins" in reduction:
+            _, low, high = histogram
+            width = (high - low) / bins
+            most = max(reduction["bins"])
+            for i, count in enumerate(reduction["bins"]):
+                bar = "#" * round(40 * count / most)
+                print(
+                    f"[{low + i * width:>12g}, {low + (i + 1) * width:>12g}) {count:>8d} {bar}"
+                )
+        if reduce_response.data["failed"]:
+            print(
+                f"[{expr}] isn't a number on ranks [{reduce_response.data['failed']}]"
+            )
+        self.report_missing(reduce_response, timeout)
+
+    def do_trace(self, line: str) -> None:
+        """
+        Description:
+        Trace values without stopping the processes. A trace probe works like
+        gdb's dprintf: each time a process reaches [location] it prints
+        [format] with [args] and carries on running. The hits are kept by
+        each process (the latest 10000 by default, see MDB_TRACE_BUFFER)
+        until they are fetched, so there is no round trip per hit.
+        Optionally specify ranks and a timeout as for [command].
+
+        [trace show] fetches and prints the hits collected so far. [trace
+        watch] continues the processes and prints their hits every
+        [interval] seconds (default 1) until they stop, e.g., at a breakpoint
+        or after ctrl-c.
+
+        Example:
+        The following command will trace i and x at line 42 of solver.c on
+        processes 0-3, then run the processes and print the hits as they
+        arrive.
+
+            (mdb) trace 0-3 solver.c:42,"i=%d x=%f",i,x
+            (mdb) trace watch 0-3
+        """
+
+        if not re.search("gdb", self.client.backend_name):
+            print("Error: this feature is only supported for gdb-like backends")
+            return
+
+        subcommand, _, rest = line.partition(" ")
+        if subcommand not in ("show", "watch"):
+            subcommand, rest = "", line
+        parsed = self.parse_command(rest)
+        if parsed is None:
+            return
+        args, select, timeout = parsed
 
         loop = asyncio.get_event_loop()
+        if subcommand == "show":
+            trace_response = loop.run_until_complete(
+                self.client.run_trace(select, timeout=timeout)
+            )
+            self.print_trace_hits(trace_response)
+            self.report_missing(trace_response, timeout)
+            return
+        if subcommand == "watch":
+            options = shlex.split(args)
+            interval = 1.0
+            if options:
+                try:
+                    if len(options) != 2 or options[0] != "--interval":
+                        raise ValueError("usage is trace watch [ranks] [--interval S]")
+                    interval = float(options[1])
+                except ValueError as e:
+                    print(f"Error: {e}")
+                    return
+            self.forward_interrupts(loop)
+            command_response = loop.run_until_complete(
+                self.watch_traces(select, interval)
+            )
+            self.ignore_interrupts(loop)
+            pretty_print_response(sort_debug_response(command_response.data["results"]))
+            self.report_missing(command_response, None)
+            return
+
+        try:
+            command = dprintf_command(self.next_trace_id, args)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        command_response = loop.run_until_complete(
+            self.client.run_command(command, select, timeout=timeout)
+        )
+        pretty_print_response(sort_debug_response(command_response.data["results"]))
+        self.report_missing(command_response, timeout)
+        print(f"trace {self.next_trace_id} installed on ranks [{select}]")
+        self.next_trace_id += 1
+
+    async def watch_traces(self, select: RankSet, interval: float) -> Message:
+        """Continue the selected ranks and print their trace hits every
+        ``interval`` seconds until they stop.
+
+        Returns:
+            The response to ``continue``.
+        """
+        running = asyncio.ensure_future(self.client.run_command("continue", select))
+        while True:
+            done, _ = await asyncio.wait([running], timeout=interval)
+            # hits printed just before the ranks stopped are fetched too
+            self.print_trace_hits(await self.client.run_trace(select))
+            if done:
+                return running.result()
+
+    def print_trace_hits(self, response: Message) -> None:
+        for rank, hits in sorted(response.data["hits"].items()):
+            for hit in hits:
+                trace_id, _, text = hit.partition(" ")
+                print(f"{rank}:\t[trace {trace_id}] {text}")
+        for rank, dropped in sorted(response.data["dropped"].items()):
+            print(
+                f"rank {rank} dropped its {dropped} oldest hits, fetch hits more "
+                "often or increase MDB_TRACE_BUFFER"
+            )
+
+    def forward_interrupts(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Interrupt the debuggers on ctrl-c while a command runs."""
 
         def ask_exit(signame: str) -> None:
             # we tell debug process to send a command and not listen for a
@@ -192,9 +543,8 @@ class mdbShell(cmd.Cmd):
                 functools.partial(ask_exit, signame),
             )
 
-        command_response = loop.run_until_complete(
-            self.client.run_command(command, select)
-        )
+    def ignore_interrupts(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Stop interrupting the debuggers on ctrl-c once a command is done."""
 
         def ask_remain_calm(signame: str) -> None:
             # we tell debug process to send a command and not listen for a
@@ -212,12 +562,219 @@ class mdbShell(cmd.Cmd):
                 functools.partial(ask_remain_calm, signame),
             )
 
-        if command_response.msg_type == "exchange_command_response":
-            response = sort_debug_response(command_response.data["results"])
-            pretty_print_response(response)
+    def do_profile(self, line: str) -> None:
+        """
+        Description:
+        Profile the selected processes by sampling their stacks. Each sample
+        lets the processes run for [interval] seconds (default 0.1), then
+        interrupts them and takes a backtrace. The most common stacks of all
+        processes are printed, along with how long the processes were
+        stopped for each sample. The processes must be stopped (e.g., at a
+        breakpoint) and are stopped again afterwards. Optionally specify ranks
+        and a timeout as for [command].
+
+        The merged profile (--output) and the profile of each process
+        (--rank-output) can be written as folded stacks for flame graph
+        tools, e.g., `flamegraph.pl profile.folded > profile.svg`.
+
+        Example:
+        The following command will take 50 samples, 0.2 seconds apart, of
+        processes 0-63 and write the merged profile to profile.folded.
+
+            (mdb) profile 0-63 --samples 50 --interval 0.2 --output profile.folded
+        """
+
+        parsed = self.parse_command(line)
+        if parsed is None:
+            return
+        options, select, timeout = parsed
+        args = shlex.split(options)
+        settings = {
+            "--samples": "20",
+            "--interval": "0.1",
+            "--output": "",
+            "--rank-output": "",
+        }
+        if len(args) % 2 or any(option not in settings for option in args[::2]):
+            print(
+                "Error: usage is profile [ranks] [--samples N] [--interval SECONDS] "
+                "[--output FILE] [--rank-output FILE]"
+            )
+            return
+        settings.update(zip(args[::2], args[1::2]))
+        try:
+            samples = int(settings["--samples"])
+            interval = float(settings["--interval"])
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        if timeout is not None:
+            # the timeout is on top of the time spent sampling
+            timeout += samples * interval
+
+        loop = asyncio.get_event_loop()
+        self.forward_interrupts(loop)
+        profile_response = loop.run_until_complete(
+            self.client.run_profile(select, samples, interval, timeout=timeout)
+        )
+        self.ignore_interrupts(loop)
+
+        profile = profile_response.data["profile"]
+        overhead = profile_response.data["overhead"]
+        total = sum(profile.values())
+        for stack, count in list(profile.items())[:PROFILE_REPORT_STACKS]:
+            print(f"{100 * count / total:5.1f}% {stack}")
+        if overhead["samples"]:
+            print(
+                "{} samples, ranks were stopped for {:.1f} ms per sample on "
+                "average (longest {:.1f} ms)".format(
+                    overhead["samples"],
+                    1000 * overhead["pause"] / overhead["samples"],
+                    1000 * overhead["max_pause"],
+                )
+            )
         else:
-            print("Received unexpected message type: %s", command_response.msg_type)
-        return
+            print("no samples were taken, are the ranks stopped?")
+        if settings["--output"]:
+            with open(settings["--output"], "w") as f:
+                f.writelines(line + "\n" for line in folded_lines(profile))
+            print(f"written profile to {settings['--output']}")
+        if settings["--rank-output"]:
+            with open(settings["--rank-output"], "w") as f:
+                for rank, rank_profile in sorted(
+                    profile_response.data["profiles"].items()
+                ):
+                    lines = folded_lines(rank_profile, prefix=f"rank {rank}")
+                    f.writelines(line + "\n" for line in lines)
+            print(f"written profile of each rank to {settings['--rank-output']}")
+        self.report_missing(profile_response, timeout)
+
+    def parse_command(
+        self, line: str, select: RankSet | None = None, ranks_option: bool = False
+    ) -> tuple[str, RankSet, float | None] | None:
+        """Split the arguments of [command] into the debugger command, the
+        ranks to run it on and its timeout.
+
+        Args:
+            line: arguments of the command.
+            select: ranks to use if none are given. Defaults to the selected
+              ranks.
+            ranks_option: only take ranks given with ``--ranks``, e.g., when
+              the command itself may start with a number.
+
+        Returns:
+            The command, ranks and timeout, or None if the ranks or timeout
+            are invalid.
+        """
+        command = line
+        select = self.select if select is None else select
+        timeout = self.command_timeout
+        commands = command.split(" ")
+
+        if commands[0] == "--timeout":
+            try:
+                timeout = float(commands[1])
+                if not math.isfinite(timeout) or timeout < 0:
+                    raise ValueError(timeout)
+            except (IndexError, ValueError):
+                print(
+                    "Error: --timeout must be followed by a number of seconds, "
+                    "or 0 to wait forever"
+                )
+                return None
+            timeout = timeout or None
+            commands = commands[2:] or [""]
+            command = " ".join(commands)
+
+        if ranks_option:
+            if commands[0] == "--ranks":
+                commands = commands[1:] or [""]
+            else:
+                return command, select, timeout
+        if re.match(r"^[0-9,-]+$", commands[0]):
+            try:
+                select = parse_ranks(commands[0])
+            except ValueError as e:
+                print(f"Error: {e}")
+                return None
+            command = " ".join(commands[1:])
+        elif ranks_option:
+            print("Error: --ranks must be followed by a list of ranks, e.g., 0,3-5")
+            return None
+        return command, select, timeout
+
+    def report_missing(self, response: Message, timeout: float | None) -> None:
+        if "timed_out" in response.data:
+            print(
+                f"ranks [{response.data['timed_out']}] timed out after {timeout:g}s, "
+                "their output is missing"
+            )
+        if "lost" in response.data:
+            print(
+                f"lost connection to ranks [{response.data['lost']}], their output "
+                "is missing"
+            )
+
+    def run_batch(self, batch: CommandBatch) -> None:
+        """Run the ``command`` lines of a script in one round trip and print
+        the output of each command in order."""
+        commands = []
+        selects = []
+        timeouts = []
+        for line in batch.commands:
+            parsed = self.parse_command(line.split(" ", 1)[1])
+            if parsed is not None and not parsed[0]:
+                print("Error: usage is command [--timeout SECONDS] [ranks] <command>")
+                parsed = None
+            if parsed is None:
+                # the error has been printed, the other lines still run as
+                # they would one at a time
+                print(f"skipped [{line}]")
+                continue
+            commands.append(parsed[0])
+            selects.append(parsed[1])
+            timeouts.append(parsed[2])
+        if not commands:
+            return
+        # the batch has as long as its commands together
+        timeout = None if None in timeouts else sum(t for t in timeouts if t)
+
+        loop = asyncio.get_event_loop()
+        self.forward_interrupts(loop)
+        try:
+            batch_response = loop.run_until_complete(
+                self.client.run_batch(commands, selects, timeout=timeout)
+            )
+        finally:
+            self.ignore_interrupts(loop)
+        results = batch_response.data["results"]
+        missing = (
+            batch_response.data.get("timed_out", RankSet())
+            | batch_response.data.get("lost", RankSet())
+            | self.client.lost_ranks
+        )
+        for i, (command, select) in enumerate(zip(commands, selects)):
+            response = results[i] if i < len(results) else {}
+            pretty_print_response(sort_debug_response(response))
+            replied = {rank for ranks in response.values() for rank in ranks}
+            skipped = [
+                rank
+                for rank in select & self.exchange_select
+                if rank not in replied and rank not in missing
+            ]
+            if skipped:
+                print(
+                    f"[{command}] skipped on ranks [{format_ranks(skipped)}] after an "
+                    "earlier command failed"
+                )
+        self.report_missing(batch_response, timeout)
+
+    def onecmd(self, line: str) -> bool:
+        """Override Cmd.onecmd() to run batches of script commands."""
+        if isinstance(line, CommandBatch):
+            self.run_batch(line)
+            return False
+        return super().onecmd(line)
 
     def do_quit(self, line: str) -> bool:
         """
@@ -259,20 +816,71 @@ class mdbShell(cmd.Cmd):
         Manually control ranks 0,2,3 and 4 using the following command:
 
             (mdb) select 0,2-4
+
+        Select the ranks where a condition holds with [select where]. The
+        condition is evaluated by every rank (or only by the ranks given
+        with --ranks) and only the outcome is sent back, e.g., to find the
+        ranks with an error code:
+
+            (mdb) select where ierr != 0
+            (mdb) select where --ranks 0-63 ierr != 0
         """
+        if line == "where" or line.startswith("where "):
+            self.select_where(line[len("where") :].strip())
+            return
         if line == "":
-            self.select_str = f"0-{self.ranks - 1}"
+            select_str = f"0-{self.ranks - 1}"
         else:
-            self.select_str = line
-        self.select = parse_ranks(self.select_str)
-        if not set(self.select) <= set(self.exchange_select):
+            select_str = line
+        try:
+            select = parse_ranks(select_str)
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        if not select <= self.exchange_select:
             msg = "Error: user specified option [select] must be subset of available ranks (check mdb launch command)."
-            msg += f"\nselect = [{self.select_str}] but available ranks are [{self.exchange_select_str}]."
+            msg += f"\nselect = [{select_str}] but available ranks are [{self.exchange_select_str}]."
             print(msg)
             return
+        self.select_str = select_str
+        self.select = select
         self.prompt = f"(mdb {self.select_str}) "
         return
 
+    def select_where(self, line: str) -> None:
+        """Select the ranks where a condition holds (see [select where])."""
+        # an expression may start with a number, so ranks need --ranks
+        parsed = self.parse_command(
+            line, select=self.exchange_select, ranks_option=True
+        )
+        if parsed is None:
+            return
+        expr, select, timeout = parsed
+        if not expr:
+            print("Error: usage is select where [--ranks RANKS] <expr>")
+            return
+
+        loop = asyncio.get_event_loop()
+        self.forward_interrupts(loop)
+        try:
+            predicate_response = loop.run_until_complete(
+                self.client.run_predicate(expr, select, timeout=timeout)
+            )
+        finally:
+            self.ignore_interrupts(loop)
+        matched = predicate_response.data["matched"]
+        failed = predicate_response.data["failed"]
+        if failed:
+            print(f"cannot evaluate [{expr}] on ranks [{failed}]")
+        self.report_missing(predicate_response, timeout)
+        if not matched:
+            print(f"[{expr}] is false on every rank, selection unchanged")
+            return
+        self.select_str = str(matched)
+        self.select = matched
+        self.prompt = f"(mdb {self.select_str}) "
+        print(f"selected ranks [{matched}] where [{expr}] is true")
+
     def do_execute(self, line: str) -> None:
         """
         Description:
@@ -299,9 +907,25 @@ class mdbShell(cmd.Cmd):
                 return None
             return text
 
-        commands = script.splitlines()
+        lines = script.splitlines()
         # strip comments from list of commands (lines starting with `#`)
-        commands = list(filter(strip_comments, commands))
+        lines = list(filter(strip_comments, lines))
+
+        # consecutive [command] lines are sent to the debuggers in one batch
+        # rather than waiting for a round trip after each of them
+        commands: list[str] = []
+        block: list[str] = []
+        for line in [*lines, ""]:
+            if line.startswith("command ") and not self.broadcast_mode:
+                block.append(line)
+                continue
+            if len(block) > 1:
+                commands.append(CommandBatch(block))
+            else:
+                commands.extend(block)
+            block = []
+            if line:
+                commands.append(line)
 
         if queue:
             self.cmdqueue.extend(commands)
@@ -342,6 +966,9 @@ class mdbShell(cmd.Cmd):
     def precmd(self, line: str) -> str:
         """Override Cmd.precmd() to only run the command if debug processes are open."""
 
+        if isinstance(line, CommandBatch):
+            return line
+
         if line in ["q", "quit", "EOF"]:
             if self.broadcast_mode:
                 if line == "EOF":
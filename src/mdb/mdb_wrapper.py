@@ -10,6 +10,7 @@ import click
 from typing_extensions import TypedDict
 
 from .debug_client import DebugClient
+from .node_wrapper import run_node_wrapper
 from .utils import parse_ranks
 
 Wrapper_opts = TypedDict(
@@ -27,6 +28,11 @@ Wrapper_opts = TypedDict(
         "target": str,
         "redirect_stdout": str,
         "connection_attempts": int,
+        "connection_backoff": float,
+        "connection_backoff_max": float,
+        "rank_ports": dict[int, int],
+        "node_wrapper": bool,
+        "multi_inferior": bool,
     },
 )
 
@@ -73,7 +79,33 @@ Wrapper_opts = TypedDict(
     "--connection-attempts",
     default=10,
     show_default=True,
-    help="Maximum number of failed connection attempts. A connection attempt is made once per second.",
+    help="Maximum number of failed connection attempts.",
+)
+@click.option(
+    "--connection-backoff",
+    default=0.5,
+    show_default=True,
+    help="Longest delay in seconds before the first connection retry, which waits at least half of it. The delay doubles after every failed attempt and is randomised so that many processes don't retry at the same time.",
+)
+@click.option(
+    "--connection-backoff-max",
+    default=8.0,
+    show_default=True,
+    help="Longest delay in seconds between connection attempts.",
+)
+@click.option(
+    "--node-wrapper",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="Debug every rank on this node from one wrapper process. The first wrapper to start on each node debugs the ranks of the others.",
+)
+@click.option(
+    "--multi-inferior",
+    is_flag=True,
+    default=False,
+    show_default=True,
+    help="With --node-wrapper, debug every rank on this node from a single gdb with one inferior per rank.",
 )
 @click.argument(
     "args",
@@ -88,6 +120,10 @@ def wrapper(
     target: click.File,
     redirect_stdout: click.File,
     connection_attempts: int,
+    connection_backoff: float,
+    connection_backoff_max: float,
+    node_wrapper: bool,
+    multi_inferior: bool,
     args: tuple[str] | list[str],
 ) -> None:
     """Run mdb wrapper for debug backend.
@@ -112,6 +148,9 @@ def wrapper(
             redirect_stdout.name if redirect_stdout is not None else None
         ),
         "connection_attempts": connection_attempts,
+        "connection_backoff": connection_backoff,
+        "connection_backoff_max": connection_backoff_max,
+        "multi_inferior": multi_inferior,
         "args": args,
     }
 
@@ -119,13 +158,15 @@ def wrapper(
     logging.basicConfig(filename=f"rank.{my_rank}.log", level=logging.DEBUG)
     logger = logging.getLogger(__name__)
 
-    dbg_client = DebugClient(opts)  # type: ignore
-    logger.debug("debug client initialized")
-
     loop = asyncio.new_event_loop()
     asyncio.set_event_loop(loop)
 
-    loop.run_until_complete(dbg_client.run())
+    if node_wrapper:
+        loop.run_until_complete(run_node_wrapper(opts))
+    else:
+        dbg_client = DebugClient(opts)  # type: ignore
+        logger.debug("debug client initialized")
+        loop.run_until_complete(dbg_client.run())
     loop.close()
 
 
@@ -150,7 +191,13 @@ class WrapperLauncher:
         self.appfile = prog_opts["appfile"]
         self.backend = prog_opts["backend"]
         self.connection_attempts = prog_opts["connection_attempts"]
+        self.connection_backoff = prog_opts["connection_backoff"]
+        self.connection_backoff_max = prog_opts["connection_backoff_max"]
         self.args = prog_opts["args"]
+        # ranks served by a relay connect to the relay's port instead
+        self.rank_ports = prog_opts.get("rank_ports", {})
+        self.node_wrapper = prog_opts.get("node_wrapper", False)
+        self.multi_inferior = prog_opts.get("multi_inferior", False)
         self.set_mpi_mode()
         return
 
@@ -174,14 +221,22 @@ class WrapperLauncher:
                     "-h",
                     f"{self.hostname}",
                     "-p",
-                    f"{self.port}",
+                    f"{self.rank_ports.get(rank, self.port)}",
                     "-b",
                     f"{self.backend}",
                     "-t",
                     f"{self.target}",
                     "--connection-attempts",
                     f"{self.connection_attempts}",
+                    "--connection-backoff",
+                    f"{self.connection_backoff}",
+                    "--connection-backoff-max",
+                    f"{self.connection_backoff_max}",
                 ]
+                if self.node_wrapper:
+                    options.append("--node-wrapper")
+                if self.multi_inferior:
+                    options.append("--multi-inferior")
                 if self.redirect_stdout is not None:
                     options = options + [
                         "--redirect-stdout",
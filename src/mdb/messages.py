@@ -2,13 +2,444 @@
 # details.
 
 import json
+import os
+import struct
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable, Optional
+
+from .rank_set import RankSet
+from .reduction import combine_reductions, empty_reduction
+from .stacks import (
+    MAX_RANK_PROFILE_STACKS,
+    build_tree,
+    empty_tree,
+    merge_profiles,
+    merge_trees,
+)
+from .utils import group_results, merge_results
 
 MDB_CLIENT = "mdb client"
 DEBUG_CLIENT = "debug client"
 EXCHANGE = "exchange server"
 
+# wire formats in order of preference. Handshake messages are always sent as
+# json, after which both ends switch to the negotiated format.
+WIRE_FORMATS = ["binary", "json"]
+
+# type tags used by the binary wire format
+_NONE = b"N"
+_TRUE = b"T"
+_FALSE = b"F"
+_INT = b"i"
+_FLOAT = b"d"
+_STR = b"s"
+_LIST = b"l"
+_DICT = b"m"
+# columnar encoding for the per-rank {int: str} results dictionaries. Keys and
+# lengths are packed as arrays so they can be (un)packed in one struct call.
+_RANK_MAP = b"r"
+# rank sets are sent as their (start, end) ranges, never as individual ranks
+_RANK_SET = b"R"
+
+_INT_STRUCT = struct.Struct("!q")
+_FLOAT_STRUCT = struct.Struct("!d")
+_LEN_STRUCT = struct.Struct("!I")
+
+
+def supported_wire_formats() -> list[str]:
+    """List the wire formats this process is willing to use, in order of
+    preference. Setting ``MDB_WIRE_FORMAT`` restricts this to a single format,
+    e.g., ``MDB_WIRE_FORMAT=json`` makes the traffic human readable.
+
+    Returns:
+        List of wire format names.
+    """
+    wire_format = os.environ.get("MDB_WIRE_FORMAT", None)
+    if wire_format is None:
+        return list(WIRE_FORMATS)
+    if wire_format not in WIRE_FORMATS:
+        raise ValueError(
+            f"Unsupported wire format [{wire_format}]. Supported formats are {WIRE_FORMATS}."
+        )
+    return [wire_format]
+
+
+def negotiate_wire_format(offered: list[str]) -> str:
+    """Pick the first wire format offered by a peer that is also supported
+    locally. Falls back to json if there is no overlap (e.g., an older peer
+    that does not offer any formats).
+
+    Args:
+        offered: wire formats offered by the peer in order of preference.
+
+    Returns:
+        Name of the wire format to use for the rest of the connection.
+    """
+    supported = supported_wire_formats()
+    for wire_format in offered:
+        if wire_format in supported:
+            return wire_format
+    return "json"
+
+
+def _pack(value: Any, out: list[bytes]) -> None:
+    # bool must be checked before int because bool is a subclass of int
+    if value is None:
+        out.append(_NONE)
+    elif value is True:
+        out.append(_TRUE)
+    elif value is False:
+        out.append(_FALSE)
+    elif isinstance(value, int):
+        out.append(_INT)
+        out.append(_INT_STRUCT.pack(value))
+    elif isinstance(value, float):
+        out.append(_FLOAT)
+        out.append(_FLOAT_STRUCT.pack(value))
+    elif isinstance(value, str):
+        encoded = value.encode()
+        out.append(_STR)
+        out.append(_LEN_STRUCT.pack(len(encoded)))
+        out.append(encoded)
+    elif isinstance(value, (list, tuple)):
+        out.append(_LIST)
+        out.append(_LEN_STRUCT.pack(len(value)))
+        for item in value:
+            _pack(item, out)
+    elif isinstance(value, RankSet):
+        bounds = [bound for rank_range in value.ranges for bound in rank_range]
+        out.append(_RANK_SET)
+        out.append(_LEN_STRUCT.pack(len(bounds)))
+        out.append(struct.pack(f"!{len(bounds)}q", *bounds))
+    elif isinstance(value, dict) and _is_rank_map(value):
+        encoded_values = [v.encode() for v in value.values()]
+        count = len(value)
+        out.append(_RANK_MAP)
+        out.append(_LEN_STRUCT.pack(count))
+        out.append(struct.pack(f"!{count}q", *value.keys()))
+        out.append(struct.pack(f"!{count}I", *map(len, encoded_values)))
+        out.append(b"".join(encoded_values))
+    elif isinstance(value, dict):
+        out.append(_DICT)
+        out.append(_LEN_STRUCT.pack(len(value)))
+        for key, item in value.items():
+            _pack(key, out)
+            _pack(item, out)
+    else:
+        raise TypeError(f"cannot encode type [{type(value).__name__}] on the wire")
+
+
+def _is_rank_map(value: dict[Any, Any]) -> bool:
+    if not value:
+        return False
+    return all(type(k) is int for k in value) and all(
+        type(v) is str for v in value.values()
+    )
+
+
+def _unpack_rank_map(buf: memoryview, offset: int) -> tuple[dict[int, str], int]:
+    (count,) = _LEN_STRUCT.unpack_from(buf, offset)
+    offset += _LEN_STRUCT.size
+    keys = struct.unpack_from(f"!{count}q", buf, offset)
+    offset += count * _INT_STRUCT.size
+    lengths = struct.unpack_from(f"!{count}I", buf, offset)
+    offset += count * _LEN_STRUCT.size
+    blob = bytes(buf[offset : offset + sum(lengths)])
+    values = []
+    start = 0
+    for length in lengths:
+        values.append(blob[start : start + length].decode())
+        start += length
+    return dict(zip(keys, values)), offset + start
+
+
+def _unpack(buf: memoryview, offset: int) -> tuple[Any, int]:
+    tag = bytes(buf[offset : offset + 1])
+    offset += 1
+    if tag == _NONE:
+        return None, offset
+    if tag == _TRUE:
+        return True, offset
+    if tag == _FALSE:
+        return False, offset
+    if tag == _INT:
+        return _INT_STRUCT.unpack_from(buf, offset)[0], offset + _INT_STRUCT.size
+    if tag == _FLOAT:
+        return _FLOAT_STRUCT.unpack_from(buf, offset)[0], offset + _FLOAT_STRUCT.size
+    if tag == _RANK_MAP:
+        return _unpack_rank_map(buf, offset)
+    if tag == _RANK_SET:
+        (length,) = _LEN_STRUCT.unpack_from(buf, offset)
+        offset += _LEN_STRUCT.size
+        bounds = struct.unpack_from(f"!{length}q", buf, offset)
+        ranges = zip(bounds[0::2], bounds[1::2])
+        return RankSet.from_ranges(ranges), offset + length * _INT_STRUCT.size
+    if tag in (_STR, _LIST, _DICT):
+        (length,) = _LEN_STRUCT.unpack_from(buf, offset)
+        offset += _LEN_STRUCT.size
+        if tag == _STR:
+            end = offset + length
+            return str(buf[offset:end], "utf-8"), end
+        if tag == _LIST:
+            items = []
+            for _ in range(length):
+                item, offset = _unpack(buf, offset)
+                items.append(item)
+            return items, offset
+        mapping = {}
+        for _ in range(length):
+            key, offset = _unpack(buf, offset)
+            mapping[key], offset = _unpack(buf, offset)
+        return mapping, offset
+    raise ValueError(f"unknown type tag [{tag!r}] in binary message")
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, RankSet):
+        return {"__ranks__": str(value)}
+    raise TypeError(f"cannot encode type [{type(value).__name__}] as json")
+
+
+def _json_object_hook(obj: dict[str, Any]) -> Any:
+    if len(obj) == 1 and "__ranks__" in obj:
+        return RankSet.parse(obj["__ranks__"]) if obj["__ranks__"] else RankSet()
+    return obj
+
+
+def _grouped_results(messages: list["Message"]) -> dict[str, RankSet]:
+    grouped = []
+    for msg in messages:
+        if "results" in msg.data:
+            # relays have already grouped the results of their ranks
+            grouped.append(msg.data["results"])
+        else:
+            # keys are int ranks but json turns them into strings
+            results = {int(k): v for k, v in msg.data["result"].items()}
+            grouped.append(group_results(results))
+    return merge_results(grouped)
+
+
+def _grouped_values(messages: list["Message"]) -> dict[str, RankSet]:
+    # structured values are json text, so they are grouped just like results
+    grouped = []
+    for msg in messages:
+        if "values" in msg.data:
+            grouped.append(msg.data["values"])
+        elif "value" in msg.data:
+            values = {int(k): v for k, v in msg.data["value"].items()}
+            grouped.append(group_results(values))
+    return merge_results(grouped)
+
+
+def _grouped_batch_results(messages: list["Message"]) -> list[dict[str, RankSet]]:
+    # group the results of each command in a batch separately
+    grouped: list[list[dict[str, RankSet]]] = []
+    for msg in messages:
+        if "results" in msg.data:
+            batch = msg.data["results"]
+        else:
+            batch = [
+                group_results({int(k): v for k, v in result.items()})
+                for result in msg.data["result"]
+            ]
+        for i, results in enumerate(batch):
+            if i == len(grouped):
+                grouped.append([])
+            grouped[i].append(results)
+    return [merge_results(results) for results in grouped]
+
+
+def _union(messages: list["Message"], key: str) -> RankSet:
+    return RankSet.from_ranges(r for msg in messages for r in msg.data[key].ranges)
+
+
+def _batch_ranks(messages: list["Message"]) -> RankSet:
+    return _union(messages, "ranks")
+
+
+def _merged_tree(messages: list["Message"]) -> dict[str, Any]:
+    return merge_trees([msg.data["tree"] for msg in messages])
+
+
+def _merged_profile(messages: list["Message"]) -> dict[str, int]:
+    return merge_profiles(msg.data["profile"] for msg in messages)
+
+
+def _rank_profiles(messages: list["Message"]) -> dict[int, dict[str, int]]:
+    # keys are int ranks but json turns them into strings
+    return {
+        int(rank): profile
+        for msg in messages
+        for rank, profile in msg.data["profiles"].items()
+    }
+
+
+def _merged_overhead(messages: list["Message"]) -> dict[str, Any]:
+    # the time ranks spent stopped to be sampled, see
+    # `Message.debug_profile_response`
+    overheads = [msg.data["overhead"] for msg in messages]
+    return {
+        "samples": sum(overhead["samples"] for overhead in overheads),
+        "pause": sum(overhead["pause"] for overhead in overheads),
+        "max_pause": max(
+            (overhead["max_pause"] for overhead in overheads), default=0.0
+        ),
+    }
+
+
+def _trace_hits(messages: list["Message"]) -> dict[int, list[str]]:
+    # keys are int ranks but json turns them into strings
+    return {
+        int(rank): hits for msg in messages for rank, hits in msg.data["hits"].items()
+    }
+
+
+def _trace_dropped(messages: list["Message"]) -> dict[int, int]:
+    return {
+        int(rank): dropped
+        for msg in messages
+        for rank, dropped in msg.data["dropped"].items()
+    }
+
+
+def _with_values(data: dict[str, Any], messages: list["Message"]) -> dict[str, Any]:
+    # only responses from MI backends have values, so other responses don't
+    # grow an empty field
+    values = _grouped_values(messages)
+    if values:
+        data["values"] = values
+    return data
+
+
+# why ranks have no results in a command response (see
+# `Message.missing_response`): they missed the command's deadline or their
+# debug client has gone away
+MISSING_REASONS = ("timed_out", "lost")
+
+
+def _with_missing(data: dict[str, Any], messages: list["Message"]) -> dict[str, Any]:
+    # only sent if there are any missing ranks
+    for reason in MISSING_REASONS:
+        missing = RankSet.from_ranges(
+            r for msg in messages for r in msg.data.get(reason, RankSet()).ranges
+        )
+        if missing:
+            data[reason] = missing
+    return data
+
+
+@dataclass(frozen=True)
+class FabricRequest:
+    """A request that the exchange server sends to the debuggers of the
+    selected ranks (``data["select"]``), whose replies are merged on the way
+    back by each relay and by the exchange server. Every reply holds the
+    ``ranks`` it answers for, plus any missing ranks (see
+    ``MISSING_REASONS``), so that replies of any number of ranks can be merged
+    in any order.
+    """
+
+    # message type of the debuggers' replies. Relays reply with the same type
+    # so they look like a single debug client with many ranks
+    reply_type: str
+    # message type of the exchange server's response to the client
+    response_type: str
+    # fields of a reply that merges several replies
+    merge: Callable[[list["Message"]], dict[str, Any]]
+    # fields of a reply without results (see `Message.missing_response`)
+    empty: Callable[[], dict[str, Any]]
+    # fields of the reply of interrupted ranks, given the output of each rank
+    # after the interrupt (see `Message.interrupted_response`), else `empty`
+    interrupted: Optional[Callable[[dict[int, str]], dict[str, Any]]] = None
+    # fields keyed by rank, whose keys json turns into strings
+    rank_keys: tuple[str, ...] = ()
+
+
+def _merged_reduction(messages: list["Message"]) -> dict[str, Any]:
+    return combine_reductions([msg.data["reduction"] for msg in messages])
+
+
+FABRIC_REQUESTS = {
+    # several commands that each debug client runs back-to-back
+    "mdb_batch_request": FabricRequest(
+        reply_type="debug_batch_response",
+        response_type="exchange_batch_response",
+        merge=lambda messages: {"results": _grouped_batch_results(messages)},
+        empty=lambda: {"result": []},
+        interrupted=lambda result: {"result": [result]},
+    ),
+    # backtraces merged into a stack tree (see `stacks`)
+    "mdb_stacks_request": FabricRequest(
+        reply_type="debug_stacks_response",
+        response_type="exchange_stacks_response",
+        merge=lambda messages: {"tree": _merged_tree(messages)},
+        empty=lambda: {"tree": empty_tree()},
+        # interrupted ranks are reported without a stack
+        interrupted=lambda result: {"tree": build_tree({rank: [] for rank in result})},
+    ),
+    # folded stack profiles (see `DebugClient.sample_rank`)
+    "mdb_profile_request": FabricRequest(
+        reply_type="debug_profile_response",
+        response_type="exchange_profile_response",
+        merge=lambda messages: {
+            "profile": _merged_profile(messages),
+            "profiles": _rank_profiles(messages),
+            "overhead": _merged_overhead(messages),
+        },
+        empty=lambda: {
+            "profile": {},
+            "profiles": {},
+            "overhead": {"samples": 0, "pause": 0.0, "max_pause": 0.0},
+        },
+        rank_keys=("profiles",),
+    ),
+    # hits of trace probes (see `trace`)
+    "mdb_trace_request": FabricRequest(
+        reply_type="debug_trace_response",
+        response_type="exchange_trace_response",
+        merge=lambda messages: {
+            "hits": _trace_hits(messages),
+            "dropped": _trace_dropped(messages),
+        },
+        empty=lambda: {"hits": {}, "dropped": {}},
+        rank_keys=("hits", "dropped"),
+    ),
+    # ranks where a condition holds (see `select where`)
+    "mdb_predicate_request": FabricRequest(
+        reply_type="debug_predicate_response",
+        response_type="exchange_predicate_response",
+        merge=lambda messages: {
+            "matched": _union(messages, "matched"),
+            "failed": _union(messages, "failed"),
+        },
+        empty=lambda: {"matched": RankSet(), "failed": RankSet()},
+        interrupted=lambda result: {
+            "matched": RankSet(),
+            "failed": RankSet(list(result)),
+        },
+    ),
+    # values reduced across ranks (see `reduction`)
+    "mdb_reduce_request": FabricRequest(
+        reply_type="debug_reduce_response",
+        response_type="exchange_reduce_response",
+        merge=lambda messages: {
+            "reduction": _merged_reduction(messages),
+            "failed": _union(messages, "failed"),
+        },
+        empty=lambda: {"reduction": empty_reduction(), "failed": RankSet()},
+        interrupted=lambda result: {
+            "reduction": empty_reduction(),
+            "failed": RankSet(list(result)),
+        },
+    ),
+}
+
+# the request of each reply and response type
+_FABRIC_REPLIES = {
+    msg_type: spec
+    for spec in FABRIC_REQUESTS.values()
+    for msg_type in (spec.reply_type, spec.response_type)
+}
+
 
 @dataclass
 class Message:
@@ -17,22 +448,31 @@ class Message:
 
     @staticmethod
     def from_json(text: bytes) -> "Message":
-        msg = json.loads(text.decode())
-        if msg["msg_type"] == "exchange_command_response":
-            # the dictionary of results that comes back from the debuggers
-            # should be of type [int, str] but this gets destroyed by
-            # json.loads()
-            results = {int(k): v for k, v in msg["data"]["results"].items()}
-            msg["data"]["results"] = results
-            return Message(msg["msg_type"], msg["data"])
-        else:
-            return Message(msg["msg_type"], msg["data"])
+        msg = json.loads(text.decode(), object_hook=_json_object_hook)
+        return Message(msg["msg_type"], msg["data"])
+
+    @staticmethod
+    def from_binary(raw: bytes) -> "Message":
+        buf = memoryview(raw)
+        msg_type, offset = _unpack(buf, 0)
+        data, offset = _unpack(buf, offset)
+        return Message(msg_type, data)
+
+    @staticmethod
+    def decode(raw: bytes, wire_format: str) -> "Message":
+        if wire_format == "binary":
+            return Message.from_binary(raw)
+        return Message.from_json(raw)
 
     @staticmethod
     def debug_conn_request() -> "Message":
         return Message(
             "debug_conn_request",
-            {"from": DEBUG_CLIENT, "to": EXCHANGE},
+            {
+                "from": DEBUG_CLIENT,
+                "to": EXCHANGE,
+                "wire_formats": supported_wire_formats(),
+            },
         )
 
     @staticmethod
@@ -50,12 +490,13 @@ class Message:
         )
 
     @staticmethod
-    def debug_conn_response() -> "Message":
+    def debug_conn_response(wire_format: str) -> "Message":
         return Message(
             "mdb_conn_response",
             {
                 "from": EXCHANGE,
                 "to": DEBUG_CLIENT,
+                "wire_format": wire_format,
             },
         )
 
@@ -63,12 +504,16 @@ class Message:
     def mdb_conn_request() -> "Message":
         return Message(
             "mdb_conn_request",
-            {"from": MDB_CLIENT, "to": EXCHANGE},
+            {
+                "from": MDB_CLIENT,
+                "to": EXCHANGE,
+                "wire_formats": supported_wire_formats(),
+            },
         )
 
     @staticmethod
     def mdb_conn_response(
-        no_of_ranks: int, backend_name: str, select_str: str
+        no_of_ranks: int, backend_name: str, select_str: str, wire_format: str
     ) -> "Message":
         return Message(
             "mdb_conn_response",
@@ -78,20 +523,29 @@ class Message:
                 "no_of_ranks": no_of_ranks,
                 "backend_name": backend_name,
                 "select_str": select_str,
+                "wire_format": wire_format,
             },
         )
 
     @staticmethod
-    def mdb_command_request(command: str, select: list[int]) -> "Message":
-        return Message(
-            "mdb_command_request",
-            {
-                "from": MDB_CLIENT,
-                "to": EXCHANGE,
-                "command": command,
-                "select": select,
-            },
-        )
+    def mdb_command_request(
+        command: str,
+        select: RankSet,
+        stream: bool = False,
+        timeout: Optional[float] = None,
+    ) -> "Message":
+        # with a `timeout` (in seconds) the exchange server stops waiting for
+        # ranks that haven't replied and reports them as timed out
+        data: dict[str, Any] = {
+            "from": MDB_CLIENT,
+            "to": EXCHANGE,
+            "command": command,
+            "select": select,
+            "stream": stream,
+        }
+        if timeout is not None:
+            data["timeout"] = timeout
+        return Message("mdb_command_request", data)
 
     @staticmethod
     def mdb_interrupt_request() -> "Message":
@@ -105,49 +559,464 @@ class Message:
         )
 
     @staticmethod
-    def debug_command_response(result: dict[int, str]) -> "Message":
+    def debug_command_response(
+        result: dict[int, str], value: Optional[dict[int, str]] = None
+    ) -> "Message":
+        # `value` holds each rank's output as structured values (json text),
+        # if the backend can provide them (see `DebugClient.query_rank`)
+        data: dict[str, Any] = {
+            "from": DEBUG_CLIENT,
+            "to": EXCHANGE,
+            "result": result,
+        }
+        if value:
+            data["value"] = value
+        return Message("debug_command_response", data)
+
+    @staticmethod
+    def relay_command_response(messages: list["Message"]) -> "Message":
+        # a relay looks like a single debug client (with many ranks) to the
+        # exchange server above it
         return Message(
             "debug_command_response",
+            _with_missing(
+                _with_values(
+                    {
+                        "from": DEBUG_CLIENT,
+                        "to": EXCHANGE,
+                        "results": _grouped_results(messages),
+                    },
+                    messages,
+                ),
+                messages,
+            ),
+        )
+
+    @staticmethod
+    def exchange_command_response(messages: list["Message"]) -> "Message":
+        # most outputs are identical across ranks so only send each unique
+        # output once along with the ranks that produced it
+        return Message(
+            "exchange_command_response",
+            _with_missing(
+                _with_values(
+                    {
+                        "from": EXCHANGE,
+                        "to": MDB_CLIENT,
+                        "results": _grouped_results(messages),
+                    },
+                    messages,
+                ),
+                messages,
+            ),
+        )
+
+    @staticmethod
+    def exchange_command_partial(
+        messages: list["Message"], replied: int, total: int
+    ) -> "Message":
+        return Message(
+            "exchange_command_partial",
+            _with_missing(
+                _with_values(
+                    {
+                        "from": EXCHANGE,
+                        "to": MDB_CLIENT,
+                        "results": _grouped_results(messages),
+                        "replied": replied,
+                        "total": total,
+                    },
+                    messages,
+                ),
+                messages,
+            ),
+        )
+
+    @staticmethod
+    def mdb_batch_request(
+        commands: list[str],
+        selects: list[RankSet],
+        stop_on_error: bool = True,
+        timeout: Optional[float] = None,
+    ) -> "Message":
+        # several commands that each debug client runs back-to-back, so a
+        # script only needs one round trip per block of commands
+        data: dict[str, Any] = {
+            "from": MDB_CLIENT,
+            "to": EXCHANGE,
+            "commands": commands,
+            "selects": selects,
+            # every rank selected by any of the commands replies
+            "select": RankSet.from_ranges(r for ranks in selects for r in ranks.ranges),
+            "stop_on_error": stop_on_error,
+        }
+        if timeout is not None:
+            data["timeout"] = timeout
+        return Message("mdb_batch_request", data)
+
+    @staticmethod
+    def debug_batch_response(result: list[dict[int, str]], ranks: RankSet) -> "Message":
+        # `result` has one entry per command that was run, so it is shorter
+        # than the batch if the debug client stopped early. `ranks` are all of
+        # the debug client's ranks that were selected by any command
+        return Message(
+            "debug_batch_response",
             {
                 "from": DEBUG_CLIENT,
                 "to": EXCHANGE,
                 "result": result,
+                "ranks": ranks,
             },
         )
 
     @staticmethod
-    def exchange_command_response(messages: list["Message"]) -> "Message":
-        results = {}
-        for msg in messages:
-            results.update(msg.data["result"])
+    def mdb_stacks_request(
+        select: RankSet, timeout: Optional[float] = None
+    ) -> "Message":
+        # the backtraces of the selected ranks, merged into a stack tree (see
+        # `stacks`) on the way back up
+        data: dict[str, Any] = {
+            "from": MDB_CLIENT,
+            "to": EXCHANGE,
+            "select": select,
+        }
+        if timeout is not None:
+            data["timeout"] = timeout
+        return Message("mdb_stacks_request", data)
+
+    @staticmethod
+    def debug_stacks_response(tree: dict[str, Any], ranks: RankSet) -> "Message":
         return Message(
-            "exchange_command_response",
+            "debug_stacks_response",
             {
-                "from": EXCHANGE,
-                "to": MDB_CLIENT,
-                "results": results,
+                "from": DEBUG_CLIENT,
+                "to": EXCHANGE,
+                "tree": tree,
+                "ranks": ranks,
+            },
+        )
+
+    @staticmethod
+    def mdb_profile_request(
+        select: RankSet,
+        samples: int,
+        interval: float,
+        timeout: Optional[float] = None,
+    ) -> "Message":
+        # sample the stacks of the selected ranks `samples` times, letting
+        # them run for `interval` seconds before each sample
+        data: dict[str, Any] = {
+            "from": MDB_CLIENT,
+            "to": EXCHANGE,
+            "select": select,
+            "samples": samples,
+            "interval": interval,
+        }
+        if timeout is not None:
+            data["timeout"] = timeout
+        return Message("mdb_profile_request", data)
+
+    @staticmethod
+    def debug_profile_response(
+        profiles: dict[int, dict[str, int]],
+        overhead: dict[str, Any],
+        ranks: RankSet,
+    ) -> "Message":
+        # `profiles` are the folded stack profiles of each rank (see
+        # `merge_profiles`). `overhead` is the number of samples taken, the
+        # total and the longest time (in seconds) that a rank was stopped for
+        # a sample
+        return Message(
+            "debug_profile_response",
+            {
+                "from": DEBUG_CLIENT,
+                "to": EXCHANGE,
+                "profile": merge_profiles(profiles.values()),
+                "profiles": {
+                    rank: merge_profiles([profile], MAX_RANK_PROFILE_STACKS)
+                    for rank, profile in profiles.items()
+                },
+                "overhead": overhead,
+                "ranks": ranks,
+            },
+        )
+
+    @staticmethod
+    def mdb_trace_request(
+        select: RankSet, timeout: Optional[float] = None
+    ) -> "Message":
+        # fetch (and clear) the trace hits collected by the selected ranks
+        data: dict[str, Any] = {
+            "from": MDB_CLIENT,
+            "to": EXCHANGE,
+            "select": select,
+        }
+        if timeout is not None:
+            data["timeout"] = timeout
+        return Message("mdb_trace_request", data)
+
+    @staticmethod
+    def debug_trace_response(
+        hits: dict[int, list[str]], dropped: dict[int, int], ranks: RankSet
+    ) -> "Message":
+        # `hits` are the trace hits of each rank, oldest first. `dropped` is
+        # the number of older hits that didn't fit in each rank's buffer, only
+        # ranks that dropped any are included
+        return Message(
+            "debug_trace_response",
+            {
+                "from": DEBUG_CLIENT,
+                "to": EXCHANGE,
+                "hits": hits,
+                "dropped": dropped,
+                "ranks": ranks,
+            },
+        )
+
+    @staticmethod
+    def mdb_predicate_request(
+        expr: str, select: RankSet, timeout: Optional[float] = None
+    ) -> "Message":
+        # evaluate a condition on each selected rank, only the ranks where it
+        # holds are sent back (see `select where`)
+        data: dict[str, Any] = {
+            "from": MDB_CLIENT,
+            "to": EXCHANGE,
+            "expr": expr,
+            "select": select,
+        }
+        if timeout is not None:
+            data["timeout"] = timeout
+        return Message("mdb_predicate_request", data)
+
+    @staticmethod
+    def debug_predicate_response(
+        matched: RankSet, failed: RankSet, ranks: RankSet
+    ) -> "Message":
+        # `matched` are the ranks where the condition holds and `failed` the
+        # ranks where it couldn't be evaluated. Rank sets are sent as ranges
+        # so the reply stays small however many ranks there are
+        return Message(
+            "debug_predicate_response",
+            {
+                "from": DEBUG_CLIENT,
+                "to": EXCHANGE,
+                "matched": matched,
+                "failed": failed,
+                "ranks": ranks,
             },
         )
 
     @staticmethod
-    def exchange_info(message: str) -> "Message":
+    def mdb_reduce_request(
+        expr: str,
+        select: RankSet,
+        histogram: Optional[tuple[int, float, float]] = None,
+        timeout: Optional[float] = None,
+    ) -> "Message":
+        # reduce the value of an expression across the selected ranks, see
+        # `partial_reduction` for `histogram`
+        data: dict[str, Any] = {
+            "from": MDB_CLIENT,
+            "to": EXCHANGE,
+            "expr": expr,
+            "select": select,
+        }
+        if histogram is not None:
+            data["histogram"] = list(histogram)
+        if timeout is not None:
+            data["timeout"] = timeout
+        return Message("mdb_reduce_request", data)
+
+    @staticmethod
+    def debug_reduce_response(
+        reduction: dict[str, Any], failed: RankSet, ranks: RankSet
+    ) -> "Message":
+        # `failed` are the ranks whose value isn't a number
         return Message(
-            "exchange_info",
+            "debug_reduce_response",
             {
-                "message": message,
+                "from": DEBUG_CLIENT,
+                "to": EXCHANGE,
+                "reduction": reduction,
+                "failed": failed,
+                "ranks": ranks,
             },
         )
 
     @staticmethod
-    def debug_init_complete() -> "Message":
+    def merged_response(msg_type: str, messages: list["Message"]) -> "Message":
+        """Merge the replies to a request in ``FABRIC_REQUESTS``.
+
+        Args:
+            msg_type: type of the merged message. With the request's
+              ``reply_type`` it can be merged again, e.g., by a relay's
+              parent. With its ``response_type`` it is the response to the
+              client.
+            messages: replies to merge.
+
+        Returns:
+            A single reply for the ranks of every message.
+        """
+        spec = _FABRIC_REPLIES[msg_type]
+        data: dict[str, Any]
+        if msg_type == spec.response_type:
+            data = {"from": EXCHANGE, "to": MDB_CLIENT}
+        else:
+            data = {"from": DEBUG_CLIENT, "to": EXCHANGE}
+        data.update(spec.merge(messages), ranks=_batch_ranks(messages))
+        return Message(msg_type, _with_missing(data, messages))
+
+    @staticmethod
+    def interrupted_response(request_type: str, result: dict[int, str]) -> "Message":
+        """Reply of a debug client in place of a request that was interrupted.
+
+        Args:
+            request_type: type of the request, a key of ``FABRIC_REQUESTS``.
+            result: output of each interrupted rank.
+
+        Returns:
+            A reply that counts the interrupted ranks as replied.
+        """
+        spec = FABRIC_REQUESTS[request_type]
+        data: dict[str, Any] = {"from": DEBUG_CLIENT, "to": EXCHANGE}
+        if spec.interrupted is None:
+            data.update(spec.empty())
+        else:
+            data.update(spec.interrupted(result))
+        data["ranks"] = RankSet(list(result))
+        return Message(spec.reply_type, data)
+
+    @staticmethod
+    def missing_response(
+        msg_type: str, ranks: RankSet, reason: str = "timed_out"
+    ) -> "Message":
+        """Stand-in for the replies of ranks that can't reply to a command.
+
+        Args:
+            msg_type: type of the replies, i.e., ``debug_command_response`` or
+              the ``reply_type`` of a request in ``FABRIC_REQUESTS``.
+            ranks: ranks without a reply.
+            reason: one of ``MISSING_REASONS``.
+
+        Returns:
+            A reply without results that counts ``ranks`` as replied.
+        """
+        data: dict[str, Any] = {
+            "from": DEBUG_CLIENT,
+            "to": EXCHANGE,
+            reason: ranks,
+        }
+        if msg_type in _FABRIC_REPLIES:
+            data.update(_FABRIC_REPLIES[msg_type].empty(), ranks=RankSet())
+        else:
+            data["result"] = {}
+        return Message(msg_type, data)
+
+    @staticmethod
+    def debug_ranks_lost(ranks: RankSet) -> "Message":
+        # sent by a relay when the connection to some of its ranks is lost
         return Message(
-            "debug_init_complete",
+            "debug_ranks_lost",
             {
                 "from": DEBUG_CLIENT,
                 "to": EXCHANGE,
+                "ranks": ranks,
+            },
+        )
+
+    @staticmethod
+    def exchange_info(message: str, lost: Optional[RankSet] = None) -> "Message":
+        # `lost` are ranks whose debug client has gone away
+        data: dict[str, Any] = {"message": message}
+        if lost is not None:
+            data["lost"] = lost
+        return Message("exchange_info", data)
+
+    @staticmethod
+    def debug_init_complete(
+        ranks: RankSet, hosts: Optional[dict[str, int]] = None
+    ) -> "Message":
+        # `hosts` is the number of ranks on each host. The exchange server
+        # only sees the address of its child (e.g., a relay), so the hosts are
+        # forwarded up the tree.
+        data: dict[str, Any] = {
+            "from": DEBUG_CLIENT,
+            "to": EXCHANGE,
+            "ranks": ranks,
+        }
+        if hosts is not None:
+            data["hosts"] = hosts
+        return Message("debug_init_complete", data)
+
+    @staticmethod
+    def node_register(rank: int, env: dict[str, str], cwd: str) -> "Message":
+        # sent by a wrapper to the node wrapper that will debug its rank
+        return Message(
+            "node_register",
+            {
+                "from": DEBUG_CLIENT,
+                "to": DEBUG_CLIENT,
+                "rank": rank,
+                "env": env,
+                "cwd": cwd,
             },
         )
 
+    @property
+    def request_id(self) -> Optional[int]:
+        """Id of the request that this message is (a reply to), used to tell
+        apart the replies of requests that are in flight at the same time."""
+        request_id: Optional[int] = self.data.get("id")
+        return request_id
+
+    def with_request_id(self, request_id: Optional[int]) -> "Message":
+        """Tag the message with a request id (see ``request_id``).
+
+        Args:
+            request_id: id of the request, None leaves the message untagged.
+
+        Returns:
+            The message itself.
+        """
+        if request_id is not None:
+            self.data["id"] = request_id
+        return self
+
+    def rank_count(self) -> int:
+        """Number of ranks whose results are contained in a command response,
+        including ranks without results (see ``missing_response``)."""
+        missing = sum(len(self.data.get(reason, ())) for reason in MISSING_REASONS)
+        if "ranks" in self.data:
+            return len(self.data["ranks"]) + missing
+        if "results" in self.data:
+            return sum(len(ranks) for ranks in self.data["results"].values()) + missing
+        return len(self.data["result"]) + missing
+
+    def replied_ranks(self) -> RankSet:
+        """Ranks accounted for by a command response (see ``rank_count``)."""
+        groups: list[RankSet] = [
+            self.data[reason] for reason in MISSING_REASONS if reason in self.data
+        ]
+        if "ranks" in self.data:
+            groups.append(self.data["ranks"])
+        elif "results" in self.data:
+            groups += self.data["results"].values()
+        else:
+            groups.append(RankSet([int(rank) for rank in self.data["result"]]))
+        return RankSet.from_ranges(r for group in groups for r in group.ranges)
+
     def to_json(self) -> bytes:
         msg = dict(msg_type=self.msg_type, data=self.data)
-        return json.dumps(msg).encode()
+        return json.dumps(msg, default=_json_default).encode()
+
+    def to_binary(self) -> bytes:
+        out: list[bytes] = []
+        _pack(self.msg_type, out)
+        _pack(self.data, out)
+        return b"".join(out)
+
+    def encode(self, wire_format: str) -> bytes:
+        if wire_format == "binary":
+            return self.to_binary()
+        return self.to_json()
@@ -0,0 +1,389 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import asyncio
+import fcntl
+import logging
+import os
+import re
+import socket
+from contextlib import suppress
+from typing import Any, Optional
+
+from .async_connection import AsyncConnection
+from .debug_client import DebugClient
+from .messages import Message
+from .pty_process import PtyProcess
+from .trace import (
+    TRACE_MARKER,
+    TraceBuffer,
+    inferior_probe,
+    split_inferior,
+    trace_buffer_size,
+)
+from .utils import socket_directory
+
+logger = logging.getLogger(__name__)
+
+# gdb commands that resume the program (including abbreviations)
+EXECUTION_COMMAND = re.compile(
+    r"^\s*(c|cont|continue|fg|n|next|s|step|ni|nexti|si|stepi|fin|finish"
+    r"|u|until|adv|advance|j|jump)(\s|$)"
+)
+
+
+def node_socket_path(exchange_hostname: str, exchange_port: int) -> str:
+    """Path of the socket shared by all wrappers of one job on one node.
+
+    Args:
+        exchange_hostname: hostname of the exchange server.
+        exchange_port: port of the exchange server.
+
+    Returns:
+        The path of the node socket.
+    """
+    return os.path.join(socket_directory(), f"{exchange_hostname}-{exchange_port}.sock")
+
+
+def elect_leader(path: str) -> Optional[socket.socket]:
+    """Try to become the node leader, i.e., the wrapper that debugs every
+    rank on this node.
+
+    The socket is bound and listening under a unique name before it is
+    hard linked to ``path``, so exactly one wrapper wins and followers never
+    see a socket that isn't accepting connections yet.
+
+    Args:
+        path: path of the node socket (see ``node_socket_path``).
+
+    Returns:
+        The listening socket if this wrapper is the leader, else None.
+    """
+    tmp_path = f"{path}.{os.getpid()}"
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.bind(tmp_path)
+        sock.listen()
+        os.link(tmp_path, path)
+    except FileExistsError:
+        sock.close()
+        return None
+    finally:
+        with suppress(FileNotFoundError):
+            os.unlink(tmp_path)
+    return sock
+
+
+class NodeDebugClient(DebugClient):
+    """Debug client that debugs every rank on its node over a single
+    exchange server connection.
+
+    The other wrappers on the node hand their rank (and MPI environment) over
+    to this one via the node socket and then wait for it to exit.
+    """
+
+    def __init__(self, opts: dict[str, Any], sock: socket.socket):
+        super().__init__(opts=opts)
+        self.sock = sock
+        # keep followers connected so they stay alive as long as we do
+        self.followers: list[AsyncConnection] = []
+
+    async def connect(self) -> None:
+        await super().connect()
+        # followers can only be registered once the exchange is connected
+        self.server = await asyncio.start_unix_server(
+            self.handle_follower, sock=self.sock
+        )
+
+    async def handle_follower(
+        self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+    ) -> None:
+        conn = AsyncConnection(reader, writer)
+        try:
+            msg = await conn.recv_message()
+        except asyncio.IncompleteReadError:
+            # a follower checking that we are still here (see `is_listening`)
+            return
+        self.followers.append(conn)
+        logger.info("node wrapper debugging rank %d", msg.data["rank"])
+        await self.add_rank(msg.data["rank"], env=msg.data["env"], cwd=msg.data["cwd"])
+
+
+def environment_commands(env: dict[str, str], base_env: dict[str, str]) -> list[str]:
+    """gdb commands that change an inferior's environment from ``base_env``
+    (which every inferior inherits from gdb) to ``env``.
+
+    Args:
+        env: environment the inferior should run with.
+        base_env: environment gdb was started with.
+
+    Returns:
+        The list of ``set environment`` and ``unset environment`` commands.
+    """
+    commands = [f"unset environment {name}" for name in base_env if name not in env]
+    for name, value in env.items():
+        # gdb reads one command per line so multi-line values can't be set
+        if base_env.get(name) != value and "\n" not in value:
+            commands.append(f"set environment {name}={value}")
+    return commands
+
+
+class MultiInferiorDebugClient(NodeDebugClient):
+    """Node wrapper that debugs every rank on its node from a single gdb, one
+    inferior per rank, so the target's symbols are only loaded once.
+
+    Commands are routed to each rank with ``inferior N``. With
+    ``schedule-multiple`` on, resuming one rank lets the other local ranks
+    run too, so ranks waiting on each other in MPI calls don't deadlock.
+    Execution commands (e.g., ``continue``) therefore run once for the whole
+    node (see ``run_on_ranks``).
+    """
+
+    def __init__(self, opts: dict[str, Any], sock: socket.socket):
+        super().__init__(opts=opts, sock=sock)
+        if not self.backend.multi_inferior:
+            raise ValueError(
+                f"Debugger backend does not support multiple inferiors: {self.backend.name}"
+            )
+        self.runtimeOptions.append("set schedule-multiple on")
+        self.gdb: Optional[PtyProcess] = None
+        # gdb inferior number of each local rank
+        self.inferiors: dict[int, int] = {}
+        # gdb only runs one command at a time
+        self.lock = asyncio.Lock()
+        self.active_rank: Optional[int] = None
+
+    async def gdb_command(self, command: str) -> str:
+        assert self.gdb is not None
+        self.gdb.sendline(command)
+        logger.debug("running gdb command: [%s]", command)
+        return await self.gdb.expect(self.backend.prompt_string)
+
+    async def init_debug_proc(
+        self,
+        rank: int,
+        env: Optional[dict[str, str]] = None,
+        cwd: Optional[str] = None,
+    ) -> None:
+        async with self.lock:
+            if self.gdb is None:
+                # the first rank starts gdb and becomes inferior 1
+                await super().init_debug_proc(rank, env=env, cwd=cwd)
+                self.gdb = self.dbg_procs[rank]
+                self.inferiors[rank] = 1
+                return
+
+            output = await self.gdb_command(f"add-inferior -exec {self.target}")
+            m = re.search(r"inferior (\d+)", output)
+            if m is None:
+                raise RuntimeError(f"failed to add inferior for rank {rank}: {output}")
+            number = int(m.group(1))
+
+            commands = [f"inferior {number}", f"set args {' '.join(self.args)}"]
+            if cwd is not None:
+                commands.append(f"set cwd {cwd}")
+            if env is not None:
+                commands += environment_commands(env, dict(os.environ))
+            command = self.backend.start_command
+            if self.stdout is not None:
+                command += f" >> {self.stdout}"
+            commands.append(command)
+            for command in commands:
+                await self.gdb_command(command)
+
+            logger.debug("rank %d is inferior %d", rank, number)
+            self.inferiors[rank] = number
+            self.traces[rank] = TraceBuffer(trace_buffer_size())
+            self.dbg_procs[rank] = self.gdb
+
+    def record_trace_hit(self, rank: int, line: str) -> None:
+        # every rank shares one gdb, so the hit says which inferior it came
+        # from (see `install_probe`)
+        try:
+            inferior, hit = split_inferior(line[len(TRACE_MARKER) :])
+        except ValueError:
+            logger.warning("cannot parse trace hit: %s", line)
+            return
+        ranks = {number: rank for rank, number in self.inferiors.items()}
+        if inferior not in ranks:
+            logger.warning("trace hit from unknown inferior %d: %s", inferior, line)
+            return
+        self.traces[ranks[inferior]].append(hit)
+
+    async def run_on_rank(self, rank: int, command: str) -> str:
+        async with self.lock:
+            self.active_rank = rank
+            await self.gdb_command(f"inferior {self.inferiors[rank]}")
+            return await super().run_on_rank(rank, command)
+
+    async def resume(self, rank: int, command: str) -> tuple[str, Optional[int]]:
+        """Run an execution command, which resumes every inferior until one
+        of them stops (gdb then stops the others too).
+
+        Args:
+            rank: rank the command is run from.
+            command: execution command, e.g., ``continue``.
+
+        Returns:
+            The output of the command and the rank that stopped, or None if
+            it isn't known.
+        """
+        assert self.gdb is not None
+        async with self.lock:
+            self.active_rank = rank
+            await self.gdb_command(f"inferior {self.inferiors[rank]}")
+            output = await super().run_on_rank(rank, command)
+            if self.gdb.closed:
+                return output, None
+            # gdb switches to the inferior that stopped
+            current = await self.gdb_command("inferior")
+        m = re.search(r"Current inferior is (\d+)", current)
+        if m is None:
+            return output, None
+        ranks = {number: rank for rank, number in self.inferiors.items()}
+        return output, ranks.get(int(m.group(1)))
+
+    async def install_probe(
+        self, ranks: list[int], probe: str
+    ) -> list[tuple[str, bool, Optional[str]]]:
+        """Install a trace probe once for the node. gdb sets breakpoints in
+        every inferior, so the probe is limited to the inferiors of
+        ``ranks`` with a condition.
+
+        Args:
+            ranks: ranks to trace.
+            probe: ``dprintf`` command made by ``inferior_probe``.
+
+        Returns:
+            The same reply for each rank (see ``run_and_check``).
+        """
+        assert self.gdb is not None
+        condition = " || ".join(
+            f"$_inferior == {self.inferiors[rank]}" for rank in ranks
+        )
+        async with self.lock:
+            self.active_rank = ranks[0]
+            output = await super().run_on_rank(ranks[0], probe)
+            failed = self.command_failed(ranks[0], output)
+            if not failed and not self.gdb.closed:
+                # `$bpnum` is the number of the probe that was just set
+                await self.gdb_command(f"condition $bpnum {condition}")
+        return [(output, failed, None) for _ in ranks]
+
+    async def run_on_ranks(
+        self, ranks: list[int], command: str, query: bool = False
+    ) -> list[tuple[str, bool, Optional[str]]]:
+        probe = inferior_probe(command)
+        if ranks and probe is not None:
+            return await self.install_probe(ranks, probe)
+        if not ranks or EXECUTION_COMMAND.match(command) is None:
+            return await super().run_on_ranks(ranks, command, query)
+        # running the command once per rank would resume every inferior each
+        # time, carrying ranks past the stops that were just reported
+        output, stopped = await self.resume(ranks[0], command)
+        failed = self.command_failed(ranks[0], output)
+        # the output describes the stop, so it goes to the rank that stopped
+        reporter = stopped if stopped in ranks else ranks[0]
+        if stopped is None:
+            stopped = reporter
+        note = f"\r\nStopped because rank {stopped} stopped.\r\n"
+        return [(output if rank == reporter else note, failed, None) for rank in ranks]
+
+    async def interrupt_rank(self, rank: int) -> str:
+        # every rank shares one gdb, so only interrupt it once
+        if rank != self.active_rank:
+            return ""
+        return await super().interrupt_rank(rank)
+
+
+async def follow_leader(path: str, rank: int) -> bool:
+    """Hand a rank over to the node leader and wait until the leader exits.
+
+    Args:
+        path: path of the node socket (see ``node_socket_path``).
+        rank: rank of this wrapper.
+
+    Returns:
+        False if no leader is listening on the node socket.
+    """
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        return False
+
+    conn = AsyncConnection(reader, writer)
+    await conn.send_message(
+        Message.node_register(rank=rank, env=dict(os.environ), cwd=os.getcwd())
+    )
+    # the MPI launcher still sees this process as the rank so it has to stay
+    # alive until the leader exits
+    await reader.read()
+    writer.close()
+    return True
+
+
+def is_listening(path: str) -> bool:
+    """Check if a node leader is listening on the node socket.
+
+    Args:
+        path: path of the node socket (see ``node_socket_path``).
+
+    Returns:
+        False if the connection is refused, e.g., because the socket was left
+        behind by a leader that crashed.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.setblocking(False)
+        try:
+            sock.connect(path)
+        except (ConnectionRefusedError, FileNotFoundError):
+            return False
+        except BlockingIOError:
+            # the leader's backlog is full, but it is there
+            pass
+    return True
+
+
+def remove_stale_socket(path: str) -> None:
+    """Remove the node socket if nobody is listening on it.
+
+    Leaders remove their socket while they are still listening, so once a
+    connection is refused only other followers can remove the socket. They
+    check and remove it under a lock on the socket directory, else a
+    follower could remove the socket of a leader that another follower has
+    just elected after removing the stale one.
+
+    Args:
+        path: path of the node socket (see ``node_socket_path``).
+    """
+    directory = os.open(os.path.dirname(path), os.O_RDONLY)
+    try:
+        fcntl.flock(directory, fcntl.LOCK_EX)
+        if os.path.exists(path) and not is_listening(path):
+            logger.warning("removing stale node socket [%s]", path)
+            os.unlink(path)
+    finally:
+        # closing the directory releases the lock
+        os.close(directory)
+
+
+async def run_node_wrapper(opts: dict[str, Any]) -> None:
+    """Run as either the node leader or one of its followers."""
+    path = node_socket_path(opts["exchange_hostname"], opts["exchange_port"])
+    while True:
+        sock = elect_leader(path)
+        if sock is not None:
+            logger.info("rank %s is the node leader", opts["rank"])
+            if opts.get("multi_inferior", False):
+                client: NodeDebugClient = MultiInferiorDebugClient(opts, sock)
+            else:
+                client = NodeDebugClient(opts, sock)
+            try:
+                await client.run()
+            finally:
+                os.unlink(path)
+            return
+        if await follow_leader(path, int(opts["rank"])):
+            return
+        # nobody is listening so the socket was left behind by an old job
+        remove_stale_socket(path)
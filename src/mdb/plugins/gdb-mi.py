@@ -0,0 +1,62 @@
+import re
+from typing import Optional
+
+from mdb.backend import DebugBackend
+
+# MI commands that return the structured equivalent of a CLI command's
+# output. None of them have side effects so they can run after the command
+STRUCTURED_QUERIES = [
+    (re.compile(r"^\s*(bt|backtrace|where)(\s|$)"), "-stack-list-frames"),
+    # `$` is the value that was just printed, so it isn't evaluated twice
+    (re.compile(r"^\s*(p|print)(\s|/)"), '-data-evaluate-expression "$"'),
+    (re.compile(r"^\s*(i|info)\s+(b|br|break|breakpoints)(\s|$)"), "-break-list"),
+    (
+        re.compile(r"^\s*(i|info)\s+locals(\s|$)"),
+        "-stack-list-locals --simple-values",
+    ),
+]
+
+
+class GDBMIBackend(DebugBackend):
+
+    @property
+    def name(self) -> str:
+        return "gdb-mi"
+
+    @property
+    def debug_command(self) -> str:
+        return "gdb -q --interpreter=mi3"
+
+    @property
+    def argument_separator(self) -> str:
+        return "--args"
+
+    @property
+    def prompt_string(self) -> str:
+        return r"\(gdb\) \r?\n"
+
+    @property
+    def default_options(self) -> list[str]:
+        commands = ["set pagination off", "set confirm off"]
+        return commands
+
+    @property
+    def start_command(self) -> str:
+        return "start"
+
+    @property
+    def float_regex(self) -> str:
+        return r"\d+ = ([+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?)"
+
+    def runtime_options(self, opts: dict[str, str]) -> list[str]:
+        return []
+
+    @property
+    def machine_interface(self) -> bool:
+        return True
+
+    def structured_query(self, command: str) -> Optional[str]:
+        for regex, query in STRUCTURED_QUERIES:
+            if regex.match(command):
+                return query
+        return None
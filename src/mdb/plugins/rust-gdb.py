@@ -1,4 +1,4 @@
-from mdb.backend import DebugBackend
+from mdb.backend import GDB_ERROR_REGEX, GDB_FRAME_REGEX, DebugBackend
 
 
 class GDBBackend(DebugBackend):
@@ -32,5 +32,17 @@ class GDBBackend(DebugBackend):
     def float_regex(self) -> str:
         return r"\d+ = ([+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?)"
 
+    @property
+    def error_regex(self) -> str:
+        return GDB_ERROR_REGEX
+
+    @property
+    def frame_regex(self) -> str:
+        return GDB_FRAME_REGEX
+
     def runtime_options(self, opts: dict[str, str]) -> list[str]:
         return []
+
+    @property
+    def multi_inferior(self) -> bool:
+        return True
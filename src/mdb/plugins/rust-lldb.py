@@ -30,5 +30,16 @@ class LLDBBackend(DebugBackend):
     def float_regex(self) -> str:
         return r"\d+ = ([+-]?(\d+(\.\d*)?|\.\d+)([eE][+-]?\d+)?)"
 
+    @property
+    def error_regex(self) -> str:
+        return r"(?m)^error: "
+
+    @property
+    def frame_regex(self) -> str:
+        # e.g., `* frame #0: 0x... a.out`main at test.c:3:5`
+        return (
+            r"(?m)^[\s*]*frame #\d+: (?:0x[0-9a-fA-F]+ )?\S*`(.+?)(?: at | \+ \d+|\s*$)"
+        )
+
     def runtime_options(self, opts: dict[str, str]) -> list[str]:
         return []
@@ -0,0 +1,224 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import asyncio
+import codecs
+import errno
+import fcntl
+import os
+import re
+import shlex
+import struct
+import termios
+from typing import Callable, Optional
+
+# how far back from the newest output a prompt can start. Anything before
+# that has already been searched, so each byte of output is only searched
+# once however large the output of a command is
+PROMPT_WINDOW = 1024
+READ_SIZE = 65536
+# same terminal size as pexpect, so debuggers format their output the same way
+TERMINAL_SIZE = (24, 80)
+
+
+class PtyProcess:
+    """A process (i.e., a debugger) running in a pseudo terminal, read with
+    asyncio.
+
+    Output is kept as a list of chunks and prompts are only searched for in
+    the newest output (see ``PROMPT_WINDOW``), so waiting for the prompt
+    after a command with a large output takes linear rather than quadratic
+    time.
+    """
+
+    def __init__(self, proc: asyncio.subprocess.Process, fd: int) -> None:
+        self.proc = proc
+        self.fd = fd
+        self.closed = False
+        # output that hasn't been returned by `expect` yet
+        self.chunks: list[str] = []
+        self.data = asyncio.Event()
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.patterns: dict[str, re.Pattern[str]] = {}
+        # lines that are passed to a handler instead of `expect` (see
+        # `divert_lines`), and the start of such a line until it is complete
+        self.marker = ""
+        self.handler: Optional[Callable[[str], None]] = None
+        self.held = ""
+        asyncio.get_running_loop().add_reader(fd, self._read)
+
+    @classmethod
+    async def spawn(
+        cls,
+        command: str,
+        env: Optional[dict[str, str]] = None,
+        cwd: Optional[str] = None,
+    ) -> "PtyProcess":
+        """Start a process in a new pseudo terminal.
+
+        Args:
+            command: command line of the process.
+            env: environment of the process. Defaults to the environment of
+              this process.
+            cwd: working directory of the process. Defaults to the working
+              directory of this process.
+
+        Returns:
+            The running process.
+        """
+        fd, tty = os.openpty()
+        os.set_blocking(fd, False)
+        fcntl.ioctl(tty, termios.TIOCSWINSZ, struct.pack("HHHH", *TERMINAL_SIZE, 0, 0))
+
+        def make_controlling_terminal() -> None:
+            # needed so that ctrl-c (see `sendintr`) interrupts the process
+            fcntl.ioctl(0, termios.TIOCSCTTY, 0)
+
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *shlex.split(command),
+                stdin=tty,
+                stdout=tty,
+                stderr=tty,
+                env=env,
+                cwd=cwd,
+                start_new_session=True,
+                preexec_fn=make_controlling_terminal,
+            )
+        except BaseException:
+            os.close(fd)
+            raise
+        finally:
+            os.close(tty)
+        return cls(proc, fd)
+
+    @property
+    def pid(self) -> int:
+        return self.proc.pid
+
+    async def wait(self) -> int:
+        """Wait for the process to exit.
+
+        Returns:
+            The exit code of the process.
+        """
+        return await self.proc.wait()
+
+    def _read(self) -> None:
+        try:
+            data = os.read(self.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            # linux reports EIO once the process has closed the terminal
+            if e.errno != errno.EIO:
+                raise
+            data = b""
+        if data:
+            text = self.decoder.decode(data)
+        else:
+            text = self.decoder.decode(b"", final=True)
+            self.close()
+        if self.handler is not None:
+            text = self._divert(text)
+        if text:
+            self.chunks.append(text)
+        self.data.set()
+
+    def divert_lines(self, marker: str, handler: Callable[[str], None]) -> None:
+        """Pass lines of output that start with ``marker`` to ``handler`` as
+        soon as they are read, e.g., output that the debugger prints while
+        the program runs. These lines are never returned by ``expect``.
+
+        Args:
+            marker: start of the lines.
+            handler: called with each line, without the line break.
+        """
+        self.marker = marker
+        self.handler = handler
+
+    def _divert(self, text: str) -> str:
+        assert self.handler is not None
+        if not self.held and self.marker not in text:
+            # only split the output into lines if it may contain a marker
+            tail = text[text.rfind("\n") + 1 :].lstrip("\r")
+            if not tail or not self.marker.startswith(tail):
+                return text
+        *lines, last = (self.held + text).split("\n")
+        self.held = ""
+        kept = []
+        for line in lines:
+            stripped = line.strip("\r")
+            if stripped.startswith(self.marker):
+                self.handler(stripped)
+            else:
+                kept.append(line + "\n")
+        # hold back the start of a line that may turn out to be a marked line
+        start = last.lstrip("\r")
+        if (
+            start
+            and not self.closed
+            and (start.startswith(self.marker) or self.marker.startswith(start))
+        ):
+            self.held = last
+        else:
+            kept.append(last)
+        return "".join(kept)
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            asyncio.get_running_loop().remove_reader(self.fd)
+            os.close(self.fd)
+            self.fd = -1
+        self.closed = True
+
+    def send(self, text: str) -> None:
+        os.write(self.fd, text.encode())
+
+    def sendline(self, line: str) -> None:
+        self.send(line + "\n")
+
+    def sendintr(self) -> None:
+        """Send ctrl-c, i.e., SIGINT to the foreground process."""
+        self.send(chr(termios.tcgetattr(self.fd)[6][termios.VINTR][0]))
+
+    def _pattern(self, pattern: str) -> re.Pattern[str]:
+        if pattern not in self.patterns:
+            self.patterns[pattern] = re.compile(pattern)
+        return self.patterns[pattern]
+
+    async def expect(self, pattern: str, eof: bool = False) -> str:
+        """Wait for output that matches ``pattern``, e.g., the prompt.
+
+        Args:
+            pattern: regular expression (shorter than ``PROMPT_WINDOW``).
+            eof: also stop waiting if the process exits.
+
+        Returns:
+            The output before the match. The match is dropped and any output
+            after it is kept for the next call.
+        """
+        regex = self._pattern(pattern)
+        # end of the output where the prompt is searched for. Only new chunks
+        # are joined to it, never the whole output
+        tail = ""
+        searched = 0
+        while True:
+            new = self.chunks[searched:]
+            if new:
+                tail = tail[-PROMPT_WINDOW:] + "".join(new)
+                searched = len(self.chunks)
+                m = regex.search(tail)
+                if m is not None:
+                    output = "".join(self.chunks)
+                    start = len(output) - len(tail)
+                    self.chunks = [output[start + m.end() :]]
+                    return output[: start + m.start()]
+            if self.closed:
+                if not eof:
+                    raise EOFError("debug process exited")
+                output = "".join(self.chunks)
+                self.chunks = []
+                return output
+            self.data.clear()
+            await self.data.wait()
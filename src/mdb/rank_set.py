@@ -0,0 +1,173 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+from __future__ import annotations
+
+import re
+from bisect import bisect_right
+from typing import Any, Iterable, Iterator
+
+
+class RankSet:
+    """Immutable set of MPI ranks stored as sorted, disjoint, inclusive
+    ranges, e.g., ranks ``0-511,513-1023`` are stored as two ranges no matter
+    how many ranks they contain.
+
+    Membership tests are O(log n) in the number of ranges and set algebra is
+    linear in the number of ranges rather than the number of ranks.
+    """
+
+    __slots__ = ("_starts", "_ends", "_len")
+
+    def __init__(self, ranks: Iterable[int] = ()) -> None:
+        ranges: list[tuple[int, int]] = []
+        for rank in sorted(set(ranks)):
+            if ranges and rank == ranges[-1][1] + 1:
+                ranges[-1] = (ranges[-1][0], rank)
+            else:
+                ranges.append((rank, rank))
+        self._set_ranges(ranges)
+
+    def _set_ranges(self, ranges: list[tuple[int, int]]) -> None:
+        # ranges must already be sorted, disjoint and non-adjacent
+        self._starts = [start for start, _ in ranges]
+        self._ends = [end for _, end in ranges]
+        self._len = sum(end - start + 1 for start, end in ranges)
+
+    @staticmethod
+    def from_ranges(ranges: Iterable[tuple[int, int]]) -> RankSet:
+        """Create a rank set from inclusive ``(start, end)`` ranges. The ranges
+        may be unsorted, overlapping or adjacent.
+
+        Args:
+            ranges: iterable of inclusive ``(start, end)`` tuples.
+
+        Returns:
+            The rank set containing every rank in the ranges.
+        """
+        merged: list[tuple[int, int]] = []
+        for start, end in sorted(ranges):
+            if start > end:
+                raise ValueError(f"invalid rank range [{start}-{end}]")
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+            else:
+                merged.append((start, end))
+        rank_set = RankSet()
+        rank_set._set_ranges(merged)
+        return rank_set
+
+    @staticmethod
+    def parse(text: str) -> RankSet:
+        """Parse a string of ranks into a rank set. E.g.,
+        ``RankSet.parse("1,3-5")`` contains ranks 1, 3, 4 and 5. Ranges are
+        never expanded so very large selections are cheap to parse.
+
+        Args:
+            text: string of ranks using either a mix of comma separation and
+              ranges using hyphen.
+
+        Returns:
+            The rank set.
+        """
+        ranges = []
+        for part in text.split(","):
+            m = re.fullmatch(r"\s*(\d+)\s*(?:-\s*(\d+)\s*)?", part)
+            if m is None:
+                raise ValueError(f"invalid rank specification [{text}]")
+            start = int(m.group(1))
+            end = int(m.group(2)) if m.group(2) is not None else start
+            ranges.append((start, end))
+        return RankSet.from_ranges(ranges)
+
+    @property
+    def ranges(self) -> list[tuple[int, int]]:
+        """The inclusive ``(start, end)`` ranges in ascending order."""
+        return list(zip(self._starts, self._ends))
+
+    def first(self) -> int:
+        """Return the lowest rank in the set."""
+        if not self._starts:
+            raise ValueError("empty rank set has no first rank")
+        return self._starts[0]
+
+    def __contains__(self, rank: object) -> bool:
+        if not isinstance(rank, int):
+            return False
+        i = bisect_right(self._starts, rank) - 1
+        return i >= 0 and rank <= self._ends[i]
+
+    def __iter__(self) -> Iterator[int]:
+        for start, end in zip(self._starts, self._ends):
+            yield from range(start, end + 1)
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __bool__(self) -> bool:
+        return self._len > 0
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, RankSet):
+            return NotImplemented
+        return self._starts == other._starts and self._ends == other._ends
+
+    def __hash__(self) -> int:
+        return hash((tuple(self._starts), tuple(self._ends)))
+
+    def __str__(self) -> str:
+        return ",".join(
+            str(start) if start == end else f"{start}-{end}"
+            for start, end in zip(self._starts, self._ends)
+        )
+
+    def __repr__(self) -> str:
+        return f"RankSet('{self}')"
+
+    def __or__(self, other: RankSet) -> RankSet:
+        return RankSet.from_ranges(self.ranges + other.ranges)
+
+    def __and__(self, other: RankSet) -> RankSet:
+        ranges = []
+        i = j = 0
+        a, b = self.ranges, other.ranges
+        while i < len(a) and j < len(b):
+            start = max(a[i][0], b[j][0])
+            end = min(a[i][1], b[j][1])
+            if start <= end:
+                ranges.append((start, end))
+            # drop whichever range finishes first
+            if a[i][1] < b[j][1]:
+                i += 1
+            else:
+                j += 1
+        rank_set = RankSet()
+        rank_set._set_ranges(ranges)
+        return rank_set
+
+    def __sub__(self, other: RankSet) -> RankSet:
+        ranges = []
+        b = other.ranges
+        j = 0
+        for start, end in self.ranges:
+            # skip ranges of other that end before this range starts
+            while j < len(b) and b[j][1] < start:
+                j += 1
+            k = j
+            while k < len(b) and b[k][0] <= end:
+                if b[k][0] > start:
+                    ranges.append((start, b[k][0] - 1))
+                start = max(start, b[k][1] + 1)
+                k += 1
+            if start <= end:
+                ranges.append((start, end))
+        rank_set = RankSet()
+        rank_set._set_ranges(ranges)
+        return rank_set
+
+    def __le__(self, other: RankSet) -> bool:
+        return self.issubset(other)
+
+    def issubset(self, other: RankSet) -> bool:
+        """Return True if every rank in this set is also in ``other``."""
+        return not (self - other)
@@ -0,0 +1,101 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+from typing import Any, Optional
+
+# operations of `reduce`, all of them are answered from the same partial
+# reduction (see `partial_reduction`)
+REDUCE_OPS = ["count", "sum", "mean", "min", "max", "argmin", "argmax", "histogram"]
+DEFAULT_BINS = 10
+
+# A partial reduction is a dict with the number of values, their sum, the
+# smallest and largest value with the (lowest) rank that has it, and
+# optionally a histogram. Partial reductions of disjoint sets of ranks are
+# combined with `combine_reductions`, so each debug client (and relay) only
+# sends a handful of numbers however many ranks it has.
+Reduction = dict[str, Any]
+
+
+def empty_reduction(bins: Optional[int] = None) -> Reduction:
+    reduction: Reduction = {
+        "count": 0,
+        "sum": 0.0,
+        "min": None,
+        "min_rank": None,
+        "max": None,
+        "max_rank": None,
+    }
+    if bins is not None:
+        reduction["bins"] = [0] * bins
+    return reduction
+
+
+def histogram_bin(value: float, bins: int, low: float, high: float) -> int:
+    """Find the bin of a value in a histogram of ``bins`` equal bins between
+    ``low`` and ``high``. Values outside of the range go in the first or last
+    bin.
+
+    Returns:
+        The index of the bin.
+    """
+    if high <= low:
+        return 0
+    index = int((value - low) / (high - low) * bins)
+    return min(max(index, 0), bins - 1)
+
+
+def partial_reduction(
+    values: dict[int, float],
+    histogram: Optional[tuple[int, float, float]] = None,
+) -> Reduction:
+    """Reduce the values of some ranks.
+
+    Args:
+        values: dict mapping each rank to its value.
+        histogram: number of bins and range (low, high) of the histogram,
+          None if no histogram is needed.
+
+    Returns:
+        The partial reduction (see ``Reduction``).
+    """
+    reduction = empty_reduction(None if histogram is None else histogram[0])
+    for rank, value in sorted(values.items()):
+        reduction["count"] += 1
+        reduction["sum"] += value
+        if reduction["min"] is None or value < reduction["min"]:
+            reduction["min"], reduction["min_rank"] = value, rank
+        if reduction["max"] is None or value > reduction["max"]:
+            reduction["max"], reduction["max_rank"] = value, rank
+        if histogram is not None:
+            reduction["bins"][histogram_bin(value, *histogram)] += 1
+    return reduction
+
+
+def combine_reductions(reductions: list[Reduction]) -> Reduction:
+    """Combine partial reductions of disjoint sets of ranks.
+
+    Args:
+        reductions: partial reductions (see ``partial_reduction``), all with
+          or all without a histogram of the same bins.
+
+    Returns:
+        The partial reduction of all of the ranks.
+    """
+    bins = [r["bins"] for r in reductions if "bins" in r]
+    combined = empty_reduction(len(bins[0]) if bins else None)
+    for reduction in reductions:
+        if not reduction["count"]:
+            continue
+        combined["count"] += reduction["count"]
+        combined["sum"] += reduction["sum"]
+        # ties go to the lowest rank, as in `partial_reduction`
+        low = (reduction["min"], reduction["min_rank"])
+        if combined["min"] is None or low < (combined["min"], combined["min_rank"]):
+            combined["min"], combined["min_rank"] = low
+        high = (reduction["max"], -reduction["max_rank"])
+        if combined["max"] is None or high > (combined["max"], -combined["max_rank"]):
+            combined["max"] = reduction["max"]
+            combined["max_rank"] = reduction["max_rank"]
+    for counts in bins:
+        combined["bins"] = [a + b for a, b in zip(combined["bins"], counts)]
+    return combined
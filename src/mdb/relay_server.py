@@ -0,0 +1,211 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import asyncio
+import logging
+from dataclasses import dataclass
+from typing import Any
+
+from .async_client import (
+    CONNECTION_BACKOFF,
+    CONNECTION_BACKOFF_MAX,
+    AsyncClient,
+)
+from .exchange_server import AsyncExchangeServer, PendingRequest
+from .messages import FabricRequest, Message
+from .rank_set import RankSet
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RelayNode:
+    """One relay in the tree planned by ``plan_relay_tree``."""
+
+    port: int
+    parent_port: int
+    ranks: RankSet
+
+
+def plan_relay_tree(
+    select: RankSet, fanout: int, port: int
+) -> tuple[list[RelayNode], dict[int, int]]:
+    """Plan a tree of relays so that no exchange server (or relay) has more
+    than ``fanout`` children. Ranks are split into consecutive blocks of
+    ``fanout`` ranks, each served by one relay. Further levels of relays are
+    added until the top level has at most ``fanout`` relays.
+
+    Args:
+        select: ranks that will be debugged.
+        fanout: maximum number of children of each node.
+        port: port of the exchange server. Relays use the following ports,
+          i.e., ``port + 1``, ``port + 2``, etc.
+
+    Returns:
+        The relays (parents before children) and a dict mapping each rank to
+        the port of the relay it should connect to.
+    """
+    if fanout < 2:
+        raise ValueError(f"relay fanout must be at least 2 [{fanout}]")
+
+    ranks = list(select)
+    next_port = port + 1
+
+    # leaves first, each level groups `fanout` nodes of the level below
+    levels: list[list[RelayNode]] = []
+    groups = [RankSet(ranks[i : i + fanout]) for i in range(0, len(ranks), fanout)]
+    while len(groups) > 1:
+        level = []
+        for group in groups:
+            level.append(RelayNode(port=next_port, parent_port=port, ranks=group))
+            next_port += 1
+        levels.append(level)
+        if len(level) <= fanout:
+            break
+        groups = []
+        for i in range(0, len(level), fanout):
+            children = level[i : i + fanout]
+            groups.append(
+                RankSet.from_ranges(r for child in children for r in child.ranks.ranges)
+            )
+
+    # now that every level has its ports, point each child at its parent
+    for children, parents in zip(levels, levels[1:]):
+        for i, child in enumerate(children):
+            child.parent_port = parents[i // fanout].port
+
+    rank_ports = {}
+    if levels:
+        for node in levels[0]:
+            for rank in node.ranks:
+                rank_ports[rank] = node.port
+
+    nodes = [node for level in reversed(levels) for node in level]
+    return nodes, rank_ports
+
+
+class RelayClient(AsyncClient):
+    """Connection from a relay to the exchange server (or relay) above it."""
+
+    async def register(self, ranks: RankSet, hosts: dict[str, int]) -> None:
+        """Connect to the parent and register all of the relay's ranks at
+        once, as if they were the ranks of a single debug client.
+
+        Args:
+            ranks: ranks connected to the relay.
+            hosts: number of ranks on each host.
+        """
+        await self.connect_to_exchange(Message.debug_conn_request())
+        await self.conn.send_message(
+            Message.debug_init_complete(ranks=ranks, hosts=hosts)
+        )
+        logger.info("relay registered ranks [%s] with parent", ranks)
+
+
+class RelayServer(AsyncExchangeServer):
+    """Intermediate exchange server in a tree of exchange servers.
+
+    Debug clients (or other relays) connect to a relay exactly as they would
+    connect to the exchange server. Once all of its ranks have connected, the
+    relay connects to its parent and registers all of its ranks at once.
+    Commands from the parent are fanned out to the children and their
+    responses are grouped (see ``Message.relay_command_response``) before
+    being sent upwards so the parent only handles one connection and one
+    message per relay.
+    """
+
+    def __init__(self, opts: dict[str, Any]):
+        super().__init__(
+            opts={
+                "number_of_ranks": opts["number_of_ranks"],
+                "select": opts["select"],
+                "hostname": opts["hostname"],
+                "port": opts["port"],
+                "backend": opts.get("backend", ""),
+                "launch_task": None,
+            }
+        )
+        self.parent = RelayClient(
+            opts={
+                "exchange_hostname": opts["exchange_hostname"],
+                "exchange_port": opts["exchange_port"],
+                "connection_attempts": opts["connection_attempts"],
+                "connection_backoff": opts.get(
+                    "connection_backoff", CONNECTION_BACKOFF
+                ),
+                "connection_backoff_max": opts.get(
+                    "connection_backoff_max", CONNECTION_BACKOFF_MAX
+                ),
+            }
+        )
+        # set once the relay's ranks have been registered with the parent
+        self.registered = False
+
+    def _report_progress(self) -> None:
+        logger.info(
+            "relay connected to ranks (%d/%d)",
+            self.debug_client_count,
+            self.max_debug_clients,
+        )
+
+    async def _send_response(
+        self, request: PendingRequest, messages: list[Message]
+    ) -> None:
+        await request.conn.send_message(
+            Message.relay_command_response(messages=messages).with_request_id(
+                request.client_id
+            )
+        )
+
+    async def _send_partial_response(
+        self,
+        request: PendingRequest,
+        messages: list[Message],
+        replied: int,
+        total: int,
+    ) -> None:
+        # the parent counts ranks, so each batch can be sent as a normal reply
+        await self._send_response(request, messages)
+
+    async def _send_merged_response(
+        self, request: PendingRequest, spec: FabricRequest, messages: list[Message]
+    ) -> None:
+        # the parent merges the reply with those of its other children
+        await request.conn.send_message(
+            Message.merged_response(spec.reply_type, messages).with_request_id(
+                request.client_id
+            )
+        )
+
+    def _report_lost(self, ranks: RankSet) -> None:
+        # the parent stops waiting for these ranks too and reports them to the
+        # clients (or its own parent)
+        if self.registered:
+            asyncio.create_task(
+                self.parent.conn.send_message(Message.debug_ranks_lost(ranks=ranks))
+            )
+
+    async def _end_stream(self, request: PendingRequest) -> None:
+        # only the exchange server at the top of the tree ends the stream
+        pass
+
+    async def run(self) -> None:
+        await self.start_server()
+        try:
+            # children may take a long time to start their debuggers so there
+            # is no timeout here, the exchange server at the top applies its own
+            await self.debuggers_ready.wait()
+
+            await self.parent.register(self.connected_ranks, self.host_ranks)
+            self.registered = True
+
+            await self._forward_commands(self.parent.conn)
+        finally:
+            self.close()
+
+    async def kill(self) -> None:
+        # the parent has gone away so drop the children, which then shut down
+        # in the same way as if they had lost the exchange server
+        for debugger in self.debuggers:
+            debugger.writer.close()
+        self.close()
@@ -0,0 +1,279 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import json
+import re
+from typing import Any, Iterable
+
+from .rank_set import RankSet
+
+# name of frames whose function is unknown, as printed by gdb
+UNKNOWN_FRAME = "??"
+
+# A stack tree is a prefix tree of call stacks, outermost frame first. Each
+# node is a dict ``{"ranks": RankSet, "children": {function: node}}`` so that
+# it can be sent over the wire as is. The root stands for the program itself,
+# its ranks are all of the ranks in the tree.
+StackTree = dict[str, Any]
+
+# stacks deeper than this (e.g., deep recursion) lose their middle frames,
+# which are replaced by `ELIDED_FRAMES`, so that trees stay shallow enough to
+# be merged and sent over the wire
+MAX_TREE_DEPTH = 64
+ELIDED_FRAMES = "..."
+
+
+def empty_tree() -> StackTree:
+    return {"ranks": RankSet(), "children": {}}
+
+
+def parse_backtrace(output: str, frame_regex: str) -> list[str]:
+    """Extract the function of each frame from the output of a backtrace.
+
+    Args:
+        output: output of the debugger's backtrace command, innermost frame
+          first.
+        frame_regex: regular expression whose first group is the function
+          of a frame (see ``DebugBackend.frame_regex``).
+
+    Returns:
+        The functions, outermost frame first.
+    """
+    funcs = [func.strip() or UNKNOWN_FRAME for func in re.findall(frame_regex, output)]
+    return funcs[::-1]
+
+
+def clip_stack(frames: list[str], max_depth: int = MAX_TREE_DEPTH) -> list[str]:
+    """Keep the outermost and innermost frames of a deep stack, e.g., the
+    frames of ``main`` and of the function that a deep recursion is stuck in.
+
+    Args:
+        frames: functions, outermost frame first.
+        max_depth: maximum number of frames, including ``ELIDED_FRAMES``.
+
+    Returns:
+        The frames, with ``ELIDED_FRAMES`` in place of the middle frames if
+        there are more than ``max_depth``.
+    """
+    if len(frames) <= max_depth:
+        return frames
+    outer = max_depth // 2
+    inner = max_depth - outer - 1
+    return frames[:outer] + [ELIDED_FRAMES] + frames[len(frames) - inner :]
+
+
+def build_tree(stacks: dict[int, list[str]]) -> StackTree:
+    """Merge the call stacks of several ranks into a prefix tree, e.g.,
+    ``build_tree({0: ["main", "a"], 1: ["main", "b"]})`` would return the
+    tree ``main (0-1) -> a (0), b (1)``.
+
+    Args:
+        stacks: dict mapping each rank to its functions, outermost frame
+          first. Deep stacks are clipped (see ``clip_stack``).
+
+    Returns:
+        The stack tree (see ``StackTree``).
+    """
+    # collect plain lists of ranks first, rank sets are built once at the end
+    root: dict[str, Any] = {"ranks": [], "children": {}}
+    for rank, frames in sorted(stacks.items()):
+        node = root
+        node["ranks"].append(rank)
+        for func in clip_stack(frames):
+            children = node["children"]
+            if func not in children:
+                children[func] = {"ranks": [], "children": {}}
+            node = children[func]
+            node["ranks"].append(rank)
+
+    def freeze(node: dict[str, Any]) -> StackTree:
+        return {
+            "ranks": RankSet(node["ranks"]),
+            "children": {
+                func: freeze(child) for func, child in node["children"].items()
+            },
+        }
+
+    return freeze(root)
+
+
+def merge_trees(trees: list[StackTree]) -> StackTree:
+    """Merge stack trees of disjoint sets of ranks, e.g., the trees sent by
+    each debug client (or relay).
+
+    Args:
+        trees: stack trees (see ``StackTree``).
+
+    Returns:
+        A single tree holding the stacks of every rank.
+    """
+    merged = empty_tree()
+    if not trees:
+        return merged
+    merged["ranks"] = RankSet.from_ranges(
+        r for tree in trees for r in tree["ranks"].ranges
+    )
+    grouped: dict[str, list[StackTree]] = {}
+    for tree in trees:
+        for func, child in tree["children"].items():
+            grouped.setdefault(func, []).append(child)
+    merged["children"] = {
+        func: children[0] if len(children) == 1 else merge_trees(children)
+        for func, children in grouped.items()
+    }
+    return merged
+
+
+def _sorted_children(node: StackTree) -> list[tuple[str, StackTree]]:
+    return sorted(node["children"].items(), key=lambda item: item[1]["ranks"].first())
+
+
+def _stopped_ranks(node: StackTree) -> RankSet:
+    # ranks whose stack ends at this node
+    below = RankSet.from_ranges(
+        r for child in node["children"].values() for r in child["ranks"].ranges
+    )
+    ranks: RankSet = node["ranks"]
+    return ranks - below
+
+
+def render_tree(tree: StackTree, indent: str = "  ") -> list[str]:
+    """Format a stack tree as indented lines, one per function, e.g.,
+    ``[0-7] main`` followed by ``  [0-3] MPI_Barrier``. Identical stacks
+    share their lines however many ranks there are.
+
+    Args:
+        tree: stack tree (see ``StackTree``).
+        indent: indentation added at each level of the tree.
+
+    Returns:
+        The lines, children ordered by their lowest rank.
+    """
+    lines = []
+    no_stack = _stopped_ranks(tree)
+    if no_stack:
+        lines.append(f"[{no_stack}] <no stack>")
+
+    def walk(node: StackTree, depth: int) -> None:
+        for func, child in _sorted_children(node):
+            lines.append(f"{indent * depth}[{child['ranks']}] {func}")
+            walk(child, depth + 1)
+
+    walk(tree, 0)
+    return lines
+
+
+def tree_to_dot(tree: StackTree) -> str:
+    """Export a stack tree as a graphviz graph, e.g., for ``dot -Tsvg``.
+
+    Args:
+        tree: stack tree (see ``StackTree``).
+
+    Returns:
+        The graph in the DOT language.
+    """
+    lines = ["digraph stacks {", "  node [shape=box];"]
+    count = 0
+
+    def walk(node: StackTree, name: str) -> None:
+        nonlocal count
+        for func, child in _sorted_children(node):
+            count += 1
+            child_name = f"n{count}"
+            label = json.dumps(f"{func}\n[{child['ranks']}]")
+            lines.append(f"  {child_name} [label={label}];")
+            if name:
+                lines.append(f"  {name} -> {child_name};")
+            walk(child, child_name)
+
+    walk(tree, "")
+    lines.append("}")
+    return "\n".join(lines) + "\n"
+
+
+def tree_to_json(tree: StackTree) -> str:
+    """Export a stack tree as json, with rank sets as strings like "0-3,7".
+
+    Args:
+        tree: stack tree (see ``StackTree``).
+
+    Returns:
+        The json text.
+    """
+
+    def convert(node: StackTree) -> dict[str, Any]:
+        return {
+            "ranks": str(node["ranks"]),
+            "children": {
+                func: convert(child) for func, child in _sorted_children(node)
+            },
+        }
+
+    return json.dumps(convert(tree), indent=2)
+
+
+# profiles hold at most this many stacks, the least common stacks beyond that
+# are counted together as `OTHER_STACKS` so memory use doesn't grow with the
+# number of ranks (see `merge_profiles`)
+MAX_PROFILE_STACKS = 4096
+# per-rank profiles are smaller because there is one for each rank
+MAX_RANK_PROFILE_STACKS = 256
+OTHER_STACKS = "[other]"
+
+
+def fold_stack(frames: list[str]) -> str:
+    """Join the functions of a stack in the folded format read by flame graph
+    tools, e.g., ``main;solve;MPI_Barrier``.
+
+    Args:
+        frames: functions, outermost frame first.
+
+    Returns:
+        The folded stack.
+    """
+    return ";".join(frames) or UNKNOWN_FRAME
+
+
+def merge_profiles(
+    profiles: Iterable[dict[str, int]], max_stacks: int = MAX_PROFILE_STACKS
+) -> dict[str, int]:
+    """Add up folded stack profiles, i.e., dicts mapping each folded stack
+    (see ``fold_stack``) to the number of samples in which it was seen.
+
+    Args:
+        profiles: profiles to merge.
+        max_stacks: maximum number of stacks in the merged profile. The
+          samples of the least common stacks are counted as ``OTHER_STACKS``
+          instead, so the total number of samples is unchanged.
+
+    Returns:
+        The merged profile, most common stacks first.
+    """
+    merged: dict[str, int] = {}
+    for profile in profiles:
+        for stack, count in profile.items():
+            merged[stack] = merged.get(stack, 0) + count
+    ranked = sorted(merged.items(), key=lambda item: item[1], reverse=True)
+    if len(ranked) <= max_stacks:
+        return dict(ranked)
+    kept = dict(ranked[: max_stacks - 1])
+    kept[OTHER_STACKS] = kept.get(OTHER_STACKS, 0) + sum(
+        count for _, count in ranked[max_stacks - 1 :]
+    )
+    return kept
+
+
+def folded_lines(profile: dict[str, int], prefix: str = "") -> list[str]:
+    """Format a profile as the lines of a folded stacks file, e.g., for
+    ``flamegraph.pl``.
+
+    Args:
+        profile: profile (see ``merge_profiles``).
+        prefix: frame prepended to every stack, e.g., ``rank 3``.
+
+    Returns:
+        One ``stack count`` line per stack.
+    """
+    if prefix:
+        return [f"{prefix};{stack} {count}" for stack, count in profile.items()]
+    return [f"{stack} {count}" for stack, count in profile.items()]
@@ -0,0 +1,121 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import os
+import re
+from collections import deque
+from typing import Optional
+
+# start of every line printed by a trace probe, so that the debug client can
+# tell trace hits apart from the rest of the debugger's output
+TRACE_MARKER = "@mdb-trace:"
+# hits kept per rank until they are fetched, older hits are dropped
+TRACE_BUFFER_SIZE = 10000
+
+# `LOCATION,"FORMAT",ARGS` as passed to gdb's `dprintf`
+_DPRINTF_REGEX = re.compile(r'^\s*([^,]+?)\s*,\s*"((?:[^"\\]|\\.)*)"(.*)$')
+# a `dprintf` command made by `dprintf_command`, split around the marker
+_PROBE_REGEX = re.compile(
+    r'^(\s*dprintf\s+[^,]+?\s*,\s*")'
+    + re.escape(TRACE_MARKER)
+    + r'((?:[^"\\]|\\.)*")(.*)$'
+)
+
+
+def trace_buffer_size() -> int:
+    """Number of hits each rank keeps, set with ``MDB_TRACE_BUFFER``.
+
+    Returns:
+        The size of the per-rank buffers.
+    """
+    size = int(os.environ.get("MDB_TRACE_BUFFER", TRACE_BUFFER_SIZE))
+    if size < 1:
+        raise ValueError(f"MDB_TRACE_BUFFER must be at least 1 [{size}]")
+    return size
+
+
+def dprintf_command(trace_id: int, probe: str) -> str:
+    """Turn a trace probe into a ``dprintf`` command whose output the debug
+    client collects (see ``TraceBuffer``) rather than printing it.
+
+    Args:
+        trace_id: id that is printed at the start of each hit.
+        probe: ``LOCATION,"FORMAT",ARGS`` as for ``dprintf``, e.g.,
+          ``solver.c:42,"i=%d x=%f",i,x``.
+
+    Returns:
+        The ``dprintf`` command.
+    """
+    m = _DPRINTF_REGEX.match(probe)
+    if m is None:
+        raise ValueError(f'trace probe must be LOCATION,"FORMAT",ARGS [{probe}]')
+    location, fmt, args = m.groups()
+    # hits are collected line by line
+    if not fmt.endswith("\\n"):
+        fmt += "\\n"
+    return f'dprintf {location},"{TRACE_MARKER}{trace_id} {fmt}"{args}'
+
+
+def inferior_probe(command: str) -> Optional[str]:
+    """Make a trace probe (see ``dprintf_command``) print the gdb inferior
+    that hit it, e.g., ``@mdb-trace:2:1 i=3`` for a hit of trace 1 in
+    inferior 2, so the hits of ranks that share a gdb can be told apart.
+
+    Args:
+        command: command run by the user.
+
+    Returns:
+        The ``dprintf`` command, or None if ``command`` isn't a trace probe.
+    """
+    m = _PROBE_REGEX.match(command)
+    if m is None:
+        return None
+    start, fmt, args = m.groups()
+    return f"{start}{TRACE_MARKER}%d:{fmt},$_inferior{args}"
+
+
+def split_inferior(hit: str) -> tuple[int, str]:
+    """Split a hit printed by an ``inferior_probe`` (without the marker).
+
+    Args:
+        hit: hit, e.g., ``2:1 i=3``.
+
+    Returns:
+        The inferior that hit the probe and the hit as printed by a probe
+        made by ``dprintf_command``, e.g., ``(2, "1 i=3")``.
+    """
+    inferior, _, text = hit.partition(":")
+    return int(inferior), text
+
+
+class TraceBuffer:
+    """Ring buffer of the latest trace hits of a rank.
+
+    Hits are collected as the debugger prints them, even while a command
+    such as ``continue`` is running, and are fetched in bulk (see
+    ``DebugClient.send_trace_hits``). If they aren't fetched in time the
+    oldest hits are dropped, so memory use is bounded however often a probe
+    is hit.
+    """
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE) -> None:
+        self.hits: deque[str] = deque(maxlen=size)
+        self.dropped = 0
+
+    def append(self, hit: str) -> None:
+        if len(self.hits) == self.hits.maxlen:
+            self.dropped += 1
+        self.hits.append(hit)
+
+    def drain(self) -> tuple[list[str], int]:
+        """Take the hits out of the buffer.
+
+        Returns:
+            The hits, oldest first, and the number of hits that were dropped
+            since the buffer was last drained.
+        """
+        hits = list(self.hits)
+        dropped = self.dropped
+        self.hits.clear()
+        self.dropped = 0
+        return hits, dropped
@@ -1,31 +1,107 @@
 # Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
 # details.
 
+import json
+import os
 import re
+import socket
+import stat
+import tempfile
 from os.path import expanduser
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Any, Iterable, Optional
+
+from .rank_set import RankSet
 
 if TYPE_CHECKING:
     from .backend import DebugBackend
 
 
-def sort_debug_response(results: dict[int, str]) -> dict[int, str]:
-    """Sort debug output by process rank.
+def sort_debug_response(results: dict[str, RankSet]) -> dict[str, RankSet]:
+    """Sort grouped debug output by the lowest process rank in each group.
 
     Args:
-        response: dict containing the
+        results: dict mapping debug output to the ranks that produced it (see
+          ``group_results``).
 
     Returns:
-        The string with bracketted paste escape sequence removed.
+        The same dict ordered by lowest rank.
+    """
+    return dict(sorted(results.items(), key=lambda item: item[1].first()))
+
+
+def group_results(results: dict[int, str]) -> dict[str, RankSet]:
+    """Group identical debug output from different ranks. E.g.,
+    ``group_results({0: "a", 1: "a", 2: "b"})`` would return the following:
+    ``{"a": RankSet("0-1"), "b": RankSet("2")}``.
+
+    Args:
+        results: dict mapping each rank to its debug output.
+
+    Returns:
+        A dict mapping each unique output to the ranks that produced it.
     """
-    return dict(sorted(results.items()))
+    groups: dict[str, list[int]] = {}
+    for rank, output in results.items():
+        groups.setdefault(output, []).append(rank)
+    return {output: RankSet(ranks) for output, ranks in groups.items()}
+
+
+def expand_results(results: dict[str, RankSet]) -> dict[int, str]:
+    """Inverse of ``group_results``. Expand grouped debug output back into
+    one entry per rank, sorted by rank.
+
+    Args:
+        results: dict mapping debug output to the ranks that produced it.
+
+    Returns:
+        A dict mapping each rank to its debug output.
+    """
+    expanded = {}
+    for output, ranks in results.items():
+        for rank in ranks:
+            expanded[rank] = output
+    return dict(sorted(expanded.items()))
+
 
+def expand_values(values: dict[str, RankSet]) -> dict[int, Any]:
+    """Expand grouped structured values (json text, see
+    ``Message.debug_command_response``) into one decoded value per rank,
+    sorted by rank.
 
-def pretty_print_response(response: dict[int, str]) -> None:
+    Args:
+        values: dict mapping json encoded values to the ranks that produced
+          them.
+
+    Returns:
+        A dict mapping each rank to its decoded value.
+    """
+    decoded = {text: json.loads(text) for text in values}
+    return {rank: decoded[text] for rank, text in expand_results(values).items()}
+
+
+def merge_results(results: list[dict[str, RankSet]]) -> dict[str, RankSet]:
+    """Merge several dicts of grouped debug output (see ``group_results``),
+    e.g., the partial results streamed back from the exchange server.
+
+    Args:
+        results: list of dicts mapping debug output to the ranks that
+          produced it.
+
+    Returns:
+        A single dict mapping each unique output to the ranks that produced it.
+    """
+    merged: dict[str, RankSet] = {}
+    for grouped in results:
+        for output, ranks in grouped.items():
+            merged[output] = merged[output] | ranks if output in merged else ranks
+    return merged
+
+
+def pretty_print_response(response: dict[str, RankSet]) -> None:
     lines = []
-    for rank, result in response.items():
+    for result, ranks in response.items():
         if result:
-            lines.append(prepend_ranks(rank=rank, result=result))
+            lines.append(prepend_ranks(ranks=ranks, result=result))
     combined_output = (72 * "*" + "\n").join(lines)
     print(combined_output)
 
@@ -48,9 +124,32 @@ def extract_float(line: str, backend: "DebugBackend") -> float:
     return result
 
 
-def prepend_ranks(rank: int, result: str) -> str:
+def extract_truth(line: str, backend: "DebugBackend") -> Optional[bool]:
+    """Interpret the output of ``print <expr>`` as a condition, e.g., for
+    ``select where``. Booleans (including fortran's ``.TRUE.``) are used as
+    is and numbers are true if they aren't zero, as in C.
+
+    Args:
+        line: output of the print command.
+        backend: debugger backend that produced the output.
+
+    Returns:
+        The value of the condition, or None if the output isn't a boolean or
+        a number, e.g., because the expression couldn't be evaluated.
+    """
+    line = strip_control_characters(line)
+    m = re.search(r"\d+ = (true|false|\.true\.|\.false\.)\s", line, re.IGNORECASE)
+    if m:
+        return m.group(1).lower() in ("true", ".true.")
+    try:
+        return extract_float(line, backend) != 0
+    except ValueError:
+        return None
+
+
+def prepend_ranks(ranks: RankSet, result: str) -> str:
     return "".join(
-        [f"{rank}:\t" + line + "\r\n" for line in result.split("\r\n")[1:-1]]
+        [f"{ranks}:\t" + line + "\r\n" for line in result.split("\r\n")[1:-1]]
     )
 
 
@@ -79,26 +178,32 @@ def strip_control_characters(text: str) -> str:
     return re.sub(r"\x1b\[[\d;]*m", "", text)
 
 
-def parse_ranks(ranks: str) -> list[int]:
+def parse_ranks(ranks: str) -> RankSet:
     """Parse a string of ranks into a set of integers. E.g.,
-    ``parse_ranks("1,3-5")`` would return the following: ``set(1,3,4,5)``.
+    ``parse_ranks("1,3-5")`` would return the following: ``RankSet("1,3-5")``.
 
     Args:
         ranks: string of ranks using either a mix of comma separation and
           ranges using hyphen.
 
     Returns:
-        A set of ranks represented by integers.
+        An interval encoded set of ranks (see ``RankSet``).
     """
-    ranks = re.sub(
-        r"(\d+)-(\d+)",
-        lambda match: ",".join(
-            str(i) for i in range(int(match.group(1)), int(match.group(2)) + 1)
-        ),
-        ranks,
-    )
+    return RankSet.parse(ranks)
+
 
-    return list(set([int(s) for s in ranks.split(",")]))
+def format_ranks(ranks: Iterable[int]) -> str:
+    """Format ranks as a compact string, collapsing consecutive ranks into
+    ranges. This is the inverse of ``parse_ranks``. E.g.,
+    ``format_ranks([0, 1, 2, 3, 5])`` would return ``"0-3,5"``.
+
+    Args:
+        ranks: ranks in any order (duplicates are ignored).
+
+    Returns:
+        String of comma separated ranks and hyphenated ranges.
+    """
+    return str(RankSet(ranks))
 
 
 def ssl_cert_path() -> str:
@@ -107,3 +212,61 @@ def ssl_cert_path() -> str:
 
 def ssl_key_path() -> str:
     return expanduser("~/.mdb/key.rsa")
+
+
+def socket_directory() -> str:
+    """Directory for mdb's Unix domain sockets. Only the current user can
+    access it, which is what authenticates local connections.
+
+    Returns:
+        The path of the directory.
+    """
+    directory = os.path.join(tempfile.gettempdir(), f"mdb-{os.getuid()}")
+    os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid != os.getuid()
+        or info.st_mode & 0o077
+    ):
+        raise PermissionError(
+            f"{directory} must be a directory that only the current user can access"
+        )
+    return directory
+
+
+def exchange_socket_path(port: int) -> str:
+    """Path of the Unix domain socket where the exchange server (or relay)
+    listening on ``port`` accepts connections from the same host.
+
+    Args:
+        port: TCP port of the exchange server.
+
+    Returns:
+        The path of the socket.
+    """
+    return os.path.join(socket_directory(), f"exchange-{port}.sock")
+
+
+def is_local_host(hostname: str) -> bool:
+    """Check whether ``hostname`` refers to this machine, i.e., one of its
+    addresses can be bound to.
+
+    Args:
+        hostname: hostname or IP address.
+
+    Returns:
+        True if ``hostname`` resolves to an address of this machine.
+    """
+    try:
+        addresses = socket.getaddrinfo(hostname, None, type=socket.SOCK_STREAM)
+    except OSError:
+        return False
+    for family, type_, proto, _, address in addresses:
+        with socket.socket(family, type_, proto) as sock:
+            try:
+                sock.bind((address[0], 0))
+            except OSError:
+                continue
+        return True
+    return False
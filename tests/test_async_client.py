@@ -0,0 +1,16 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import random
+
+from mdb.async_client import backoff_delay
+
+
+def test_backoff_delay() -> None:
+    random.seed(0)
+    for attempt in range(1, 10):
+        limit = min(8.0, 0.5 * 2 ** (attempt - 1))
+        delays = [backoff_delay(attempt, base=0.5, cap=8.0) for _ in range(200)]
+        assert all(limit / 2 <= delay <= limit for delay in delays)
+        # jitter spreads retries out rather than all clients retrying at once
+        assert max(delays) - min(delays) > limit / 4
@@ -0,0 +1,76 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import re
+import sys
+import types
+from pathlib import Path
+
+import pytest
+
+from mdb.backend import BackendRegistry, backends
+
+PLUGIN = """
+from mdb.backend import DebugBackend
+from plugin_log import loaded
+
+loaded.append("{name}")
+
+
+class Backend(DebugBackend):
+    name = "{name}"
+    debug_command = "{name}"
+    argument_separator = "--"
+    prompt_string = "(dbg)"
+    default_options = []
+    start_command = "start"
+    float_regex = ""
+
+    def runtime_options(self, opts):
+        return []
+"""
+
+
+def test_builtin_plugins_match_their_names() -> None:
+    assert "gdb" in backends
+    assert "not-a-debugger" not in backends
+    for name in backends:
+        assert backends[name]().name == name
+
+
+def test_backends_are_only_imported_when_used(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # plugins record when they are imported
+    loaded: list[str] = []
+    log = types.ModuleType("plugin_log")
+    log.loaded = loaded  # type: ignore[attr-defined]
+    monkeypatch.setitem(sys.modules, "plugin_log", log)
+
+    plugin_dir = tmp_path / "plugins"
+    plugin_dir.mkdir()
+    for name in ["dbg-a", "dbg-b"]:
+        (plugin_dir / f"{name}.py").write_text(PLUGIN.format(name=name))
+    (plugin_dir / "broken.py").write_text("raise RuntimeError('never imported')\n")
+
+    registry = BackendRegistry(str(plugin_dir))
+    assert list(registry) == ["broken", "dbg-a", "dbg-b"]
+    assert "dbg-a" in registry
+    assert loaded == []
+
+    assert registry["dbg-b"]().name == "dbg-b"
+    assert registry["dbg-b"] is registry["dbg-b"]
+    assert loaded == ["dbg-b"]
+
+    with pytest.raises(KeyError):
+        registry["missing"]
+
+
+def test_error_regex() -> None:
+    gdb = backends["gdb"]()
+    assert gdb.error_regex is not None
+    assert re.search(gdb.error_regex, 'p x\r\nNo symbol "x" in current context.\r\n')
+    assert not re.search(gdb.error_regex, "p x\r\n$1 = 3\r\n")
+    lldb = backends["lldb"]()
+    assert lldb.error_regex is not None
+    assert re.search(lldb.error_regex, "p x\r\nerror: use of undeclared identifier")
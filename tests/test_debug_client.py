@@ -0,0 +1,495 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import asyncio
+import os
+import socket
+import sys
+from pathlib import Path
+from typing import Any, Awaitable, Callable
+
+import pytest
+from test_gdb_mi import FakeGDB
+
+from mdb.async_connection import AsyncConnection
+from mdb.debug_client import DebugClient
+from mdb.gdb_mi import MISession
+from mdb.messages import Message
+from mdb.node_wrapper import MultiInferiorDebugClient
+from mdb.rank_set import RankSet
+from mdb.trace import dprintf_command
+
+# stands in for `gdb -q --args <target>`. It prints the values of python
+# expressions, a short backtrace, and runs the "program" on `continue` until
+# it is interrupted. Its behaviour is set with environment variables:
+# FAKE_RANK is the value of `rank`, FAKE_RUNS is how many times the program
+# runs before it exits and FAKE_HITS is how many trace hits it prints each
+# time it runs, each hit split across two writes. Inferiors can be added as
+# in a node wrapper (see `MultiInferiorDebugClient`), FAKE_BREAKS lists the
+# inferior that hits a breakpoint each time the program runs. Once a trace
+# probe is limited to some inferiors, each of them prints its own hits
+FAKE_GDB = """
+import json, os, re, sys, time
+
+variables = {"rank": int(os.environ["FAKE_RANK"]), "name": "solver", "resumed": 0}
+breaks = [int(i) for i in os.environ.get("FAKE_BREAKS", "").split(",") if i]
+inferiors = 1
+current = 1
+traced = [None]
+runs = int(os.environ.get("FAKE_RUNS", "1000"))
+hits = int(os.environ.get("FAKE_HITS", "0"))
+history = 0
+stops = 0
+exited = False
+
+def out(text):
+    sys.stdout.write(text)
+    sys.stdout.flush()
+
+while True:
+    try:
+        command = input("(gdb) ")
+    except KeyboardInterrupt:
+        out("Quit\\n")
+        continue
+    if command.startswith("print "):
+        try:
+            value = eval(command[len("print "):], {}, dict(variables))
+        except NameError as e:
+            out(f'No symbol "{e.name}" in current context.\\n')
+            continue
+        if isinstance(value, bool):
+            value = int(value)
+        history += 1
+        out(f"${history} = {json.dumps(value)}\\n")
+    elif command == "bt":
+        if exited:
+            out("No stack.\\n")
+            continue
+        func = "compute" if stops % 2 else "MPI_Barrier"
+        out(f"#0  0x0000000000401136 in {func} () at solver.c:7\\n")
+        out("#1  0x0000000000401182 in solve () at solver.c:12\\n")
+        out("#2  main () at solver.c:20\\n")
+    elif command == "continue":
+        if exited:
+            out("The program is not being run.\\n")
+            continue
+        variables["resumed"] += 1
+        out("Continuing.\\n")
+        for i in range(hits):
+            for inferior in traced:
+                out("@mdb-tr")
+                time.sleep(0.05)
+                prefix = "" if inferior is None else f"{inferior}:"
+                out(f"ace:{prefix}solver.c:7 i={i}\\n")
+        if breaks:
+            current = breaks.pop(0)
+            out(f'Thread {current}.1 "solver" hit Breakpoint 1.{current}, main ()\\n')
+            continue
+        if runs == 0:
+            exited = True
+            out(f"[Inferior 1 (process {os.getpid()}) exited normally]\\n")
+            continue
+        runs -= 1
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            stops += 1
+            out("\\nProgram received signal SIGINT, Interrupt.\\n")
+    elif command.startswith("dprintf "):
+        out("Dprintf 1 at 0x401136: file solver.c, line 7.\\n")
+    elif command.startswith("condition $bpnum "):
+        traced = [int(i) for i in re.findall(r"== (\\d+)", command)]
+    elif command.startswith("add-inferior "):
+        inferiors += 1
+        out(f"[New inferior {inferiors}]\\nAdded inferior {inferiors}\\n")
+    elif command == "inferior":
+        out(f"[Current inferior is {current} [process {os.getpid()}] (solver)]\\n")
+    elif command.startswith("inferior "):
+        current = int(command.split()[1])
+        out(f"[Switching to inferior {current} [process {os.getpid()}] (solver)]\\n")
+    elif command.startswith("set ") or command == "start":
+        pass
+    else:
+        out(f'Undefined command: "{command.split()[0]}".  Try "help".\\n')
+"""
+
+
+class RecordedConnection(AsyncConnection):
+    """Connection to the exchange server that keeps the messages sent on
+    it."""
+
+    def __init__(self) -> None:
+        self.sent: asyncio.Queue[Message] = asyncio.Queue()
+
+    async def send_message(self, msg: Message) -> None:
+        await self.sent.put(msg)
+
+
+@pytest.fixture(autouse=True)
+def fake_gdb(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    gdb = tmp_path / "gdb"
+    gdb.write_text(f"#!{sys.executable}\n{FAKE_GDB}")
+    gdb.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("MDB_DISABLE_TLS", "1")
+
+
+async def start_client(
+    ranks: int,
+    backend: str = "gdb",
+    multi_inferior: bool = False,
+    **env: dict[int, str],
+) -> tuple[DebugClient, RecordedConnection]:
+    """Start a debug client of several ranks, as in a node wrapper.
+
+    Args:
+        ranks: number of ranks.
+        backend: name of the debugger backend.
+        multi_inferior: debug every rank from one debugger, each rank is an
+          inferior.
+        env: value of each variable of the fake debugger (e.g., ``FAKE_RUNS``)
+          on each rank, if it isn't the default.
+
+    Returns:
+        The client and the connection that it replies on.
+    """
+    opts: dict[str, Any] = {
+        "rank": "0",
+        "target": "solver",
+        "redirect_stdout": None,
+        "args": [],
+        "backend": backend,
+        "exchange_hostname": "localhost",
+        "exchange_port": 0,
+        "connection_attempts": 1,
+    }
+    if multi_inferior:
+        # the node socket is only used once the exchange is connected
+        client: DebugClient = MultiInferiorDebugClient(opts, socket.socket())
+    else:
+        client = DebugClient(opts)
+    conn = RecordedConnection()
+    client.conn = conn
+    for rank in range(ranks):
+        rank_env = {
+            name: values[rank] for name, values in env.items() if rank in values
+        }
+        await client.init_debug_proc(
+            rank, env={**os.environ, "FAKE_RANK": str(rank), **rank_env}
+        )
+    return client, conn
+
+
+async def reply(
+    handler: Callable[[Message], Awaitable[None]],
+    conn: RecordedConnection,
+    request: Message,
+) -> Message:
+    await asyncio.wait_for(handler(request.with_request_id(7)), timeout=10)
+    response = conn.sent.get_nowait()
+    assert response.request_id == 7
+    assert conn.sent.empty()
+    return response
+
+
+def test_profile_samples_until_the_target_exits() -> None:
+    async def main() -> None:
+        # rank 1 exits the second time it runs, after one sample
+        client, conn = await start_client(2, FAKE_RUNS={1: "1"})
+        response = await reply(
+            client.execute_profile,
+            conn,
+            Message.mdb_profile_request(RankSet([0, 1]), samples=3, interval=0.2),
+        )
+        assert response.data["profiles"] == {
+            0: {"main;solve;compute": 2, "main;solve;MPI_Barrier": 1},
+            1: {"main;solve;compute": 1},
+        }
+        overhead = response.data["overhead"]
+        assert overhead["samples"] == 4
+        assert 0 < overhead["max_pause"] <= overhead["pause"]
+        # the debugger is back at its prompt on both ranks
+        assert "not being run" in await client.run_on_rank(1, "continue")
+        assert "$1 = 0" in await client.run_on_rank(0, "print rank")
+
+    asyncio.run(main())
+
+
+def test_profile_of_exited_target_is_empty() -> None:
+    async def main() -> None:
+        client, conn = await start_client(1, FAKE_RUNS={0: "0"})
+        profile, pauses = await client.sample_rank(0, samples=3, interval=0.2)
+        assert (profile, pauses) == ({}, [])
+        assert await client.backtrace_rank(0) == []
+
+    asyncio.run(main())
+
+
+def test_batch_stops_on_error() -> None:
+    async def main() -> None:
+        client, conn = await start_client(2)
+        commands = ["print rank", "print missing", "print rank + 1"]
+        selects = [RankSet([0, 1]), RankSet([1]), RankSet([0, 1])]
+
+        response = await reply(
+            client.execute_batch,
+            conn,
+            Message.mdb_batch_request(commands, selects, stop_on_error=True),
+        )
+        result = response.data["result"]
+        # the batch stops after the command that failed on rank 1, but both
+        # ranks still reply
+        assert [sorted(outputs) for outputs in result] == [[0, 1], [1]]
+        assert "No symbol" in result[1][1]
+        assert response.data["ranks"] == RankSet([0, 1])
+
+        response = await reply(
+            client.execute_batch,
+            conn,
+            Message.mdb_batch_request(commands, selects, stop_on_error=False),
+        )
+        result = response.data["result"]
+        assert len(result) == 3
+        assert "$3 = 1" in result[2][0]
+        assert "$3 = 2" in result[2][1]
+
+    asyncio.run(main())
+
+
+def test_interrupted_command_replies() -> None:
+    async def main() -> None:
+        client, conn = await start_client(1)
+        client.start_command(
+            Message.mdb_command_request("continue", RankSet([0])).with_request_id(3)
+        )
+        await asyncio.sleep(0.2)
+        await client.interrupt()
+        response = await asyncio.wait_for(conn.sent.get(), timeout=10)
+        assert response.msg_type == "debug_command_response"
+        assert response.request_id == 3
+        assert "Program received signal SIGINT" in response.data["result"][0]
+        assert "Interrupted: True" in response.data["result"][0]
+        assert "$1 = 0" in await client.run_on_rank(0, "print rank")
+
+    asyncio.run(main())
+
+
+def test_failed_handler_replies() -> None:
+    async def main() -> None:
+        client, conn = await start_client(2)
+
+        async def backtrace_rank(rank: int) -> list[str]:
+            raise RecursionError("maximum recursion depth exceeded")
+
+        client.backtrace_rank = backtrace_rank  # type: ignore[method-assign]
+        client.start_command(
+            Message.mdb_stacks_request(RankSet([0, 1])).with_request_id(3)
+        )
+        response = await asyncio.wait_for(conn.sent.get(), timeout=10)
+        # the exchange server still gets a (failed) reply from every rank
+        assert response.msg_type == "debug_stacks_response"
+        assert response.request_id == 3
+        assert response.data["ranks"] == RankSet([0, 1])
+        assert "$1 = 0" in await client.run_on_rank(0, "print rank")
+
+    asyncio.run(main())
+
+
+def test_predicate_outcomes() -> None:
+    async def main() -> None:
+        client, conn = await start_client(3)
+        ranks = RankSet([0, 1, 2])
+
+        async def predicate(expr: str) -> tuple[RankSet, RankSet]:
+            response = await reply(
+                client.evaluate_predicate,
+                conn,
+                Message.mdb_predicate_request(expr, ranks),
+            )
+            assert response.data["ranks"] == ranks
+            return response.data["matched"], response.data["failed"]
+
+        assert await predicate("rank > 0") == (RankSet([1, 2]), RankSet())
+        assert await predicate("rank % 2") == (RankSet([1]), RankSet())
+        # the value isn't a number, or isn't defined
+        assert await predicate("name") == (RankSet(), ranks)
+        assert await predicate("missing") == (RankSet(), ranks)
+
+    asyncio.run(main())
+
+
+def test_reduction_values() -> None:
+    async def main() -> None:
+        client, conn = await start_client(3)
+        ranks = RankSet([0, 1, 2])
+
+        async def reduce(expr: str) -> tuple[dict[str, Any], RankSet]:
+            response = await reply(
+                client.evaluate_reduction,
+                conn,
+                Message.mdb_reduce_request(expr, ranks, histogram=(2, 0.0, 4.0)),
+            )
+            assert response.data["ranks"] == ranks
+            return response.data["reduction"], response.data["failed"]
+
+        reduction, failed = await reduce("rank * 1.5")
+        assert failed == RankSet()
+        assert reduction["count"] == 3
+        assert reduction["sum"] == 4.5
+        assert (reduction["min"], reduction["min_rank"]) == (0.0, 0)
+        assert (reduction["max"], reduction["max_rank"]) == (3.0, 2)
+        assert reduction["bins"] == [2, 1]
+
+        # ranks that can't print a number are left out
+        reduction, failed = await reduce("name if rank else 2")
+        assert failed == RankSet([1, 2])
+        assert (reduction["count"], reduction["sum"]) == (1, 2.0)
+        reduction, failed = await reduce("missing")
+        assert failed == ranks
+        assert reduction["count"] == 0
+
+    asyncio.run(main())
+
+
+def test_trace_hits_split_across_reads_are_recorded() -> None:
+    async def main() -> None:
+        client, conn = await start_client(2, FAKE_RUNS={0: "0"}, FAKE_HITS={0: "3"})
+        output = await client.run_on_rank(0, "continue")
+        assert "exited normally" in output
+        assert "@mdb" not in output and "ace:" not in output
+
+        response = await reply(
+            client.send_trace_hits, conn, Message.mdb_trace_request(RankSet([0, 1]))
+        )
+        assert response.data["hits"] == {
+            0: [f"solver.c:7 i={i}" for i in range(3)],
+            1: [],
+        }
+        assert response.data["dropped"] == {}
+        # the hits are only sent once
+        assert client.traces[0].drain() == ([], 0)
+
+    asyncio.run(main())
+
+
+def test_failed_commands_are_not_queried() -> None:
+    gdb = FakeGDB(
+        [
+            '~"$1 = 3\\n"\r\n1^done\r\n',
+            '2^done,value="3"\r\n',
+            '3^error,msg="No symbol \\"nope\\" in current context."\r\n',
+        ]
+    )
+
+    async def main() -> None:
+        client, conn = await start_client(0, backend="gdb-mi")
+        client.dbg_procs[0] = gdb  # type: ignore[assignment]
+        client.mi_sessions[0] = MISession(
+            gdb, client.backend.prompt_string  # type: ignore[arg-type]
+        )
+
+        response = await reply(
+            client.execute_command,
+            conn,
+            Message.mdb_command_request("p x", RankSet([0])),
+        )
+        assert response.data["value"] == {0: '{"value": "3"}'}
+        # `$` is still 3, it must not be reported as the value of `nope`
+        response = await reply(
+            client.execute_command,
+            conn,
+            Message.mdb_command_request("p nope", RankSet([0])),
+        )
+        assert "value" not in response.data
+        assert gdb.batches == []
+
+    asyncio.run(main())
+
+
+def test_batches_skip_queries_and_stop_on_mi_error() -> None:
+    gdb = FakeGDB(
+        [
+            '~"$1 = 3\\n"\r\n1^done\r\n',
+            '2^error,msg="No symbol \\"nope\\" in current context."\r\n',
+        ]
+    )
+
+    async def main() -> None:
+        client, conn = await start_client(0, backend="gdb-mi")
+        client.dbg_procs[0] = gdb  # type: ignore[assignment]
+        client.mi_sessions[0] = MISession(
+            gdb, client.backend.prompt_string  # type: ignore[arg-type]
+        )
+        # batches don't need the values of the prints, so nothing is queried
+        response = await reply(
+            client.execute_batch,
+            conn,
+            Message.mdb_batch_request(["p x", "p nope", "p y"], [RankSet([0])] * 3),
+        )
+        assert len(response.data["result"]) == 2
+        assert gdb.sent == [
+            '1-interpreter-exec console "p x"',
+            '2-interpreter-exec console "p nope"',
+        ]
+
+    asyncio.run(main())
+
+
+def test_multi_inferior_resumes_once_per_node() -> None:
+    async def main() -> None:
+        client, conn = await start_client(
+            3, multi_inferior=True, FAKE_BREAKS={0: "3,1"}
+        )
+        response = await reply(
+            client.execute_command,
+            conn,
+            Message.mdb_command_request("continue", RankSet([0, 1, 2])),
+        )
+        # the stop is credited to the rank whose inferior hit the breakpoint
+        result = response.data["result"]
+        assert "Thread 3.1" in result[2]
+        assert "Stopped because rank 2 stopped" in result[0]
+        assert "Stopped because rank 2 stopped" in result[1]
+
+        response = await reply(
+            client.execute_batch,
+            conn,
+            Message.mdb_batch_request(["continue"], [RankSet([0, 1])]),
+        )
+        result = response.data["result"][0]
+        assert "Thread 1.1" in result[0]
+        assert "Stopped because rank 0 stopped" in result[1]
+
+        # each command only resumed the program once
+        assert "$1 = 2" in await client.run_on_rank(0, "print resumed")
+
+    asyncio.run(main())
+
+
+def test_multi_inferior_trace_hits_go_to_their_rank() -> None:
+    async def main() -> None:
+        client, conn = await start_client(
+            3, multi_inferior=True, FAKE_HITS={0: "2"}, FAKE_BREAKS={0: "1"}
+        )
+        probe = dprintf_command(1, 'solver.c:7,"i=%d",i')
+        response = await reply(
+            client.execute_command,
+            conn,
+            Message.mdb_command_request(probe, RankSet([0, 2])),
+        )
+        assert all("Dprintf 1" in output for output in response.data["result"].values())
+        await reply(
+            client.execute_command,
+            conn,
+            Message.mdb_command_request("continue", RankSet([0, 1, 2])),
+        )
+
+        response = await reply(
+            client.send_trace_hits, conn, Message.mdb_trace_request(RankSet([0, 1, 2]))
+        )
+        hits = [f"solver.c:7 i={i}" for i in range(2)]
+        assert response.data["hits"] == {0: hits, 1: [], 2: hits}
+
+    asyncio.run(main())
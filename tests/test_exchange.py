@@ -0,0 +1,831 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import asyncio
+import os
+import socket
+import ssl
+from pathlib import Path
+from typing import Any, Callable, Coroutine, Optional
+
+import pytest
+
+from mdb.async_connection import AsyncConnection
+from mdb.exchange_server import AsyncExchangeServer
+from mdb.mdb_client import Client
+from mdb.mdb_launch import ensure_certificate
+from mdb.messages import FABRIC_REQUESTS, Message
+from mdb.rank_set import RankSet
+from mdb.reduction import partial_reduction
+from mdb.relay_server import RelayNode, RelayServer, plan_relay_tree
+from mdb.stacks import build_tree
+from mdb.utils import exchange_socket_path
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port: int = sock.getsockname()[1]
+    return port
+
+
+# commands received by each fake debugger
+received: dict[int, list[str]] = {}
+
+
+async def fake_debugger(
+    port: int,
+    ranks: list[int],
+    delay: float = 0.0,
+    context: Optional[ssl.SSLContext] = None,
+    hostname: Optional[str] = None,
+) -> None:
+    """Stand-in for `DebugClient` that answers commands without a real
+    debugger. Several ranks behave like a node wrapper and are registered one
+    at a time."""
+    for rank in ranks:
+        received[rank] = []
+    # retry like `AsyncClient` does in case a relay isn't listening yet
+    for _ in range(50):
+        try:
+            reader, writer = await asyncio.open_connection(
+                "127.0.0.1", port, ssl=context
+            )
+            break
+        except ConnectionRefusedError:
+            await asyncio.sleep(0.1)
+    conn = AsyncConnection(reader, writer)
+    await conn.send_message(Message.debug_conn_request())
+    msg = await conn.recv_message()
+    conn.wire_format = msg.data["wire_format"]
+    hosts = None if hostname is None else {hostname: 1}
+    for rank in ranks:
+        await conn.send_message(
+            Message.debug_init_complete(ranks=RankSet([rank]), hosts=hosts)
+        )
+
+    while True:
+        msg = await conn.recv_message()
+        if msg.msg_type == "ping":
+            await asyncio.sleep(delay * ranks[0])
+            for rank in ranks:
+                received[rank].append("ping")
+            await conn.send_message(Message.pong().with_request_id(msg.request_id))
+        elif msg.msg_type == "mdb_command_request":
+            selected = [rank for rank in ranks if rank in msg.data["select"]]
+            if msg.data["command"] == "crash" and selected:
+                writer.close()
+                return
+            for rank in selected:
+                received[rank].append(msg.data["command"])
+            if msg.data["command"] == "stray":
+                # a message of the wrong type on the command's request id
+                await conn.send_message(Message.pong().with_request_id(msg.request_id))
+            await asyncio.sleep(delay * ranks[0])
+            result = {
+                rank: f"{msg.data['command']}\r\nrank {rank % 2}\r\n(gdb) "
+                for rank in selected
+            }
+            await conn.send_message(
+                Message.debug_command_response(result=result).with_request_id(
+                    msg.request_id
+                )
+            )
+        elif msg.msg_type == "mdb_batch_request":
+            batch = []
+            for command, select in zip(msg.data["commands"], msg.data["selects"]):
+                selected = [rank for rank in ranks if rank in select]
+                for rank in selected:
+                    received[rank].append(command)
+                batch.append({rank: f"{command} {rank % 2}" for rank in selected})
+                # rank 1 fails on the command "fail"
+                if command == "fail" and 1 in selected:
+                    break
+            all_selected = [
+                rank
+                for rank in ranks
+                if any(rank in select for select in msg.data["selects"])
+            ]
+            await conn.send_message(
+                Message.debug_batch_response(
+                    result=batch, ranks=RankSet(all_selected)
+                ).with_request_id(msg.request_id)
+            )
+        elif msg.msg_type == "mdb_stacks_request":
+            # even ranks wait in a barrier, odd ranks are still computing
+            selected = [rank for rank in ranks if rank in msg.data["select"]]
+            stacks = {
+                rank: ["main", "solve", "compute" if rank % 2 else "MPI_Barrier"]
+                for rank in selected
+            }
+            await conn.send_message(
+                Message.debug_stacks_response(
+                    tree=build_tree(stacks), ranks=RankSet(selected)
+                ).with_request_id(msg.request_id)
+            )
+        elif msg.msg_type == "mdb_profile_request":
+            # odd ranks spend every sample computing, even ranks alternate
+            # between computing and waiting in a barrier
+            selected = [rank for rank in ranks if rank in msg.data["select"]]
+            samples = msg.data["samples"]
+            profiles = {}
+            for rank in selected:
+                waiting = 0 if rank % 2 else samples // 2
+                profiles[rank] = {"main;compute": samples - waiting}
+                if waiting:
+                    profiles[rank]["main;MPI_Barrier"] = waiting
+            await conn.send_message(
+                Message.debug_profile_response(
+                    profiles=profiles,
+                    overhead={
+                        "samples": samples * len(selected),
+                        "pause": 0.01 * samples * len(selected),
+                        "max_pause": 0.01 * (rank + 1),
+                    },
+                    ranks=RankSet(selected),
+                ).with_request_id(msg.request_id)
+            )
+        elif msg.msg_type == "mdb_trace_request":
+            # every rank has hit its probe twice, rank 2 has dropped older hits
+            selected = [rank for rank in ranks if rank in msg.data["select"]]
+            await conn.send_message(
+                Message.debug_trace_response(
+                    hits={
+                        rank: [f"1 i={i} rank={rank}" for i in range(2)]
+                        for rank in selected
+                    },
+                    dropped={rank: 5 for rank in selected if rank == 2},
+                    ranks=RankSet(selected),
+                ).with_request_id(msg.request_id)
+            )
+        elif msg.msg_type == "mdb_predicate_request":
+            # odd ranks match, rank 2 can't evaluate anything
+            selected = [rank for rank in ranks if rank in msg.data["select"]]
+            await conn.send_message(
+                Message.debug_predicate_response(
+                    matched=RankSet([rank for rank in selected if rank % 2]),
+                    failed=RankSet([rank for rank in selected if rank == 2]),
+                    ranks=RankSet(selected),
+                ).with_request_id(msg.request_id)
+            )
+        elif msg.msg_type == "mdb_reduce_request":
+            # each rank's value is its rank squared, rank 2 has no value
+            selected = [rank for rank in ranks if rank in msg.data["select"]]
+            histogram = msg.data.get("histogram")
+            await conn.send_message(
+                Message.debug_reduce_response(
+                    reduction=partial_reduction(
+                        {rank: float(rank**2) for rank in selected if rank != 2},
+                        None if histogram is None else tuple(histogram),
+                    ),
+                    failed=RankSet([rank for rank in selected if rank == 2]),
+                    ranks=RankSet(selected),
+                ).with_request_id(msg.request_id)
+            )
+
+
+def run_session(
+    ranks: int,
+    session: Callable[[Client], Coroutine[Any, Any, None]],
+    delay: float = 0.0,
+    fanout: int = 0,
+    ranks_per_node: int = 1,
+) -> None:
+    received.clear()
+
+    async def main() -> None:
+        port = free_port()
+        relays: list[RelayNode] = []
+        rank_ports: dict[int, int] = {}
+        port_map: dict[int, int] = {}
+        if fanout > 0:
+            relays, rank_ports = plan_relay_tree(RankSet(range(ranks)), fanout, port)
+            # relays use the ports after the exchange server's port
+            port_map = {node.port: free_port() for node in relays}
+            port_map[port] = port
+            rank_ports = {rank: port_map[p] for rank, p in rank_ports.items()}
+        exchange = AsyncExchangeServer(
+            opts={
+                "number_of_ranks": ranks,
+                "select": f"0-{ranks - 1}",
+                "hostname": "127.0.0.1",
+                "port": port,
+                "backend": "gdb",
+                "launch_task": None,
+            }
+        )
+        await exchange.start_server()
+        # keep references so the tasks aren't garbage collected
+        debuggers = [
+            asyncio.create_task(
+                RelayServer(
+                    opts={
+                        "number_of_ranks": len(node.ranks),
+                        "select": str(node.ranks),
+                        "hostname": "127.0.0.1",
+                        "port": port_map[node.port],
+                        "exchange_hostname": "127.0.0.1",
+                        "exchange_port": port_map[node.parent_port],
+                        "connection_attempts": 3,
+                    }
+                ).run()
+            )
+            for node in relays
+        ]
+        debuggers += [
+            asyncio.create_task(
+                fake_debugger(
+                    rank_ports.get(rank, port),
+                    list(range(rank, min(rank + ranks_per_node, ranks))),
+                    delay=delay,
+                )
+            )
+            for rank in range(0, ranks, ranks_per_node)
+        ]
+
+        client = Client(
+            opts={
+                "exchange_hostname": "127.0.0.1",
+                "exchange_port": port,
+                "connection_attempts": 3,
+            }
+        )
+        await client.connect()
+        try:
+            await session(client)
+        finally:
+            for task in debuggers:
+                task.cancel()
+            exchange.close()
+
+    asyncio.run(main())
+
+
+@pytest.fixture(autouse=True)
+def disable_tls(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("MDB_DISABLE_TLS", "1")
+
+
+def test_command_response() -> None:
+    async def session(client: Client) -> None:
+        response = await client.run_command("p rank", RankSet(range(4)))
+        assert response.msg_type == "exchange_command_response"
+        assert response.data["results"] == {
+            "p rank\r\nrank 0\r\n(gdb) ": RankSet([0, 2]),
+            "p rank\r\nrank 1\r\n(gdb) ": RankSet([1, 3]),
+        }
+
+    run_session(4, session)
+
+
+def test_streamed_command_response() -> None:
+    partials: list[Message] = []
+
+    async def session(client: Client) -> None:
+        response = await client.run_command(
+            "p rank", RankSet(range(4)), on_progress=partials.append
+        )
+        assert response.data["results"] == {
+            "p rank\r\nrank 0\r\n(gdb) ": RankSet([0, 2]),
+            "p rank\r\nrank 1\r\n(gdb) ": RankSet([1, 3]),
+        }
+
+    # each rank replies 0.3 seconds after the previous one so every reply
+    # should arrive in its own batch
+    run_session(4, session, delay=0.3)
+
+    assert [p.data["replied"] for p in partials] == [1, 2, 3, 4]
+    assert all(p.data["total"] == 4 for p in partials)
+    assert partials[0].data["results"] == {"p rank\r\nrank 0\r\n(gdb) ": RankSet([0])}
+
+
+def test_stray_messages_are_not_streamed() -> None:
+    partials: list[Message] = []
+
+    async def session(client: Client) -> None:
+        response = await client.run_command(
+            "stray", RankSet(range(2)), on_progress=partials.append
+        )
+        assert response.data["results"] == {
+            "stray\r\nrank 0\r\n(gdb) ": RankSet([0]),
+            "stray\r\nrank 1\r\n(gdb) ": RankSet([1]),
+        }
+
+    run_session(2, session, delay=0.3)
+
+    assert [p.data["replied"] for p in partials] == [1, 2]
+
+
+def test_command_only_sent_to_selected_ranks() -> None:
+    async def session(client: Client) -> None:
+        response = await client.run_command("bt", RankSet([1, 3]))
+        assert response.data["results"] == {"bt\r\nrank 1\r\n(gdb) ": RankSet([1, 3])}
+
+        partials: list[Message] = []
+        await client.run_command("bt", RankSet([2]), on_progress=partials.append)
+        assert partials[-1].data["replied"] == 1
+        assert partials[-1].data["total"] == 1
+
+    run_session(4, session)
+
+    assert received == {0: [], 1: ["bt"], 2: ["bt"], 3: ["bt"]}
+
+
+def test_commands_in_flight_finish_out_of_order() -> None:
+    finished: list[str] = []
+
+    async def run(client: Client, command: str, select: RankSet) -> Message:
+        response = await client.run_command(command, select)
+        finished.append(command)
+        return response
+
+    async def session(client: Client) -> None:
+        # rank 3 takes longest to reply, so `bt` overtakes `continue`
+        slow, fast, streamed = await asyncio.gather(
+            run(client, "continue", RankSet([3])),
+            run(client, "bt", RankSet([0, 1])),
+            client.run_command("p rank", RankSet([1]), on_progress=lambda _: None),
+        )
+        assert slow.data["results"] == {"continue\r\nrank 1\r\n(gdb) ": RankSet([3])}
+        assert fast.data["results"] == {
+            "bt\r\nrank 0\r\n(gdb) ": RankSet([0]),
+            "bt\r\nrank 1\r\n(gdb) ": RankSet([1]),
+        }
+        assert streamed.data["results"] == {"p rank\r\nrank 1\r\n(gdb) ": RankSet([1])}
+
+    run_session(4, session, delay=0.3)
+
+    assert finished == ["bt", "continue"]
+
+
+def test_stragglers_time_out() -> None:
+    partials: list[Message] = []
+
+    async def session(client: Client) -> None:
+        # ranks reply after 0, 0.3, 0.6 and 0.9 seconds
+        response = await client.run_command("bt", RankSet(range(4)), timeout=0.45)
+        assert response.data["results"] == {
+            "bt\r\nrank 0\r\n(gdb) ": RankSet([0]),
+            "bt\r\nrank 1\r\n(gdb) ": RankSet([1]),
+        }
+        assert response.data["timed_out"] == RankSet([2, 3])
+
+        response = await client.run_command(
+            "p x", RankSet(range(4)), on_progress=partials.append, timeout=0.45
+        )
+        assert response.data["timed_out"] == RankSet([2, 3])
+        assert partials[-1].data["replied"] == 4
+
+        # the late replies to `bt` and `p x` are discarded
+        response = await client.run_command("up", RankSet([3]))
+        assert response.data["results"] == {"up\r\nrank 1\r\n(gdb) ": RankSet([3])}
+        assert "timed_out" not in response.data
+
+    run_session(4, session, delay=0.3)
+
+
+def test_stragglers_time_out_through_relay_tree() -> None:
+    async def session(client: Client) -> None:
+        response = await client.run_command("bt", RankSet(range(6)), timeout=1.9)
+        assert response.data["results"] == {
+            "bt\r\nrank 0\r\n(gdb) ": RankSet([0, 2]),
+            "bt\r\nrank 1\r\n(gdb) ": RankSet([1, 3]),
+        }
+        assert response.data["timed_out"] == RankSet([4, 5])
+
+    # ranks reply 0.4 seconds apart. Relays report their stragglers after
+    # 1.4 seconds, before the exchange server's deadline, so ranks that replied
+    # to a relay in time aren't counted as timed out
+    run_session(6, session, delay=0.4, fanout=3)
+
+
+def test_lost_debuggers_are_dropped(capsys: pytest.CaptureFixture[str]) -> None:
+    async def session(client: Client) -> None:
+        # ranks 2 and 3 share a debug client, only rank 2 ran the command
+        response = await client.run_command("crash", RankSet([2]))
+        assert response.data["results"] == {}
+        assert response.data["lost"] == RankSet([2])
+
+        response = await client.run_command("bt", RankSet(range(4)))
+        assert response.data["results"] == {
+            "bt\r\nrank 0\r\n(gdb) ": RankSet([0]),
+            "bt\r\nrank 1\r\n(gdb) ": RankSet([1]),
+        }
+        assert "lost" not in response.data
+        assert client.lost_ranks == RankSet([2, 3])
+
+    run_session(4, session, ranks_per_node=2)
+
+    # the lost ranks are only reported once
+    assert capsys.readouterr().out.count("lost connection to ranks [2-3]") == 1
+
+
+def test_ping_waits_for_every_live_debugger() -> None:
+    async def ping(client: Client) -> Message:
+        request_id = await client.conn.request(Message.ping())
+        try:
+            return await client.conn.recv_reply(request_id)
+        finally:
+            client.conn.end_request(request_id)
+
+    async def session(client: Client) -> None:
+        # rank 0 answers straight away and is then lost, which must not count
+        # as a second pong
+        pong = asyncio.create_task(ping(client))
+        await asyncio.sleep(0.1)
+        await client.run_command("crash", RankSet([0]))
+        assert (await pong).msg_type == "pong"
+        assert received[1] == received[2] == ["ping"]
+
+    # ranks 1 and 2 answer after 0.3 and 0.6 seconds
+    run_session(3, session, delay=0.3)
+
+
+def test_lost_debuggers_are_reported_through_relay_tree() -> None:
+    async def session(client: Client) -> None:
+        response = await client.run_command("crash", RankSet([4]))
+        assert response.data["lost"] == RankSet([4])
+
+        response = await client.run_command("bt", RankSet(range(6)))
+        assert response.data["results"] == {
+            "bt\r\nrank 0\r\n(gdb) ": RankSet([0, 2]),
+            "bt\r\nrank 1\r\n(gdb) ": RankSet([1, 3, 5]),
+        }
+        await asyncio.sleep(0.1)
+        assert client.lost_ranks == RankSet([4])
+
+    run_session(6, session, fanout=3)
+
+
+def test_batch_response() -> None:
+    async def session(client: Client) -> None:
+        response = await client.run_batch(
+            ["b main", "run", "bt"], [RankSet(range(4)), RankSet([1, 2]), RankSet([0])]
+        )
+        assert response.msg_type == "exchange_batch_response"
+        assert response.data["results"] == [
+            {"b main 0": RankSet([0, 2]), "b main 1": RankSet([1, 3])},
+            {"run 1": RankSet([1]), "run 0": RankSet([2])},
+            {"bt 0": RankSet([0])},
+        ]
+
+        # the batch stops early on the node of the failing rank
+        response = await client.run_batch(
+            ["fail", "next"], [RankSet(range(4)), RankSet(range(4))]
+        )
+        assert response.data["results"] == [
+            {"fail 0": RankSet([0, 2]), "fail 1": RankSet([1, 3])},
+            {"next 0": RankSet([2]), "next 1": RankSet([3])},
+        ]
+
+    run_session(4, session, ranks_per_node=2)
+
+    assert received[0] == ["b main", "bt", "fail"]
+    assert received[1] == ["b main", "run", "fail"]
+    assert received[3] == ["b main", "fail", "next"]
+
+
+# ranks selected by the requests in FABRIC_CASES, rank 0 isn't selected
+FABRIC_SELECT = RankSet(range(1, 7))
+
+
+def check_batch(response: Message) -> None:
+    assert response.data["results"] == [
+        {"b main 0": RankSet([2, 4, 6]), "b main 1": RankSet([1, 3, 5])},
+        {"run 0": RankSet([4]), "run 1": RankSet([5])},
+    ]
+
+
+def check_stacks(response: Message) -> None:
+    assert response.data["tree"] == build_tree(
+        {
+            rank: ["main", "solve", "compute" if rank % 2 else "MPI_Barrier"]
+            for rank in FABRIC_SELECT
+        }
+    )
+
+
+def check_profile(response: Message) -> None:
+    assert response.data["profile"] == {"main;compute": 18, "main;MPI_Barrier": 6}
+    assert response.data["profiles"][3] == {"main;compute": 4}
+    assert response.data["profiles"][4] == {"main;compute": 2, "main;MPI_Barrier": 2}
+    assert response.data["overhead"]["samples"] == 24
+    assert response.data["overhead"]["pause"] == pytest.approx(0.24)
+
+
+def check_trace(response: Message) -> None:
+    assert sorted(response.data["hits"]) == list(FABRIC_SELECT)
+    assert response.data["hits"][5] == ["1 i=0 rank=5", "1 i=1 rank=5"]
+    assert response.data["dropped"] == {2: 5}
+
+
+def check_predicate(response: Message) -> None:
+    assert response.data["matched"] == RankSet([1, 3, 5])
+    assert response.data["failed"] == RankSet([2])
+
+
+def check_reduce(response: Message) -> None:
+    reduction = response.data["reduction"]
+    assert reduction["count"] == 5
+    assert reduction["sum"] == 1 + 9 + 16 + 25 + 36
+    assert (reduction["min"], reduction["min_rank"]) == (1, 1)
+    assert (reduction["max"], reduction["max_rank"]) == (36, 6)
+    assert reduction["bins"] == [1, 1, 1, 1, 1]
+    assert response.data["failed"] == RankSet([2])
+
+
+# a request of each type in FABRIC_REQUESTS and a check of its response, see
+# `fake_debugger` for the replies of each rank
+FABRIC_CASES: dict[
+    str,
+    tuple[Callable[[Client], Coroutine[Any, Any, Message]], Callable[[Message], None]],
+] = {
+    "mdb_batch_request": (
+        lambda client: client.run_batch(
+            ["b main", "run"], [FABRIC_SELECT, RankSet([4, 5])]
+        ),
+        check_batch,
+    ),
+    "mdb_stacks_request": (
+        lambda client: client.run_stacks(FABRIC_SELECT),
+        check_stacks,
+    ),
+    "mdb_profile_request": (
+        lambda client: client.run_profile(FABRIC_SELECT, 4, 0.1),
+        check_profile,
+    ),
+    "mdb_trace_request": (lambda client: client.run_trace(FABRIC_SELECT), check_trace),
+    "mdb_predicate_request": (
+        lambda client: client.run_predicate("ierr != 0", FABRIC_SELECT),
+        check_predicate,
+    ),
+    "mdb_reduce_request": (
+        lambda client: client.run_reduce("x", FABRIC_SELECT, histogram=(5, 1, 36)),
+        check_reduce,
+    ),
+}
+
+
+def test_every_fabric_request_is_tested() -> None:
+    assert FABRIC_CASES.keys() == FABRIC_REQUESTS.keys()
+
+
+@pytest.mark.parametrize("request_type", FABRIC_CASES)
+@pytest.mark.parametrize("topology", ["node wrappers", "relay tree"])
+def test_fabric_replies_are_merged(
+    request_type: str, topology: str, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    # merge replies as they arrive rather than once they all have arrived
+    monkeypatch.setattr("mdb.exchange_server.MERGE_REPLIES", 2)
+    run_request, check = FABRIC_CASES[request_type]
+
+    async def session(client: Client) -> None:
+        response = await run_request(client)
+        assert response.msg_type == FABRIC_REQUESTS[request_type].response_type
+        assert response.replied_ranks() == FABRIC_SELECT
+        check(response)
+
+    if topology == "relay tree":
+        run_session(7, session, fanout=2)
+    else:
+        run_session(7, session, ranks_per_node=2)
+
+    assert received[0] == []
+
+
+def test_plan_relay_tree() -> None:
+    relays, rank_ports = plan_relay_tree(RankSet(range(3)), fanout=4, port=2000)
+    assert relays == []
+    assert rank_ports == {}
+
+    relays, rank_ports = plan_relay_tree(RankSet.parse("0-19"), fanout=2, port=2000)
+    # 10 leaves -> 5 -> 3 -> 2, which is few enough to attach to the exchange
+    assert [len(node.ranks) for node in relays] == [16, 4, 8, 8, 4] + [4] * 5 + [2] * 10
+    assert sorted(node.port for node in relays) == list(range(2001, 2021))
+    ports = {node.port: node for node in relays}
+    for node in relays:
+        if node.parent_port != 2000:
+            assert node.ranks <= ports[node.parent_port].ranks
+    assert len(rank_ports) == 20
+    assert all(ports[p].ranks == RankSet([r, r ^ 1]) for r, p in rank_ports.items())
+
+    with pytest.raises(ValueError):
+        plan_relay_tree(RankSet.parse("0-19"), fanout=1, port=2000)
+
+
+def test_command_through_relay_tree() -> None:
+    partials: list[Message] = []
+
+    async def session(client: Client) -> None:
+        response = await client.run_command("p rank", RankSet(range(10)))
+        assert response.data["results"] == {
+            "p rank\r\nrank 0\r\n(gdb) ": RankSet.parse("0,2,4,6,8"),
+            "p rank\r\nrank 1\r\n(gdb) ": RankSet.parse("1,3,5,7,9"),
+        }
+        response = await client.run_command(
+            "bt", RankSet([3, 4]), on_progress=partials.append
+        )
+        assert partials[-1].data["replied"] == 2
+        assert partials[-1].data["total"] == 2
+        assert response.data["results"] == {
+            "bt\r\nrank 1\r\n(gdb) ": RankSet([3]),
+            "bt\r\nrank 0\r\n(gdb) ": RankSet([4]),
+        }
+
+    run_session(10, session, fanout=3)
+
+    assert received[0] == ["p rank"]
+    assert received[3] == ["p rank", "bt"]
+
+
+def test_hosts_are_reported_through_relay() -> None:
+    async def main() -> None:
+        port, relay_port = free_port(), free_port()
+        exchange = AsyncExchangeServer(
+            opts={
+                "number_of_ranks": 4,
+                "select": "0-3",
+                "hostname": "127.0.0.1",
+                "port": port,
+                "backend": "gdb",
+                "launch_task": None,
+            }
+        )
+        await exchange.start_server()
+        relay = RelayServer(
+            opts={
+                "number_of_ranks": 4,
+                "select": "0-3",
+                "hostname": "127.0.0.1",
+                "port": relay_port,
+                "exchange_hostname": "127.0.0.1",
+                "exchange_port": port,
+                "connection_attempts": 3,
+            }
+        )
+        # every connection comes from the relay's address, but the ranks are
+        # on two nodes
+        tasks = [asyncio.create_task(relay.run())] + [
+            asyncio.create_task(
+                fake_debugger(relay_port, [rank], hostname=f"node{rank // 2}")
+            )
+            for rank in range(4)
+        ]
+        try:
+            assert await exchange.ensure_debuggers()
+            assert exchange.host_ranks == {"node0": 2, "node1": 2}
+        finally:
+            for task in tasks:
+                task.cancel()
+            exchange.close()
+
+    asyncio.run(main())
+
+
+def test_node_wrapper_registers_ranks_one_at_a_time() -> None:
+    async def session(client: Client) -> None:
+        response = await client.run_command("bt", RankSet([1, 2]))
+        assert response.data["results"] == {
+            "bt\r\nrank 1\r\n(gdb) ": RankSet([1]),
+            "bt\r\nrank 0\r\n(gdb) ": RankSet([2]),
+        }
+
+    run_session(4, session, ranks_per_node=2)
+
+    assert received == {0: [], 1: ["bt"], 2: ["bt"], 3: []}
+
+
+def test_debugger_timeout_restarts_while_ranks_connect() -> None:
+    async def main() -> None:
+        port = free_port()
+        exchange = AsyncExchangeServer(
+            opts={
+                "number_of_ranks": 4,
+                "select": "0-3",
+                "hostname": "127.0.0.1",
+                "port": port,
+                "backend": "gdb",
+                "launch_task": None,
+                "debugger_timeout": 0.5,
+            }
+        )
+        await exchange.start_server()
+
+        async def late_debugger(rank: int) -> None:
+            await asyncio.sleep(0.3 * rank)
+            await fake_debugger(port, [rank])
+
+        # connecting every rank takes longer than the timeout but there is
+        # never a gap as long as the timeout
+        debuggers = [asyncio.create_task(late_debugger(rank)) for rank in range(4)]
+        assert await exchange.ensure_debuggers()
+        assert exchange.host_ranks == {"127.0.0.1": 4}
+        assert exchange._host_rates()[0][:2] == ("127.0.0.1", 4)
+
+        # readiness is an event so later checks return straight away
+        start = asyncio.get_running_loop().time()
+        assert await exchange.ensure_debuggers()
+        assert asyncio.get_running_loop().time() - start < 0.1
+
+        for task in debuggers:
+            task.cancel()
+        exchange.close()
+
+    asyncio.run(main())
+
+
+def test_debugger_timeout() -> None:
+    async def main() -> None:
+        exchange = AsyncExchangeServer(
+            opts={
+                "number_of_ranks": 2,
+                "select": "0-1",
+                "hostname": "127.0.0.1",
+                "port": free_port(),
+                "backend": "gdb",
+                "launch_task": None,
+                "debugger_timeout": 0.2,
+            }
+        )
+        assert not await exchange.ensure_debuggers()
+
+    asyncio.run(main())
+
+
+@pytest.fixture
+def tls_home(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.delenv("MDB_DISABLE_TLS")
+    monkeypatch.setenv("HOME", str(tmp_path))
+    (tmp_path / ".mdb").mkdir()
+    ensure_certificate(str(tmp_path / ".mdb"), "localhost")
+    return tmp_path / ".mdb"
+
+
+def test_tls_handshakes_are_admitted_a_few_at_a_time(tls_home: Path) -> None:
+    cert, key = tls_home / "cert.pem", tls_home / "key.rsa"
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_cert_chain(cert, key)
+    context.load_verify_locations(cert)
+    context.check_hostname = False
+
+    async def main() -> None:
+        port = free_port()
+        exchange = AsyncExchangeServer(
+            opts={
+                "number_of_ranks": 8,
+                "select": "0-7",
+                "hostname": "127.0.0.1",
+                "port": port,
+                "backend": "gdb",
+                "launch_task": None,
+                "max_handshakes": 2,
+            }
+        )
+        await exchange.start_server()
+        debuggers = [
+            asyncio.create_task(fake_debugger(port, [rank], context=context))
+            for rank in range(8)
+        ]
+        assert await exchange.ensure_debuggers()
+        assert exchange.connected_ranks == RankSet(range(8))
+
+        for task in debuggers:
+            task.cancel()
+        exchange.close()
+
+    asyncio.run(main())
+
+
+def test_local_clients_skip_tls(tls_home: Path) -> None:
+    async def main() -> None:
+        port = free_port()
+        exchange = AsyncExchangeServer(
+            opts={
+                "number_of_ranks": 1,
+                "select": "0",
+                "hostname": "127.0.0.1",
+                "port": port,
+                "backend": "gdb",
+                "launch_task": None,
+            }
+        )
+        await exchange.start_server()
+        path = exchange_socket_path(port)
+        assert os.stat(path).st_mode & 0o777 == 0o600
+
+        client = Client(
+            opts={
+                "exchange_hostname": "127.0.0.1",
+                "exchange_port": port,
+                "connection_attempts": 3,
+            }
+        )
+        await client.connect()
+        assert client.conn.writer.get_extra_info("ssl_object") is None
+        assert client.conn.writer.get_extra_info("peername") == path
+        await client.close()
+
+        exchange.close()
+        assert not os.path.exists(path)
+
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import asyncio
+import re
+
+from mdb.backend import backends
+from mdb.gdb_mi import MIParser, MISession, console_command, parse_record
+
+
+def test_parse_result_record() -> None:
+    record = parse_record(
+        '12^done,stack=[frame={level="0",func="inner",line="8"},'
+        'frame={level="1",func="main",args=[],line="20"}]'
+    )
+    assert record is not None
+    assert record.kind == "result"
+    assert record.token == 12
+    assert record.cls == "done"
+    assert record.results == {
+        "stack": [
+            {"level": "0", "func": "inner", "line": "8"},
+            {"level": "1", "func": "main", "args": [], "line": "20"},
+        ]
+    }
+
+
+def test_parse_async_and_stream_records() -> None:
+    record = parse_record('*stopped,reason="breakpoint-hit",bkptno="1",thread-id="1"')
+    assert record is not None
+    assert (record.kind, record.token, record.cls) == ("exec", None, "stopped")
+    assert record.results["reason"] == "breakpoint-hit"
+
+    record = parse_record("3^running")
+    assert record is not None
+    assert (record.kind, record.cls, record.results) == ("result", "running", {})
+
+    # octal escapes are utf-8 bytes
+    record = parse_record(r'~"$1 = \"\303\274ber\"\n"')
+    assert record is not None
+    assert (record.kind, record.text) == ("console", '$1 = "über"\n')
+
+    assert parse_record("(gdb) ") is None
+    # the terminal echoing an MI command
+    assert parse_record('4-interpreter-exec console "bt"') is None
+
+
+def test_parser_is_incremental() -> None:
+    parser = MIParser()
+    output = '~"line one\\n"\r\n~"line two\\n"\r\n5^done,value="3.5"\r\n'
+    records = []
+    for i in range(0, len(output), 7):
+        records += parser.feed(output[i : i + 7])
+    assert [r.kind for r in records] == ["console", "console", "result"]
+    assert records[2].results == {"value": "3.5"}
+    assert parser.buffer == ""
+
+
+class FakeGDB:
+    """Replays MI output in batches, one batch per prompt."""
+
+    def __init__(self, batches: list[str]) -> None:
+        self.batches = batches
+        self.sent: list[str] = []
+        self.closed = False
+
+    def sendline(self, line: str) -> None:
+        self.sent.append(line)
+
+    def sendintr(self) -> None:
+        self.sent.append("<interrupt>")
+
+    async def expect(self, pattern: str, eof: bool = False) -> str:
+        return self.batches.pop(0)
+
+
+def test_session_waits_for_target_to_stop() -> None:
+    gdb = FakeGDB(
+        [
+            '1^running\r\n*running,thread-id="all"\r\n',
+            '~"\\nBreakpoint 1, main () at simple.c:5\\n"\r\n'
+            '*stopped,reason="breakpoint-hit",frame={func="main"}\r\n',
+            '~"$1 = 3\\n"\r\n2^done\r\n',
+            '3^done,value="3"\r\n',
+            '4^error,msg="No symbol \\"nope\\" in current context."\r\n',
+        ]
+    )
+
+    async def main() -> None:
+        session = MISession(gdb, r"\(gdb\) \r?\n")  # type: ignore[arg-type]
+        response = await session.execute(console_command("continue"))
+        assert response.result.cls == "running"
+        assert response.stopped is not None
+        assert response.stopped.results["frame"] == {"func": "main"}
+        assert response.text("continue") == (
+            "continue\r\n\r\nBreakpoint 1, main () at simple.c:5\r\n(gdb) "
+        )
+
+        response = await session.execute(console_command("p x"))
+        assert response.text("p x") == "p x\r\n$1 = 3\r\n(gdb) "
+        assert await session.query('-data-evaluate-expression "$"') == {"value": "3"}
+        assert await session.query('-data-evaluate-expression "nope"') is None
+
+    asyncio.run(main())
+    assert gdb.sent[0] == '1-interpreter-exec console "continue"'
+
+
+def test_structured_queries() -> None:
+    backend = backends["gdb-mi"]()
+    assert backend.machine_interface
+    assert backend.structured_query("bt") == "-stack-list-frames"
+    assert backend.structured_query("p/x var") == '-data-evaluate-expression "$"'
+    assert backend.structured_query("info breakpoints") == "-break-list"
+    assert backend.structured_query("ptype var") is None
+    assert backends["gdb"]().structured_query("bt") is None
+    assert re.fullmatch(backend.prompt_string, "(gdb) \r\n")
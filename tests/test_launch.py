@@ -0,0 +1,89 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import asyncio
+import shlex
+import socket
+import subprocess
+import sys
+from pathlib import Path
+
+from mdb.mdb_launch import busy_ports, ensure_certificate, watch_relay
+from mdb.rank_set import RankSet
+from mdb.relay_server import RelayNode
+
+
+def test_certificate_is_reused_while_valid(tmp_path: Path) -> None:
+    cert = tmp_path / "cert.pem"
+    assert not ensure_certificate(str(tmp_path), "node1")
+    generated = cert.read_bytes()
+    assert "PRIVATE KEY" in (tmp_path / "key.rsa").read_text()
+
+    assert ensure_certificate(str(tmp_path), "node1")
+    assert cert.read_bytes() == generated
+
+    # the certificate is only valid for the host it was issued for
+    assert not ensure_certificate(str(tmp_path), "node2")
+    assert cert.read_bytes() != generated
+
+
+def test_rsa_certificate_is_replaced(tmp_path: Path) -> None:
+    # older versions of mdb generated RSA keys
+    cert, key = tmp_path / "cert.pem", tmp_path / "key.rsa"
+    subprocess.run(
+        shlex.split(
+            f"openssl req -x509 -newkey rsa:2048 -keyout {key} -out {cert} "
+            "-nodes -days 1 -subj /CN=node1"
+        ),
+        check=True,
+        capture_output=True,
+    )
+    assert not ensure_certificate(str(tmp_path), "node1")
+    assert ensure_certificate(str(tmp_path), "node1")
+
+
+def test_broken_certificate_is_replaced(tmp_path: Path) -> None:
+    (tmp_path / "cert.pem").write_text("not a certificate")
+    (tmp_path / "key.rsa").write_text("not a key")
+    assert not ensure_certificate(str(tmp_path), "node1")
+    assert ensure_certificate(str(tmp_path), "node1")
+
+
+def test_busy_ports() -> None:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        port = sock.getsockname()[1]
+        assert busy_ports("127.0.0.1", [port]) == [port]
+    assert busy_ports("127.0.0.1", [port]) == []
+
+
+class FakeExchangeServer:
+    def __init__(self) -> None:
+        self.debuggers_ready = asyncio.Event()
+        self.killed = False
+
+    async def kill(self) -> None:
+        self.killed = True
+
+
+def test_relay_exiting_early_shuts_down() -> None:
+    node = RelayNode(port=2001, parent_port=2000, ranks=RankSet(range(4)))
+
+    async def main(exit_code: int, ready: bool) -> bool:
+        server = FakeExchangeServer()
+        if ready:
+            server.debuggers_ready.set()
+        relay_task = asyncio.create_task(
+            asyncio.create_subprocess_exec(
+                sys.executable, "-c", f"import sys; sys.exit({exit_code})"
+            )
+        )
+        await watch_relay(server, node, relay_task)  # type: ignore[arg-type]
+        await relay_task.result().wait()
+        return server.killed
+
+    assert asyncio.run(main(1, ready=False))
+    # once every rank has connected, the ranks of a failed relay are lost
+    # like those of any other debug client
+    assert not asyncio.run(main(0, ready=True))
@@ -0,0 +1,157 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import json
+
+import pytest
+
+from mdb.messages import (
+    EXCHANGE,
+    FABRIC_REQUESTS,
+    Message,
+    negotiate_wire_format,
+    supported_wire_formats,
+)
+from mdb.rank_set import RankSet
+from mdb.utils import expand_values
+
+
+def test_binary_round_trip() -> None:
+    responses = [
+        Message.debug_command_response(result={0: "bt\r\n#0  main ()\r\n"}),
+        Message.debug_command_response(result={1: "bt\r\n#0  über ()\r\n"}),
+    ]
+    # rank keys keep their int type without any re-casting
+    decoded = Message.from_binary(responses[1].to_binary())
+    assert decoded == responses[1]
+    assert list(decoded.data["result"].keys()) == [1]
+
+    msg = Message.exchange_command_response(messages=responses)
+    assert Message.from_binary(msg.to_binary()) == msg
+
+    msg = Message("test", {"a": [1, 2.5, None, True, False], "b": {"c": "d"}, "e": {}})
+    assert Message.from_binary(msg.to_binary()) == msg
+
+
+def test_json_and_binary_agree() -> None:
+    msg = Message.mdb_command_request(
+        command="info frame", select=RankSet.parse("0-2,10-100000")
+    )
+    assert Message.decode(msg.encode("json"), "json") == msg
+    assert Message.decode(msg.encode("binary"), "binary") == msg
+
+
+def test_negotiate_wire_format(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.delenv("MDB_WIRE_FORMAT", raising=False)
+    assert negotiate_wire_format(["binary", "json"]) == "binary"
+    assert negotiate_wire_format(["json", "binary"]) == "json"
+    # older peers don't offer anything
+    assert negotiate_wire_format([]) == "json"
+
+    monkeypatch.setenv("MDB_WIRE_FORMAT", "json")
+    assert supported_wire_formats() == ["json"]
+    assert negotiate_wire_format(["binary", "json"]) == "json"
+
+    monkeypatch.setenv("MDB_WIRE_FORMAT", "xml")
+    with pytest.raises(ValueError):
+        supported_wire_formats()
+
+
+def test_exchange_command_response_groups_outputs() -> None:
+    responses = [
+        Message.debug_command_response(result={rank: "same"}) for rank in range(4)
+    ]
+    responses.append(Message.debug_command_response(result={4: "different"}))
+    # ranks arrive as strings when the debug client used json
+    responses.append(Message.from_json(responses[0].to_json()))
+
+    msg = Message.exchange_command_response(messages=responses)
+    assert msg.data["results"] == {
+        "same": RankSet.parse("0-3"),
+        "different": RankSet.parse("4"),
+    }
+
+
+def test_structured_values_are_grouped() -> None:
+    frames = json.dumps({"stack": [{"func": "main", "level": "0"}]})
+    responses = [
+        Message.debug_command_response(result={0: "bt"}, value={0: frames}),
+        Message.debug_command_response(result={1: "bt"}, value={1: frames}),
+        # backends without MI don't send values
+        Message.debug_command_response(result={2: "bt"}),
+    ]
+    assert "value" not in responses[2].data
+    relayed = Message.relay_command_response(messages=responses[:2])
+    msg = Message.exchange_command_response(
+        messages=[Message.from_binary(relayed.to_binary()), responses[2]]
+    )
+    assert msg.data["values"] == {frames: RankSet([0, 1])}
+    assert expand_values(msg.data["values"]) == {
+        0: {"stack": [{"func": "main", "level": "0"}]},
+        1: {"stack": [{"func": "main", "level": "0"}]},
+    }
+
+    msg = Message.exchange_command_response(messages=responses[2:])
+    assert "values" not in msg.data
+
+
+def test_batch_results_are_grouped_per_command() -> None:
+    responses = [
+        Message.debug_batch_response(
+            result=[{0: "b main"}, {0: "run"}], ranks=RankSet([0])
+        ),
+        # stopped after the first command
+        Message.debug_batch_response(result=[{1: "b main"}], ranks=RankSet([1, 2])),
+        # not selected by the first command
+        Message.debug_batch_response(result=[{}, {3: "run"}], ranks=RankSet([3])),
+    ]
+    relayed = Message.merged_response("debug_batch_response", responses[:2])
+    assert relayed.rank_count() == 3
+    msg = Message.merged_response(
+        "exchange_batch_response",
+        [Message.from_binary(relayed.to_binary()), responses[2]],
+    )
+    assert msg.data["results"] == [
+        {"b main": RankSet([0, 1])},
+        {"run": RankSet([0, 3])},
+    ]
+    assert msg.data["ranks"] == RankSet.parse("0-3")
+
+
+def test_timed_out_ranks_are_counted() -> None:
+    responses = [
+        Message.debug_command_response(result={0: "bt"}),
+        Message.missing_response("debug_command_response", RankSet([1, 2])),
+    ]
+    relayed = Message.relay_command_response(messages=responses)
+    assert relayed.rank_count() == 3
+    assert relayed.replied_ranks() == RankSet.parse("0-2")
+
+    msg = Message.exchange_command_response(
+        messages=[Message.from_json(relayed.to_json())]
+    )
+    assert msg.data["results"] == {"bt": RankSet([0])}
+    assert msg.data["timed_out"] == RankSet([1, 2])
+    assert "timed_out" not in Message.exchange_command_response(responses[:1]).data
+
+
+@pytest.mark.parametrize("request_type", FABRIC_REQUESTS)
+def test_fabric_replies_without_results_are_merged(request_type: str) -> None:
+    spec = FABRIC_REQUESTS[request_type]
+    replies = [
+        Message.interrupted_response(request_type, {0: "Interrupted: True"}),
+        Message.missing_response(spec.reply_type, RankSet([1]), "lost"),
+        Message.missing_response(spec.reply_type, RankSet([2])),
+    ]
+    assert all(reply.msg_type == spec.reply_type for reply in replies)
+    for wire_format in ("json", "binary"):
+        relayed = Message.decode(
+            Message.merged_response(spec.reply_type, replies[:2]).encode(wire_format),
+            wire_format,
+        )
+        msg = Message.merged_response(spec.response_type, [relayed, replies[2]])
+        assert msg.data["from"] == EXCHANGE
+        assert msg.data["ranks"] == RankSet([0])
+        assert msg.data["lost"] == RankSet([1])
+        assert msg.data["timed_out"] == RankSet([2])
+        assert msg.replied_ranks() == RankSet(range(3))
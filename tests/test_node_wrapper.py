@@ -0,0 +1,93 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import asyncio
+import os
+from pathlib import Path
+
+from mdb.async_connection import AsyncConnection
+from mdb.backend import backends
+from mdb.messages import Message
+from mdb.node_wrapper import (
+    elect_leader,
+    environment_commands,
+    follow_leader,
+    remove_stale_socket,
+)
+
+
+def test_only_one_leader_per_node(tmp_path: Path) -> None:
+    path = str(tmp_path / "node.sock")
+    leader = elect_leader(path)
+    assert leader is not None
+    assert elect_leader(path) is None
+    # no temporary sockets are left behind
+    assert os.listdir(tmp_path) == ["node.sock"]
+    leader.close()
+
+
+def test_follower_hands_rank_to_leader(tmp_path: Path) -> None:
+    path = str(tmp_path / "node.sock")
+    registered: list[Message] = []
+
+    async def main() -> None:
+        sock = elect_leader(path)
+        assert sock is not None
+
+        async def handle_follower(
+            reader: asyncio.StreamReader, writer: asyncio.StreamWriter
+        ) -> None:
+            registered.append(await AsyncConnection(reader, writer).recv_message())
+            # the follower waits until the leader goes away
+            writer.close()
+
+        server = await asyncio.start_unix_server(handle_follower, sock=sock)
+        assert await asyncio.wait_for(follow_leader(path, rank=3), timeout=5)
+        server.close()
+        await server.wait_closed()
+
+        # the socket file is still there but nobody is listening any more
+        assert not await follow_leader(path, rank=3)
+
+    asyncio.run(main())
+
+    assert registered[0].msg_type == "node_register"
+    assert registered[0].data["rank"] == 3
+    assert registered[0].data["env"] == dict(os.environ)
+    assert registered[0].data["cwd"] == os.getcwd()
+
+
+def test_only_stale_sockets_are_removed(tmp_path: Path) -> None:
+    path = str(tmp_path / "node.sock")
+    leader = elect_leader(path)
+    assert leader is not None
+    remove_stale_socket(path)
+    assert os.listdir(tmp_path) == ["node.sock"]
+
+    # the leader crashed without removing its socket
+    leader.close()
+    remove_stale_socket(path)
+    assert os.listdir(tmp_path) == []
+    # another follower got there first
+    remove_stale_socket(path)
+
+
+def test_environment_commands() -> None:
+    base_env = {"HOME": "/home/mdb", "OMPI_COMM_WORLD_RANK": "0", "LEADER": "1"}
+    env = {
+        "HOME": "/home/mdb",
+        "OMPI_COMM_WORLD_RANK": "3",
+        "PMIX_RANK": "3",
+        "FUNC": "() {\n echo\n}",
+    }
+    assert environment_commands(env, base_env) == [
+        "unset environment LEADER",
+        "set environment OMPI_COMM_WORLD_RANK=3",
+        "set environment PMIX_RANK=3",
+    ]
+    assert environment_commands(base_env, base_env) == []
+
+
+def test_multi_inferior_backends() -> None:
+    assert backends["gdb"]().multi_inferior
+    assert not backends["lldb"]().multi_inferior
@@ -0,0 +1,96 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import asyncio
+import shlex
+import sys
+
+import pytest
+
+from mdb.pty_process import PROMPT_WINDOW, PtyProcess
+
+# prints a prompt and then, for each line typed, that many lines of output
+FAKE_DEBUGGER = """
+import signal, sys
+signal.signal(signal.SIGINT, lambda *_: print("interrupted"))
+while True:
+    lines = int(input("(dbg) "))
+    sys.stdout.write("".join(f"line {i} of output\\n" for i in range(lines)))
+"""
+
+PROMPT = r"\(dbg\) "
+
+
+async def spawn() -> PtyProcess:
+    return await PtyProcess.spawn(f"{sys.executable} -c {shlex.quote(FAKE_DEBUGGER)}")
+
+
+def test_expect_returns_output_before_prompt() -> None:
+    async def main() -> None:
+        proc = await spawn()
+        assert await proc.expect(PROMPT) == ""
+        proc.sendline("2")
+        assert await proc.expect(PROMPT) == (
+            "2\r\nline 0 of output\r\nline 1 of output\r\n"
+        )
+        # output much larger than a single read and the prompt search window
+        proc.sendline("100000")
+        output = await proc.expect(PROMPT)
+        assert len(output) > 100 * PROMPT_WINDOW
+        assert output.endswith("line 99999 of output\r\n")
+        assert output.count("\r\n") == 100001
+
+        proc.sendintr()
+        proc.sendline("0")
+        assert "interrupted" in await proc.expect(PROMPT)
+
+        proc.sendline("quit")
+        output = await proc.expect(PROMPT, eof=True)
+        assert "ValueError" in output
+        assert proc.closed
+        with pytest.raises(EOFError):
+            await proc.expect(PROMPT)
+        assert await proc.wait() == 1
+
+    asyncio.run(main())
+
+
+def test_prompt_split_across_reads() -> None:
+    async def main() -> None:
+        proc = await spawn()
+        await proc.expect(PROMPT)
+        # pretend the prompt arrived in several pieces
+        proc.chunks = ["output\r\n(d", "bg", ") rest"]
+        assert await proc.expect(PROMPT) == "output\r\n"
+        assert proc.chunks == ["rest"]
+        proc.chunks = []
+        proc.sendline("quit")
+        await proc.expect(PROMPT, eof=True)
+        await proc.wait()
+
+    asyncio.run(main())
+
+
+def test_marked_lines_are_diverted() -> None:
+    async def main() -> None:
+        proc = await spawn()
+        await proc.expect(PROMPT)
+        diverted: list[str] = []
+        proc.divert_lines("@hit:", diverted.append)
+        # pretend a marked line arrived in several pieces between other output
+        kept = [
+            proc._divert(chunk)
+            for chunk in [
+                "Continuing.\r\n@h",
+                "it:1 i=",
+                "0\r\n@hit:1 i=1\r\n",
+                "(dbg) ",
+            ]
+        ]
+        assert "".join(kept) == "Continuing.\r\n(dbg) "
+        assert diverted == ["@hit:1 i=0", "@hit:1 i=1"]
+        proc.sendline("quit")
+        await proc.expect(PROMPT, eof=True)
+        await proc.wait()
+
+    asyncio.run(main())
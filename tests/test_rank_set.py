@@ -0,0 +1,57 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import random
+
+import pytest
+
+from mdb.rank_set import RankSet
+
+
+def test_parse_and_format() -> None:
+    ranks = RankSet.parse("7,0,1-4")
+    assert str(ranks) == "0-4,7"
+    assert ranks.ranges == [(0, 4), (7, 7)]
+    assert len(ranks) == 6
+    assert ranks.first() == 0
+
+    # adjacent and overlapping ranges are merged
+    assert str(RankSet.parse("0-3,4,2-6,9")) == "0-6,9"
+    assert str(RankSet([4, 3, 2, 2])) == "2-4"
+    assert str(RankSet()) == ""
+    assert not RankSet()
+
+    # huge ranges are never expanded
+    assert len(RankSet.parse("0-99999999")) == 100000000
+
+    for bad in ["", "a", "1-", "3-1", "1,,2"]:
+        with pytest.raises(ValueError):
+            RankSet.parse(bad)
+
+
+def test_membership() -> None:
+    ranks = RankSet.parse("0-511,513-1023,2000")
+    assert 0 in ranks
+    assert 511 in ranks
+    assert 512 not in ranks
+    assert 1023 in ranks
+    assert 1024 not in ranks
+    assert 2000 in ranks
+    assert -1 not in ranks
+    assert "0" not in ranks
+
+
+def test_set_algebra() -> None:
+    rng = random.Random(0)
+    for _ in range(200):
+        a = set(rng.sample(range(60), rng.randint(0, 40)))
+        b = set(rng.sample(range(60), rng.randint(0, 40)))
+        ra, rb = RankSet(a), RankSet(b)
+
+        assert set(ra | rb) == a | b
+        assert set(ra & rb) == a & b
+        assert set(ra - rb) == a - b
+        assert (ra <= rb) == (a <= b)
+        assert list(ra) == sorted(a)
+        assert RankSet(ra | rb) == ra | rb
+        assert hash(RankSet(a)) == hash(ra)
@@ -0,0 +1,59 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+from mdb.messages import Message
+from mdb.rank_set import RankSet
+from mdb.reduction import (
+    combine_reductions,
+    empty_reduction,
+    histogram_bin,
+    partial_reduction,
+)
+
+VALUES = {0: 3.0, 1: -1.0, 2: 7.0, 3: -1.0, 4: 7.0, 5: 0.5}
+
+
+def test_partial_reduction() -> None:
+    reduction = partial_reduction(VALUES, histogram=(4, -1.0, 7.0))
+    assert reduction["count"] == 6
+    assert reduction["sum"] == 15.5
+    # ties go to the lowest rank
+    assert (reduction["min"], reduction["min_rank"]) == (-1.0, 1)
+    assert (reduction["max"], reduction["max_rank"]) == (7.0, 2)
+    assert reduction["bins"] == [3, 0, 1, 2]
+
+
+def test_combine_reductions() -> None:
+    # any split of the ranks combines into the same reduction, including
+    # ranks without any values
+    splits: list[set[int]] = [{0, 1, 2}, {3, 4, 5}, {1, 4}, set()]
+    for split in splits:
+        parts = [
+            partial_reduction(
+                {r: v for r, v in VALUES.items() if (r in split) == inside},
+                histogram=(4, -1.0, 7.0),
+            )
+            for inside in (True, False)
+        ]
+        combined = combine_reductions(parts + [empty_reduction()])
+        assert combined == partial_reduction(VALUES, histogram=(4, -1.0, 7.0))
+
+
+def test_histogram_bin() -> None:
+    assert histogram_bin(-5.0, 4, 0.0, 8.0) == 0
+    assert histogram_bin(4.0, 4, 0.0, 8.0) == 2
+    assert histogram_bin(8.0, 4, 0.0, 8.0) == 3
+    # all values are the same
+    assert histogram_bin(1.0, 4, 1.0, 1.0) == 0
+
+
+def test_reductions_survive_the_wire() -> None:
+    msg = Message.debug_reduce_response(
+        reduction=partial_reduction(VALUES),
+        failed=RankSet([6]),
+        ranks=RankSet(range(7)),
+    )
+    for wire_format in ("json", "binary"):
+        decoded = Message.decode(msg.encode(wire_format), wire_format)
+        assert decoded.data["reduction"] == msg.data["reduction"]
+        assert decoded.replied_ranks() == RankSet(range(7))
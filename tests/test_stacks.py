@@ -0,0 +1,139 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import json
+
+from mdb.backend import backends
+from mdb.messages import Message
+from mdb.rank_set import RankSet
+from mdb.stacks import (
+    OTHER_STACKS,
+    ELIDED_FRAMES,
+    MAX_TREE_DEPTH,
+    build_tree,
+    clip_stack,
+    folded_lines,
+    merge_profiles,
+    merge_trees,
+    parse_backtrace,
+    render_tree,
+    tree_to_dot,
+    tree_to_json,
+)
+
+STACKS: dict[int, list[str]] = {
+    0: ["main", "solve", "MPI_Barrier"],
+    1: ["main", "solve", "compute"],
+    2: ["main", "solve", "MPI_Barrier"],
+    3: [],
+}
+
+
+def test_parse_gdb_backtrace() -> None:
+    output = (
+        "bt\r\n"
+        "#0  0x00007ffff7e4a3bf in MPI_Barrier (comm=0) at barrier.c:10\r\n"
+        "#1  <signal handler called>\r\n"
+        "#2  solve<double> (x=1) at solve.cpp:3\r\n"
+        "#3  0x0000555555555189 in main () at main.c:5\r\n"
+    )
+    frame_regex = backends["gdb"]().frame_regex
+    assert frame_regex is not None
+    assert parse_backtrace(output, frame_regex) == [
+        "main",
+        "solve<double>",
+        "MPI_Barrier",
+    ]
+
+
+def test_parse_lldb_backtrace() -> None:
+    output = (
+        "bt\r\n"
+        "* thread #1, name = 'a.out', stop reason = signal SIGSTOP\r\n"
+        "  * frame #0: 0x00007ffff7e4a3bf libmpi.so`MPI_Barrier + 15\r\n"
+        "    frame #1: 0x0000555555555189 a.out`main at main.c:5:3\r\n"
+    )
+    frame_regex = backends["lldb"]().frame_regex
+    assert frame_regex is not None
+    assert parse_backtrace(output, frame_regex) == ["main", "MPI_Barrier"]
+
+
+def test_build_tree() -> None:
+    tree = build_tree(STACKS)
+    assert tree["ranks"] == RankSet(range(4))
+    main = tree["children"]["main"]
+    assert main["ranks"] == RankSet([0, 1, 2])
+    solve = main["children"]["solve"]
+    assert solve["children"]["MPI_Barrier"]["ranks"] == RankSet([0, 2])
+    assert solve["children"]["compute"]["ranks"] == RankSet([1])
+
+
+def test_merge_trees() -> None:
+    # any split of the ranks merges back into the same tree
+    halves = [
+        build_tree({rank: STACKS[rank] for rank in (0, 3)}),
+        build_tree({rank: STACKS[rank] for rank in (1, 2)}),
+    ]
+    assert merge_trees(halves) == build_tree(STACKS)
+    assert merge_trees([]) == build_tree({})
+
+
+def test_render_tree() -> None:
+    assert render_tree(build_tree(STACKS)) == [
+        "[3] <no stack>",
+        "[0-2] main",
+        "  [0-2] solve",
+        "    [0,2] MPI_Barrier",
+        "    [1] compute",
+    ]
+
+
+def test_export_tree() -> None:
+    tree = build_tree(STACKS)
+    dot = tree_to_dot(tree)
+    assert dot.startswith("digraph stacks {")
+    assert '"MPI_Barrier\\n[0,2]"' in dot
+    assert dot.count("->") == 3
+
+    exported = json.loads(tree_to_json(tree))
+    solve = exported["children"]["main"]["children"]["solve"]
+    assert solve["children"]["compute"] == {"ranks": "1", "children": {}}
+
+
+def test_merge_profiles() -> None:
+    profiles = [{"main;a": 3, "main;b": 1}, {"main;a": 1, "main;c": 2}]
+    assert merge_profiles(profiles) == {"main;a": 4, "main;c": 2, "main;b": 1}
+    # the least common stacks are counted together
+    assert merge_profiles(profiles, max_stacks=2) == {"main;a": 4, OTHER_STACKS: 3}
+    assert folded_lines({"main;a": 4}, prefix="rank 3") == ["rank 3;main;a 4"]
+
+
+def test_trees_survive_the_wire() -> None:
+    msg = Message.debug_stacks_response(
+        tree=build_tree(STACKS), ranks=RankSet(range(4))
+    )
+    for wire_format in ("json", "binary"):
+        decoded = Message.decode(msg.encode(wire_format), wire_format)
+        assert decoded.data["tree"] == msg.data["tree"]
+        assert decoded.replied_ranks() == RankSet(range(4))
+
+
+def test_deep_stacks_are_clipped() -> None:
+    frames = ["main"] + [f"f{i}" for i in range(5000)] + ["MPI_Wait"]
+    clipped = clip_stack(frames)
+    assert len(clipped) == MAX_TREE_DEPTH
+    assert clipped[:2] == ["main", "f0"]
+    assert clipped[-2:] == ["f4999", "MPI_Wait"]
+    assert ELIDED_FRAMES in clipped
+    assert clip_stack(STACKS[0]) == STACKS[0]
+
+    # deep recursion can be merged, rendered and sent over the wire
+    tree = merge_trees([build_tree({0: frames}), build_tree({1: frames[:-1]})])
+    lines = render_tree(tree)
+    depths = [(len(line) - len(line.lstrip())) // 2 + 1 for line in lines]
+    assert max(depths) == MAX_TREE_DEPTH
+    assert any(line.endswith("[0] MPI_Wait") for line in lines)
+    msg = Message.debug_stacks_response(tree=tree, ranks=RankSet(range(2)))
+    for wire_format in ("json", "binary"):
+        decoded = Message.decode(msg.encode(wire_format), wire_format)
+        assert decoded.data["tree"] == tree
@@ -0,0 +1,39 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import subprocess
+import sys
+
+import pytest
+
+# modules that are slow to import and aren't needed to run each subcommand
+HEAVY_MODULES = ["matplotlib", "numpy"]
+
+
+def imported_modules(command: str) -> set[str]:
+    """Return the modules imported when mdb looks up `command`."""
+    code = (
+        "import sys\n"
+        "import click\n"
+        "from mdb.mdb import main\n"
+        f"main.get_command(click.Context(main), {command!r})\n"
+        "print('\\n'.join(sys.modules))\n"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    return set(proc.stdout.split())
+
+
+@pytest.mark.parametrize("command", ["wrapper", "launch", "relay", "attach"])
+def test_subcommands_do_not_import_plotting_libraries(command: str) -> None:
+    modules = {name.split(".")[0] for name in imported_modules(command)}
+    assert "mdb" in modules
+    for module in HEAVY_MODULES:
+        assert module not in modules
+
+
+def test_wrapper_does_not_import_other_subcommands() -> None:
+    modules = imported_modules("wrapper")
+    assert "mdb.mdb_wrapper" in modules
+    assert not {"mdb.mdb_attach", "mdb.mdb_shell", "mdb.mdb_launch"} & modules
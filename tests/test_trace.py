@@ -0,0 +1,51 @@
+# Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
+# details.
+
+import pytest
+
+from mdb.trace import (
+    TRACE_MARKER,
+    TraceBuffer,
+    dprintf_command,
+    inferior_probe,
+    split_inferior,
+    trace_buffer_size,
+)
+
+
+def test_dprintf_command() -> None:
+    assert dprintf_command(3, 'solver.c:42,"i=%d x=%f",i,x') == (
+        f'dprintf solver.c:42,"{TRACE_MARKER}3 i=%d x=%f\\n",i,x'
+    )
+    # escaped quotes stay in the format and a line break isn't added twice
+    assert dprintf_command(1, r'main , "say \"%s\"\n", s') == (
+        rf'dprintf main,"{TRACE_MARKER}1 say \"%s\"\n", s'
+    )
+    with pytest.raises(ValueError):
+        dprintf_command(1, "solver.c:42 i")
+
+
+def test_inferior_probe() -> None:
+    command = dprintf_command(3, 'solver.c:42,"i=%d x=%f",i,x')
+    assert inferior_probe(command) == (
+        f'dprintf solver.c:42,"{TRACE_MARKER}%d:3 i=%d x=%f\\n",$_inferior,i,x'
+    )
+    assert inferior_probe(r'dprintf main,"say \"%s\"\n", s') is None
+    assert inferior_probe("print x") is None
+    assert split_inferior("2:3 i=1 x=0.5") == (2, "3 i=1 x=0.5")
+
+
+def test_trace_buffer_keeps_latest_hits() -> None:
+    buffer = TraceBuffer(size=3)
+    for i in range(5):
+        buffer.append(f"1 i={i}")
+    assert buffer.drain() == (["1 i=2", "1 i=3", "1 i=4"], 2)
+    assert buffer.drain() == ([], 0)
+
+
+def test_trace_buffer_size(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("MDB_TRACE_BUFFER", "50")
+    assert trace_buffer_size() == 50
+    monkeypatch.setenv("MDB_TRACE_BUFFER", "0")
+    with pytest.raises(ValueError):
+        trace_buffer_size()
@@ -1,21 +1,74 @@
 # Copyright 2023-2026 Tom Meltzer. See the top-level COPYRIGHT file for
 # details.
 
-from mdb.utils import parse_ranks, strip_bracketted_paste, strip_control_characters
+import pytest
+
+from mdb.backend import backends
+from mdb.rank_set import RankSet
+from mdb.utils import (
+    expand_results,
+    extract_truth,
+    format_ranks,
+    group_results,
+    is_local_host,
+    merge_results,
+    parse_ranks,
+    sort_debug_response,
+    strip_bracketted_paste,
+    strip_control_characters,
+)
 
 
 def test_parse_ranks() -> None:
     input_str = "0,1-4,7"
     ranks = parse_ranks(input_str)
-    assert ranks == [0, 1, 2, 3, 4, 7]
+    assert list(ranks) == [0, 1, 2, 3, 4, 7]
 
     input_str = "8"
     ranks = parse_ranks(input_str)
-    assert ranks == [8]
+    assert list(ranks) == [8]
 
     input_str = "4,3,2"
     ranks = parse_ranks(input_str)
-    assert ranks == [2, 3, 4]
+    assert list(ranks) == [2, 3, 4]
+
+    with pytest.raises(ValueError):
+        parse_ranks("0,a")
+
+
+def test_format_ranks() -> None:
+    assert format_ranks([0, 1, 2, 3, 4, 7]) == "0-4,7"
+    assert format_ranks([8]) == "8"
+    assert format_ranks([4, 3, 2, 2]) == "2-4"
+    assert format_ranks([]) == ""
+    assert list(parse_ranks(format_ranks(range(0, 100, 3)))) == list(range(0, 100, 3))
+
+
+def test_group_results() -> None:
+    results = {1: "a", 0: "a", 2: "b", 3: "a"}
+    grouped = group_results(results)
+    assert grouped == {"a": RankSet([0, 1, 3]), "b": RankSet([2])}
+    assert expand_results(grouped) == dict(sorted(results.items()))
+
+    unsorted = {
+        "b": RankSet.parse("5-6"),
+        "a": RankSet.parse("2,7"),
+        "c": RankSet.parse("10"),
+    }
+    assert list(sort_debug_response(unsorted)) == ["a", "b", "c"]
+
+    merged = merge_results([{"a": RankSet.parse("0-3")}, {"a": RankSet.parse("4")}])
+    assert merged == {"a": RankSet.parse("0-4")}
+
+
+def test_extract_truth() -> None:
+    gdb = backends["gdb"]()
+    assert extract_truth("p ierr != 0\r\n$1 = 1\r\n", gdb) is True
+    assert extract_truth("p ierr\r\n$2 = 0\r\n", gdb) is False
+    assert extract_truth("p x\r\n$3 = -0.5\r\n", gdb) is True
+    assert extract_truth("p converged\r\n$4 = .FALSE.\r\n", gdb) is False
+    assert extract_truth("p converged\r\n$5 = true\r\n", gdb) is True
+    assert extract_truth('p y\r\nNo symbol "y" in current context.\r\n', gdb) is None
 
 
 def test_strip_functions() -> None:
@@ -26,3 +79,11 @@ def test_strip_functions() -> None:
     ans = "bt\r\n#0  simple () at simple-mpi.f90:1\r\n"
 
     assert text == ans
+
+
+def test_is_local_host() -> None:
+    assert is_local_host("localhost")
+    assert is_local_host("127.0.0.1")
+    # TEST-NET-1 addresses are never assigned to a real machine
+    assert not is_local_host("192.0.2.1")
+    assert not is_local_host("no-such-host.invalid")